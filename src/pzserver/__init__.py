@@ -1,13 +1,20 @@
 """
 PzServer: responsible for managing user interactions with the Pz Server app
+AsyncPzServer: asyncio counterpart of PzServer
+ProductCache: persistent cache of downloaded product files
 Catalog:
 SpeczCatalog:
 TrainingSet:
+UploadError: raised when some files of an upload could not be sent
+ColumnsAssociationError: raised when some column associations could not be updated
 """
 
+from .async_core import AsyncPzServer
 from .catalog import Catalog, SpeczCatalog, TrainingSet
 from .core import PzServer
 from .pipeline import Pipeline
+from .product_cache import ProductCache
+from .upload import ColumnsAssociationError, UploadError
 
 # Import version information
 try:
@@ -0,0 +1,397 @@
+"""
+Helpers shared by the synchronous and asynchronous clients of the
+Pz Server API
+"""
+
+import re
+from email.message import Message
+
+import requests
+
+from .retry import RetryPolicy
+
+ENVIRONMENTS = {
+    "localhost": "http://localhost/api/",
+    "pz-dev": "https://pzserver-dev.linea.org.br/api/",
+    "pz": "https://pzserver.linea.org.br/api/",
+}
+
+# user filter names that the API knows by another name
+MAPPING_FILTERS = {
+    "product_type": "product_type_name",
+    "product_type__or": "product_type_name__or",
+    "release": "release_name",
+    "release__or": "release_name__or",
+}
+
+MAX_POLL_INTERVAL = 30
+POLL_BACKOFF = 1.5
+
+
+def validate_filters(filter_opt, filters):
+    """
+    Checks if the filters are accepted by the endpoint options.
+
+    Args:
+        filter_opt (dict): endpoint options (filters, search and ordering)
+        filters (list): selected filters
+    """
+
+    api_params = []
+
+    # adds the filter_classes as acceptable attributes on the endpoint
+    # for filtering entries.
+    for filter_class in filter_opt.get("filter_classes", []):
+        api_params.append(filter_class["name"])
+
+    # adds the filterset_fields as acceptable attributes on the endpoint
+    # for filtering entries.
+    for filter_name in filter_opt.get("filterset", []):
+        api_params.append(filter_name)
+
+    # add search with acceptable parameters if configured.
+    if "search" in filter_opt:
+        api_params.append("search")
+
+    for uitem in filters:
+        item = MAPPING_FILTERS.get(uitem, uitem)
+        if not item in api_params:
+            lib_params = _reverse_filters(api_params)
+            raise ValueError(
+                "Invalid filter key was detected.\n"
+                "Valid filter keys are:\n  - {}".format("\n  - ".join(lib_params))
+            )
+
+
+def _reverse_filters(api_params) -> list:
+    """
+    Reverts filter mapping
+
+    Args:
+        api_params (list): available filters
+
+    Returns:
+        list: filters matching
+    """
+
+    def check_filter(filter_name):
+        """
+        Check filter name
+
+        Args:
+            filter_name (str): filter name
+
+        Returns:
+            list: filter names
+        """
+
+        for key, value in MAPPING_FILTERS.items():
+            if filter_name == value:
+                return key
+        return filter_name
+
+    return list(set(map(check_filter, api_params)))
+
+
+def filters_params(filters) -> dict:
+    """
+    Converts user filters to API query params.
+
+    Args:
+        filters (dict): filters   ex: {'release': 'LSST'}
+
+    Returns:
+        dict: query params
+    """
+
+    params = {}
+
+    for key, value in filters.items():
+        value = list(map(str, value)) if isinstance(value, list) else [str(value)]
+        key = MAPPING_FILTERS.get(key, key)
+        params[key] = ",".join(value)
+
+    return params
+
+
+def page_params(ordering=None, page_size=None) -> dict:
+    """
+    Query params of the first page of a paginated listing.
+
+    Args:
+        ordering (None or str): column name to be ordered
+        page_size (int, optional): number of records requested per page.
+
+    Returns:
+        dict: query params
+    """
+
+    params = {}
+
+    if ordering:
+        params["ordering"] = ordering
+
+    if page_size:
+        params["page_size"] = page_size
+
+    return params
+
+
+def response_data(api_response) -> dict:
+    """
+    Checks for possible HTTP errors in the response.
+
+    Args:
+        api_response: response object (requests.Response or
+            AsyncResponse)
+
+    Returns:
+        dict: response content.
+    """
+
+    status_code = api_response.status_code
+
+    data = {
+        "status_code": status_code,
+        "message": str(),
+        "data": str(),
+        "response_object": api_response,
+    }
+
+    if 200 <= status_code < 300:
+        content_type = api_response.headers.get("content-type", "")
+        data.update({"success": True, "message": "Request completed"})
+        if status_code != 204 and content_type.strip().startswith("application/json"):
+            data.update({"data": api_response.json()})
+    else:
+        data.update({"success": False, "message": api_response.text})
+
+    return data
+
+
+def raise_for_failure(data):
+    """
+    Raises the message of a failed response dict.
+
+    Args:
+        data (dict): response content
+    """
+
+    if "success" in data and data["success"] is False:
+        raise requests.exceptions.RequestException(data["message"])
+
+
+def unique_result(data):
+    """
+    Returns the only record of a listing filtered by a unique attribute.
+
+    Args:
+        data (dict): paginated listing
+
+    Returns:
+        dict: record or None when nothing was found
+    """
+
+    nobj = data.get("count")
+    if nobj > 1:
+        raise requests.exceptions.RequestException(
+            f"The return should be unique [return = {nobj} objects]"
+        )
+
+    result = data.get("results")
+    return result[0] if result else None
+
+
+def main_file_info_from_data(data) -> dict:
+    """
+    Splits the associated columns of the main file info into the
+    list of column names, the list of associated columns and the
+    registered column types (when the server sends them).
+
+    Args:
+        data (dict): main file info returned by the API
+
+    Returns:
+        dict: main file info
+    """
+
+    if data.get("associated_columns", None):
+        columns = []
+        assoc_cols = []
+        column_types = {}
+        for col in data.get("associated_columns"):
+            columns.append(col.get("column_name"))
+
+            if col.get("alias", None):
+                assoc_cols.append(col)
+
+            if col.get("dtype", None):
+                column_types[col.get("column_name")] = col.get("dtype")
+
+        data["columns"] = columns
+        data["columns_association"] = assoc_cols
+        data["column_types"] = column_types
+        del data["associated_columns"]
+
+    return data
+
+
+def poll_hint(archive):
+    """
+    Seconds suggested by the server before the next status check, from
+    the "retry_after" (or Retry-After header) or "poll_interval" fields
+    of the archive status.
+
+    Args:
+        archive (dict): archive status
+
+    Returns:
+        float: seconds or None when the server gave no hint
+    """
+
+    if not isinstance(archive, dict):
+        return None
+
+    for key in ("retry_after", "poll_interval"):
+        if archive.get(key) is not None:
+            return RetryPolicy.parse_retry_after(archive[key])
+
+    return None
+
+
+def next_poll_interval(interval, archive, max_interval, backoff=POLL_BACKOFF):
+    """
+    Seconds to wait before the next status check of an archive: the
+    server hint when there is one, otherwise the previous interval
+    grown exponentially, both limited to max_interval.
+
+    Args:
+        interval (float): previous interval
+        archive (dict): last archive status
+        max_interval (float): maximum interval
+        backoff (float, optional): growth factor of the interval.
+            Defaults to 1.5.
+
+    Returns:
+        float: interval in seconds
+    """
+
+    hint = poll_hint(archive)
+    if hint is None:
+        hint = interval * backoff
+    return min(hint, max_interval)
+
+
+def check_download_archive(archive, download_name):
+    """
+    Checks that a prepared download archive is ready to be fetched.
+
+    Args:
+        archive (dict): archive status returned by the API
+        download_name (str): name used in error messages
+
+    Returns:
+        dict: archive status
+    """
+
+    if archive and archive.get("status") == "failed":
+        raise requests.exceptions.RequestException(
+            archive.get("error_message") or f"Failed to prepare {download_name}."
+        )
+
+    if not archive or archive.get("status") != "ready":
+        raise requests.exceptions.RequestException(
+            f"{download_name} archive is not ready."
+        )
+
+    download_url = archive.get("download_url")
+    if not download_url:
+        raise requests.exceptions.RequestException(
+            f"{download_name} archive is ready but no download URL was returned."
+        )
+
+    return archive
+
+
+def filename_from_content_disposition(content_disposition):
+    """
+    File name sent in a Content-Disposition header.
+
+    Args:
+        content_disposition (str): header value
+
+    Returns:
+        str: file name ("download" when the header has none)
+    """
+
+    message = Message()
+    message["content-disposition"] = content_disposition or ""
+    filename = message.get_filename()
+    if filename:
+        return filename
+
+    return "download"
+
+
+def download_total_size(response, fallback_size=None):
+    """
+    Size of the whole file served by a (possibly partial) response.
+
+    Args:
+        response: response object
+        fallback_size (int, optional): bytes already downloaded, used
+            when the server does not send the total size.
+
+    Returns:
+        int: size in bytes or None when unknown
+    """
+
+    content_range = response.headers.get("Content-Range", "")
+    match = re.match(r"bytes \d+-\d+/(\d+)$", content_range)
+    if match:
+        return int(match.group(1))
+
+    content_length = response.headers.get("Content-Length")
+    if content_length is None:
+        return fallback_size
+
+    content_length = int(content_length)
+    if response.status_code == 206 and fallback_size is not None:
+        return fallback_size + content_length
+    return content_length
+
+
+def download_destination(save_dir, headers):
+    """
+    Paths where a download is written: the file named by the
+    Content-Disposition header and the ".part" file it is streamed to.
+
+    Args:
+        save_dir (pathlib.Path): location where the file will be saved
+        headers (dict): response headers
+
+    Returns:
+        tuple: destination and partial destination
+    """
+
+    filename = filename_from_content_disposition(
+        headers.get("Content-Disposition", "")
+    )
+    destination = save_dir / filename
+    return destination, destination.with_name(f"{destination.name}.part")
+
+
+def partial_size(partial_destination):
+    """
+    Size of a partial download, the offset from which it resumes.
+
+    Args:
+        partial_destination (pathlib.Path): ".part" file or None
+
+    Returns:
+        int: size in bytes or None when there is no partial file
+    """
+
+    if partial_destination and partial_destination.exists():
+        return partial_destination.stat().st_size
+    return None
@@ -0,0 +1,813 @@
+"""
+Asynchronous classes to communicate with the Pz Server app
+"""
+
+import asyncio
+import contextlib
+import importlib
+import itertools
+import json
+import pathlib
+import time
+from urllib.parse import urlencode, urljoin
+
+import requests
+from urllib3 import encode_multipart_formdata
+
+from .api_common import (ENVIRONMENTS, MAPPING_FILTERS, MAX_POLL_INTERVAL,
+                         check_download_archive, download_destination,
+                         download_total_size, filters_params,
+                         main_file_info_from_data, next_poll_interval,
+                         page_params, partial_size, poll_hint,
+                         raise_for_failure, response_data, unique_result,
+                         validate_filters)
+from .instrumentation import RequestEvents, endpoint_template
+from .retry import RetryPolicy
+
+
+def _import_aiohttp():
+    try:
+        return importlib.import_module("aiohttp")
+    except ImportError as exc:
+        raise ImportError(
+            "AsyncPzServer requires the optional dependency 'aiohttp'. "
+            "Install it with 'pip install pzserver[async]' and try again."
+        ) from exc
+
+
+@contextlib.contextmanager
+def _connection_errors():
+    """
+    Raises the aiohttp client errors as the builtin connection errors
+    (timeouts are already TimeoutError).
+    """
+
+    aiohttp = _import_aiohttp()
+    try:
+        yield
+    except aiohttp.ClientError as error:
+        if isinstance(error, TimeoutError):
+            raise
+        if isinstance(getattr(error, "os_error", None), ConnectionRefusedError):
+            raise ConnectionRefusedError(str(error)) from error
+        raise ConnectionError(str(error)) from error
+
+
+class AsyncResponse:
+    """
+    Response returned by AsyncHTTPClient.
+    """
+
+    def __init__(self, response):
+        self.status_code = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.content = b""
+        self._response = response
+
+    @property
+    def text(self) -> str:
+        """Response body decoded as text."""
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        """Response body decoded as JSON."""
+        return json.loads(self.content)
+
+    async def iter_chunks(self, chunk_size=1024 * 1024):
+        """
+        Iterates over the response body as it is received.
+
+        Args:
+            chunk_size (int): maximum size of each chunk in bytes.
+
+        Yields:
+            bytes: body chunk
+        """
+
+        try:
+            with _connection_errors():
+                async for chunk in self._response.content.iter_chunked(chunk_size):
+                    yield chunk
+        finally:
+            self.release()
+
+    async def read(self) -> bytes:
+        """
+        Reads the whole response body.
+
+        Returns:
+            bytes: response body
+        """
+
+        chunks = [chunk async for chunk in self.iter_chunks()]
+        self.content = b"".join(chunks)
+        return self.content
+
+    def release(self):
+        """
+        Gives the connection back to the client pool (it is closed when
+        the body was not read to the end).
+        """
+
+        self._response.release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class AsyncHTTPClient:
+    """
+    HTTP client built on aiohttp (installed with the "async" extra).
+
+    Bounds both the number of requests in flight and the number of
+    connections opened to each host. Redirects are followed and the
+    proxies of the environment (HTTP_PROXY, HTTPS_PROXY) are used.
+
+    The session is bound to the event loop that created it, so a new
+    one is opened when the client is used from another loop (e.g. a
+    second asyncio.run).
+    """
+
+    def __init__(self, max_concurrency=100, max_connections_per_host=20, timeout=300):
+        """
+        Initializes the client.
+
+        Args:
+            max_concurrency (int): maximum number of requests in flight.
+            max_connections_per_host (int): maximum open connections per host.
+            timeout (float): seconds to wait for a connection, for the
+                response headers or for each read of the response body.
+        """
+
+        self._aiohttp = _import_aiohttp()
+        self.max_concurrency = max_concurrency
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+        self._session = None
+        self._loop = None
+
+    def _current_session(self):
+        loop = asyncio.get_running_loop()
+
+        if self._session is not None and self._loop is not loop:
+            # the connections of another loop cannot be used (nor closed)
+            # from this one
+            self._session.detach()
+            self._session = None
+
+        if self._session is None or self._session.closed:
+            aiohttp = self._aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_concurrency,
+                    limit_per_host=self.max_connections_per_host,
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    connect=self.timeout, sock_read=self.timeout
+                ),
+                # downloads are written as sent, so they are not compressed
+                skip_auto_headers=("Accept-Encoding",),
+                trust_env=True,
+            )
+            self._loop = loop
+
+        return self._session
+
+    async def request(  # pylint: disable=too-many-arguments
+        self, method, url, *, params=None, headers=None, body=None, stream=False
+    ) -> AsyncResponse:
+        """
+        Sends a request.
+
+        Args:
+            method (str): HTTP method.
+            url (str): absolute url.
+            params (dict, optional): query params.
+            headers (dict, optional): request headers.
+            body (bytes, optional): request body.
+            stream (bool): when True the body is not read; the caller must
+                consume it with iter_chunks() or call release().
+
+        Returns:
+            AsyncResponse: response
+        """
+
+        if params:
+            url += ("&" if "?" in url else "?") + urlencode(params, doseq=True)
+
+        session = self._current_session()
+        with _connection_errors():
+            response = AsyncResponse(
+                await session.request(method, url, headers=headers, data=body)
+            )
+
+        if not stream:
+            await response.read()
+
+        return response
+
+    async def close(self):
+        """Closes the connections kept open."""
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+# pylint: disable=too-many-public-methods
+class AsyncPzRequests:
+    """
+    Responsible for managing asynchronous requests to the Pz Server app.
+
+    Mirrors the read, download and process methods of PzRequests as
+    coroutines, so a single event loop can drive many requests at once.
+    """
+
+    _token = None
+    _base_api_url = None
+    _client = None
+    _retry_policy = RetryPolicy()
+    _filter_options = {}
+    _mapping_filters = MAPPING_FILTERS
+    _enviroments = ENVIRONMENTS
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        token,
+        host="pz",
+        *,
+        max_concurrency=100,
+        max_connections_per_host=20,
+        timeout=300,
+        retry_policy=None,
+    ):
+        """
+        Initializes asynchronous communication with the Pz Server app.
+
+        The token is checked by open() (or when entering the async
+        context manager).
+
+        Args:
+            token (str): token to access the API.
+            host (str, optional): host key. Defaults to "pz".
+            max_concurrency (int, optional): maximum number of requests in
+                flight. Defaults to 100.
+            max_connections_per_host (int, optional): maximum number of
+                connections opened to the server. Defaults to 20.
+            timeout (float, optional): seconds to wait for a connection,
+                for the response headers or for each read of the response
+                body. Defaults to 300.
+            retry_policy (RetryPolicy, optional): policy used to retry
+                transient failures. Defaults to RetryPolicy().
+        """
+
+        self._base_api_url = self._enviroments.get(host, host)
+        self._token = token
+        self._filter_options = {}
+        self._retry_policy = retry_policy or RetryPolicy()
+        self.events = RequestEvents()
+        self._client = AsyncHTTPClient(
+            max_concurrency=max_concurrency,
+            max_connections_per_host=max_connections_per_host,
+            timeout=timeout,
+        )
+
+    async def open(self):
+        """
+        Checks if the token is valid.
+
+        Returns:
+            AsyncPzRequests: self
+        """
+
+        cntxt = await self._get_request(self._base_api_url)
+
+        if not cntxt.get("success", True):
+            stcode = cntxt.get("status_code")
+            msg = cntxt.get("message", "Unforeseen error")
+            raise requests.exceptions.RequestException(f"Status code {stcode}: {msg}")
+
+        return self
+
+    async def close(self):
+        """Closes the connections kept open to the server."""
+        await self._client.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _headers(self, **extra) -> dict:
+        return {"Authorization": f"Token {self._token}", **extra}
+
+    _check_response = staticmethod(response_data)
+
+    async def _send_request(  # pylint: disable=too-many-arguments,too-many-locals
+        self, method, url, *, params=None, headers=None, body=None, stream=False
+    ) -> dict:
+        """
+        Sends a request and converts the response to the PzRequests
+        response dict.
+
+        Returns:
+            dict: response content
+        """
+
+        started_at = time.perf_counter()
+        policy = self._retry_policy
+        data = {"success": False, "message": "", "response_object": None}
+
+        for attempt in itertools.count(1):
+            data["retries"] = attempt - 1
+            try:
+                api_response = await self._client.request(
+                    method, url, params=params, headers=headers, body=body, stream=stream
+                )
+            except OSError as error:
+                # a refused connection never reached the server
+                retryable = policy.is_idempotent(method) or isinstance(
+                    error, ConnectionRefusedError
+                )
+                if retryable and attempt < policy.max_attempts:
+                    await asyncio.sleep(policy.delay(attempt))
+                    continue
+
+                kind = "Timeout" if isinstance(error, TimeoutError) else "Connection"
+                data.update({"success": False, "message": f"{kind} Error: {error}"})
+                break
+
+            if policy.should_retry_status(method, api_response.status_code, attempt):
+                api_response.release()
+                retry_after = api_response.headers.get("Retry-After")
+                await asyncio.sleep(policy.delay(attempt, retry_after))
+                continue
+
+            if stream and not 200 <= api_response.status_code < 300:
+                await api_response.read()
+            data.update(self._check_response(api_response))
+            break
+
+        if self.events:
+            response = data.get("response_object")
+            self.events.emit(
+                {
+                    "kind": "request",
+                    "method": method,
+                    "url": url,
+                    "endpoint": endpoint_template(url, self._base_api_url),
+                    "status_code": data.get("status_code"),
+                    "success": data.get("success", False),
+                    "duration": time.perf_counter() - started_at,
+                    "request_bytes": len(body or b""),
+                    "response_bytes": (
+                        len(response.content) if response and not stream else None
+                    ),
+                    "retries": data["retries"],
+                }
+            )
+
+        return data
+
+    async def _get_request(self, url, params=None) -> dict:
+        return await self._send_request(
+            "GET",
+            url,
+            params=params,
+            headers=self._headers(Accept="application/json"),
+        )
+
+    async def _options_request(self, url) -> dict:
+        return await self._send_request(
+            "OPTIONS", url, headers=self._headers(Accept="application/json")
+        )
+
+    async def _post_request(self, url, payload, files=None) -> dict:
+        headers = self._headers(Accept="application/json")
+
+        if files:
+            fields = dict(payload or {})
+            for key, value in files.items():
+                if hasattr(value, "read"):
+                    value = (pathlib.Path(value.name).name, value.read())
+                fields[key] = value
+            body, content_type = encode_multipart_formdata(fields)
+        elif payload is not None:
+            body, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+        else:
+            body, content_type = b"", None
+
+        if content_type:
+            headers["Content-Type"] = content_type
+        return await self._send_request("POST", url, headers=headers, body=body)
+
+    _raise_for_failure = staticmethod(raise_for_failure)
+
+    async def _iter_pages(self, url, params=None):
+        """
+        Iterates over the records of a paginated endpoint, fetching the
+        next page while the current one is consumed.
+        """
+
+        resp = await self._get_request(url, params=params)
+        next_page = None
+
+        try:
+            while True:
+                raise_for_failure(resp)
+                page = resp.get("data")
+
+                if not isinstance(page, dict):
+                    for record in page or []:
+                        yield record
+                    return
+
+                if page.get("next"):
+                    next_page = asyncio.ensure_future(self._get_request(page["next"]))
+
+                for record in page.get("results") or []:
+                    yield record
+
+                if next_page is None:
+                    return
+
+                resp, next_page = await next_page, None
+        finally:
+            # the caller stopped early (or a page failed)
+            if next_page is not None:
+                next_page.cancel()
+
+    async def iter_all(self, entity, ordering=None, page_size=None):
+        """
+        Iterates over all records of the entity, page by page.
+
+        Args:
+            entity (str): entity name  e.g. "releases", "products", "product-types"
+            ordering (None or str): column name to be ordered
+            page_size (int, optional): number of records requested per page.
+
+        Yields:
+            dict: record
+        """
+
+        async for record in self._iter_pages(
+            f"{self._base_api_url}{entity}/", page_params(ordering, page_size)
+        ):
+            yield record
+
+    async def get_all(self, entity, ordering=None) -> list:
+        """
+        Returns a list with all records of the entity.
+
+        Args:
+            entity (str): entity name  e.g. "releases", "products", "product-types"
+            ordering (None or str): column name to be ordered
+
+        Returns:
+            list: list of records
+        """
+
+        return [record async for record in self.iter_all(entity, ordering=ordering)]
+
+    async def get(self, entity, _id) -> dict:
+        """
+        Gets a record from the entity.
+
+        Args:
+            entity (str): entity name  e.g. "releases", "products", "product-types"
+            _id (int): record id
+
+        Returns:
+            dict: record metadata
+        """
+
+        data = await self._get_request(f"{self._base_api_url}{entity}/{_id}/")
+        self._raise_for_failure(data)
+        return data.get("data")
+
+    async def get_by_attribute(self, entity, attribute, value) -> dict:
+        """
+        Gets a record from the entity by some attribute.
+
+        Args:
+            entity (str): entity name  e.g. "releases", "products", "product-types"
+            attribute (str): entity field
+            value (str): entity field value
+
+        Returns:
+            dict: record metadata
+        """
+
+        data = await self._get_request(
+            f"{self._base_api_url}{entity}/", params={attribute: value}
+        )
+        self._raise_for_failure(data)
+        return data.get("data")
+
+    async def get_by_name(self, entity, name) -> dict:
+        """
+        Gets a record from the entity by name.
+
+        Args:
+            entity (str): entity name  e.g. "releases", "products", "product-types"
+            name (str): record name
+
+        Returns:
+            dict: record metadata
+        """
+
+        return unique_result(await self.get_by_attribute(entity, "name", name))
+
+    async def options(self, entity) -> dict:
+        """
+        Gets options (filters, search and ordering) from the entity.
+
+        Args:
+            entity (str): entity name  e.g. "releases", "products", "product-types"
+
+        Returns:
+            dict: options metadata (filters, search and ordering).
+        """
+
+        opt = await self._options_request(f"{self._base_api_url}{entity}/")
+        self._raise_for_failure(opt)
+        return opt.get("data")
+
+    async def _products_params(self, filters=None, status=1) -> dict:
+        params = {"status": str(status)} if status else {}
+
+        if filters:
+            filter_opt = self._filter_options.get("products", None)
+            if not filter_opt:
+                filter_opt = await self.options("products")
+                self._filter_options["products"] = filter_opt
+            validate_filters(filter_opt, filters)
+            params.update(filters_params(filters))
+
+        return params
+
+    async def iter_products(self, filters=None, status=1, page_size=None):
+        """
+        Iterates over the products according to a filter, page by page.
+
+        Args:
+            filters (dict): products filter   ex: {'release': 'LSST'}
+            status (int): products status (1 is viewing only completed products)
+            page_size (int, optional): number of records requested per page.
+
+        Yields:
+            dict: product record
+        """
+
+        params = await self._products_params(filters, status)
+        if page_size:
+            params["page_size"] = page_size
+
+        async for record in self._iter_pages(f"{self._base_api_url}products/", params):
+            yield record
+
+    async def get_products(self, filters=None, status=1) -> list:
+        """
+        Returns list of products according to a filter
+
+        Args:
+            filters (dict): products filter   ex: {'release': 'LSST'}
+            status (int): products status (1 is viewing only completed products)
+
+        Returns:
+            list: list of records
+        """
+
+        return [record async for record in self.iter_products(filters, status=status)]
+
+    async def get_main_file_info(self, _id) -> dict:
+        """
+        Returns information about the main product file.
+
+        Args:
+            _id (int): record id
+
+        Returns:
+            dict: record data
+        """
+
+        resp = await self._get_request(
+            f"{self._base_api_url}products/{_id}/main_file_info/"
+        )
+        self._raise_for_failure(resp)
+        return main_file_info_from_data(resp.get("data").get("main_file"))
+
+    async def _wait_for_product_download_ready(
+        self, _id, archive, *, status_url, timeout=1800, poll_interval=2,
+        download_name="Product download",
+    ):  # pylint: disable=too-many-arguments
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        max_interval = max(MAX_POLL_INTERVAL, poll_interval)
+        hint = poll_hint(archive)
+        interval = min(poll_interval if hint is None else hint, max_interval)
+
+        while archive and archive.get("status") in ("pending", "running"):
+            if loop.time() >= deadline:
+                raise requests.exceptions.RequestException(
+                    f"{download_name} is still being prepared. Please try again later."
+                )
+
+            await asyncio.sleep(min(interval, max(0, deadline - loop.time())))
+            data = await self._get_request(status_url)
+            self._raise_for_failure(data)
+            archive = data.get("data")
+            interval = next_poll_interval(interval, archive, max_interval)
+
+        return check_download_archive(archive, download_name)
+
+    async def _resumable_destination(self, url, save_dir):
+        """
+        Paths of a download whose ".part" file is left in save_dir, so the
+        first GET already resumes it. The file name is asked with a HEAD
+        request, only sent when save_dir holds some partial download.
+
+        Returns:
+            tuple: destination and partial destination (None, None when
+                there is nothing to resume)
+        """
+
+        if not any(save_dir.glob("*.part")):
+            return None, None
+
+        data = await self._send_request("HEAD", url, headers=self._headers())
+        if not data.get("success", False):
+            return None, None
+
+        paths = download_destination(save_dir, data["response_object"].headers)
+        return paths if paths[1].exists() else (None, None)
+
+    async def _download_request(  # pylint: disable=too-many-locals
+        self, url, save_in=".", max_attempts=3
+    ):
+        """
+        Downloads a file, resuming from the partial file when the stream
+        is interrupted.
+
+        Args:
+            url (str): url to get
+            save_in (str): location where the file will be saved
+            max_attempts (int): number of attempts when streaming is interrupted
+
+        Returns:
+            dict: response content with the saved file path as message.
+        """
+
+        save_dir = pathlib.Path(save_in)
+        save_dir.mkdir(parents=True, exist_ok=True)
+        destination, partial_destination = await self._resumable_destination(
+            url, save_dir
+        )
+        last_error = None
+
+        for _attempt in range(max_attempts):
+            start_byte = partial_size(partial_destination)
+            headers = self._headers()
+            if start_byte:
+                headers["Range"] = f"bytes={start_byte}-"
+
+            data = await self._send_request("GET", url, headers=headers, stream=True)
+            if not data.get("success", False):
+                return data
+
+            resp_obj = data["response_object"]
+            if destination is None:
+                destination, partial_destination = download_destination(
+                    save_dir, resp_obj.headers
+                )
+
+            if resp_obj.status_code != 206:
+                start_byte = None
+
+            expected_size = download_total_size(resp_obj, start_byte)
+            mode = "ab" if start_byte else "wb"
+
+            try:
+                with open(partial_destination, mode) as filedown:
+                    async for chunk in resp_obj.iter_chunks():
+                        filedown.write(chunk)
+            except OSError as error:
+                last_error = error
+                continue
+            finally:
+                resp_obj.release()
+
+            actual_size = partial_destination.stat().st_size
+            if expected_size is None or actual_size == expected_size:
+                partial_destination.replace(destination)
+                data.update({"message": str(destination)})
+                return data
+
+            last_error = ConnectionError(
+                f"Incomplete download: {actual_size} of {expected_size} bytes"
+            )
+
+        raise requests.exceptions.RequestException(
+            f"Download interrupted after {max_attempts} attempts. "
+            f"Partial file kept at: {partial_destination}"
+        ) from last_error
+
+    async def _prepare_and_download(  # pylint: disable=too-many-arguments
+        self, _id, prefix, save_in, timeout, poll_interval, download_name
+    ):
+        url = f"{self._base_api_url}products/{_id}/{prefix}"
+        data = await self._post_request(f"{url}prepare/", payload=None)
+        self._raise_for_failure(data)
+
+        archive = await self._wait_for_product_download_ready(
+            _id,
+            data.get("data"),
+            status_url=f"{url}status/",
+            timeout=timeout,
+            poll_interval=poll_interval,
+            download_name=download_name,
+        )
+
+        return await self._download_request(
+            urljoin(self._base_api_url, archive["download_url"]), save_in
+        )
+
+    async def download_product(self, _id, save_in=".", timeout=1800, poll_interval=2):
+        """
+        Downloads the product to local
+
+        Args:
+            _id (int): record id
+            save_in (str): location where the file will be saved
+            timeout (int): maximum seconds to wait for archive preparation
+            poll_interval (int): seconds before the first status check; the
+                interval then grows up to 30 seconds
+
+        Returns:
+            dict: record data
+        """
+
+        return await self._prepare_and_download(
+            _id, "download/", save_in, timeout, poll_interval, "Product download"
+        )
+
+    async def download_main_file(self, _id, save_in=".", timeout=1800, poll_interval=2):
+        """
+        Gets the contents uploaded by the user for a given record.
+
+        Args:
+            _id (int): record id
+            save_in (str): location where the file will be saved
+            timeout (int): maximum seconds to wait for archive preparation
+            poll_interval (int): seconds before the first status check; the
+                interval then grows up to 30 seconds
+
+        Returns:
+            dict: record data
+        """
+
+        return await self._prepare_and_download(
+            _id, "download/main-file/", save_in, timeout, poll_interval,
+            "Product main file",
+        )
+
+    async def start_process(self, data, files=None):
+        """
+        Start process in Pz Server
+
+        Args:
+            data (dict): data process
+            files (dict, optional): files to post. Defaults to None.
+
+        Returns:
+            dict: record data
+        """
+
+        data = dict(data)
+        if "used_config" in data and isinstance(data["used_config"], dict):
+            data["used_config"] = json.dumps(data["used_config"])
+
+        process = await self._post_request(
+            f"{self._base_api_url}processes/", payload=data, files=files
+        )
+        self._raise_for_failure(process)
+        return process.get("data")
+
+    async def stop_process(self, process_id):
+        """
+        Stop process in Pz Server
+
+        Args:
+            process_id (int): process ID
+        """
+
+        data = await self._get_request(
+            f"{self._base_api_url}processes/{process_id}/stop/"
+        )
+        self._raise_for_failure(data)
+        return data.get("data")
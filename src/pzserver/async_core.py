@@ -0,0 +1,198 @@
+"""
+Asynchronous classes responsible for managing user interaction
+"""
+
+from .async_communicate import AsyncPzRequests
+from .core import FONTCOLOREND, FONTCOLORERR, PRODUCT_NOT_FOUND
+
+
+class AsyncPzServer:
+    """
+    Responsible for managing asynchronous user interactions with the
+    Pz Server app.
+
+    Usage:
+        async with AsyncPzServer(token) as pz_server:
+            metadata = await pz_server.get_product_metadata(42)
+    """
+
+    def __init__(self, token=None, host="pz", **api_options):
+        """
+        AsyncPzServer class constructor
+
+        Args:
+            token (str): user's token generated on the PZ Server website
+            host (str): "pz" (production) or
+                        "pz-dev" (test environment) or
+                        "localhost" (dev environment) or
+                        "api url"
+            **api_options: options forwarded to AsyncPzRequests
+                (e.g. max_concurrency, max_connections_per_host, timeout).
+        """
+
+        if token is None:
+            raise ValueError(
+                f"{FONTCOLORERR}Please provide a valid token.{FONTCOLOREND}"
+            )
+
+        self.api = AsyncPzRequests(token, host, **api_options)
+
+    async def open(self):
+        """
+        Checks the token and opens the connection to the Photo-z Server.
+
+        Returns:
+            AsyncPzServer: self
+        """
+        await self.api.open()
+        return self
+
+    async def close(self):
+        """
+        Closes the connections kept open to the Photo-z Server.
+        """
+        await self.api.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def get_product_types(self) -> list:
+        """
+        Fetches the list of valid product types.
+
+        Returns:
+            product types list
+        """
+        return await self.api.get_all("product-types", ordering="order")
+
+    async def get_releases(self) -> list:
+        """
+        Fetches the list of valid data releases.
+
+        Returns:
+            releases list
+        """
+        return await self.api.get_all("releases")
+
+    async def get_products_list(self, filters=None) -> list:
+        """
+        Fetches the list of data products available.
+
+        Args:
+            filters (dict): dictionary with a string
+                (or a list of strings) patterns to
+                filter the results.
+
+        Returns:
+            data products list
+        """
+        return await self.api.get_products(filters)
+
+    def iter_products_list(self, filters=None, page_size=None):
+        """
+        Iterates asynchronously over the data products available.
+
+        Args:
+            filters (dict): dictionary with a string
+                (or a list of strings) patterns to
+                filter the results.
+            page_size (int, optional): number of products
+                requested per page.
+
+        Returns:
+            async iterator of data product metadata (dict)
+        """
+        return self.api.iter_products(filters, page_size=page_size)
+
+    async def get_product_metadata(self, product_id, mainfile_info=True) -> dict:
+        """
+        Fetches the product metadata.
+
+        Args:
+            product_id (str or int): data product
+                unique identifier (product id
+                number or internal_name)
+            mainfile_info (bool, optional): additional
+                information from the main file.
+
+        Returns:
+            dict of product metadata
+        """
+        try:
+            if isinstance(product_id, int) or product_id.isdigit():
+                metaprod = dict(await self.api.get("products", product_id))
+            else:
+                plist = await self.api.get_products({"internal_name": product_id})
+                metaprod = dict(plist[0])
+        except Exception as excp:
+            raise ValueError(PRODUCT_NOT_FOUND) from excp
+
+        if mainfile_info:
+            metaprod["main_file"] = await self.api.get_main_file_info(metaprod["id"])
+
+        return metaprod
+
+    async def download_product(self, product_id=None, save_in=".") -> str:
+        """
+        Downloads the compressed zip file containing all the
+        data and metadata of a given data product.
+
+        Args:
+            product_id (str or int): data product
+                unique identifier (product id
+                number or internal_name)
+            save_in (str): location where the file will
+                be saved
+
+        Returns:
+            str: path of the saved file
+        """
+
+        prodid = (await self.get_product_metadata(product_id, mainfile_info=False))[
+            "id"
+        ]
+        results_dict = await self.api.download_product(prodid, save_in)
+
+        if not results_dict.get("success", False):
+            raise ValueError(f"Download failed: {results_dict.get('message')}")
+
+        return results_dict["message"]
+
+    async def start_process(self, data, files=None) -> dict:
+        """
+        Submits a process to the Photo-z Server.
+
+        Args:
+            data (dict): process data (display_name,
+                pipeline, used_config, inputs, ...)
+            files (dict, optional): files to post.
+
+        Returns:
+            dict: process record
+        """
+        return await self.api.start_process(data, files=files)
+
+    async def check_status(self, process_id) -> str:
+        """
+        Checks a process status.
+
+        Args:
+            process_id (int): process ID
+
+        Returns:
+            str: process status
+        """
+        process = await self.api.get("processes", process_id)
+        return f"{process.get('status')}"
+
+    async def stop_process(self, process_id):
+        """
+        Stops a process.
+
+        Args:
+            process_id (int): process ID
+        """
+        return await self.api.stop_process(process_id)
@@ -2,9 +2,24 @@
 Classes responsible for loading the datasets (products) of the Pz Server app
 """
 
+from collections.abc import Iterator
+
 import matplotlib.pyplot as plt
 from IPython.display import display
 
+from .density import (Histogram, Histogram2D, SkyHistogram, iter_chunks,
+                      plot_density, plot_histogram, plot_sky_density,
+                      value_ranges)
+
+# plots of catalogs with more rows suggest the binned mode
+BINNED_PLOT_MIN_ROWS = 100_000
+# fine bins of the binned plots, which show the occupied bins; the ranges
+# are those of the values, or these for streamed batches (read only once)
+REDSHIFT_RANGE = (-1.0, 10.0)
+REDSHIFT_BINS = 11_000
+MAGNITUDE_RANGE = (10.0, 35.0)
+MAGNITUDE_BINS = 2_500
+
 
 class Catalog:
     """
@@ -32,6 +47,54 @@ class Catalog:
         """
         display(self.metadata_df.style.hide(axis="index"))
 
+    def _binned_by_default(self):
+        """Streamed batches can only be plotted binned; large catalogs are
+        still plotted point by point, with a hint."""
+        if isinstance(self.data, Iterator):
+            # batches streamed by PzServer.iter_product_batches
+            return True
+
+        n_rows = len(self.data)
+        if n_rows > BINNED_PLOT_MIN_ROWS:
+            print(
+                f"Plotting {n_rows} points. Use plot(binned=True) to plot "
+                "densities in constant memory instead."
+            )
+        return False
+
+    def _binned_ranges(self, defaults):
+        """
+        Ranges of the binned plots: those of the values when the data can
+        be read twice, otherwise the defaults.
+
+        Args:
+            defaults (dict): column name -> default range
+
+        Returns:
+            dict: column name -> (low, high)
+        """
+
+        if isinstance(self.data, Iterator):
+            return dict(defaults)
+
+        ranges = value_ranges(self.data, list(defaults))
+        for name, value_range in ranges.items():
+            if value_range is None:
+                ranges[name] = defaults[name]
+            elif value_range[0] == value_range[1]:
+                ranges[name] = (value_range[0] - 0.5, value_range[1] + 0.5)
+        return ranges
+
+    @staticmethod
+    def _report_outside(histograms):
+        """Prints the number of values left out of the binned plots."""
+        for name, histogram in histograms.items():
+            if histogram.outside:
+                print(
+                    f"{histogram.outside} values of {name} outside the plotted "
+                    "range were not counted."
+                )
+
 
 class SpeczCatalog(Catalog):
     """
@@ -41,12 +104,16 @@ class SpeczCatalog(Catalog):
         Catalog (_type_): _description_
     """
 
-    def plot(self, savefig=False):
+    def plot(self, savefig=False, binned=None):
         """
         Very basic plots to characterize a Redshift catalog.
 
         Args:
             savefig: option to save PNG figure (boolean)
+            binned: plot the sky density on a Mollweide projection
+                and the redshift histogram, computed in chunks with
+                constant memory, instead of every point (boolean).
+                Defaults to True only for streamed batches.
         """
 
         ra_name = dec_name = redshift_name = None
@@ -64,16 +131,22 @@ class SpeczCatalog(Catalog):
             print(f"RA: {ra_name}, Dec: {dec_name}, Redshift: {redshift_name}")
             return None
 
-        plt.figure(figsize=[8, 3])
-        plt.subplot(121)
-        plt.scatter(self.data[ra_name], self.data[dec_name])
-        plt.xlabel(f"{ra_name} (deg)")
-        plt.ylabel(f"{dec_name} (deg)")
-        plt.subplot(122)
-        plt.hist(self.data[redshift_name], bins=30, histtype="bar")
-        plt.xlabel(redshift_name)
-        plt.ylabel("counts")
-        plt.tight_layout()
+        if binned is None:
+            binned = self._binned_by_default()
+
+        if binned:
+            self._plot_binned(ra_name, dec_name, redshift_name)
+        else:
+            plt.figure(figsize=[8, 3])
+            plt.subplot(121)
+            plt.scatter(self.data[ra_name], self.data[dec_name])
+            plt.xlabel(f"{ra_name} (deg)")
+            plt.ylabel(f"{dec_name} (deg)")
+            plt.subplot(122)
+            plt.hist(self.data[redshift_name], bins=30, histtype="bar")
+            plt.xlabel(redshift_name)
+            plt.ylabel("counts")
+            plt.tight_layout()
 
         if savefig:
             filename = "specz_catalog.png"
@@ -82,6 +155,27 @@ class SpeczCatalog(Catalog):
 
         return None
 
+    def _plot_binned(self, ra_name, dec_name, redshift_name):
+        ranges = self._binned_ranges({redshift_name: REDSHIFT_RANGE})
+        sky = SkyHistogram()
+        redshift = Histogram(ranges[redshift_name], REDSHIFT_BINS)
+        for chunk in iter_chunks(self.data, [ra_name, dec_name, redshift_name]):
+            sky.update(chunk[ra_name], chunk[dec_name])
+            redshift.update(chunk[redshift_name])
+        self._report_outside({redshift_name: redshift})
+
+        figure = plt.figure(figsize=[11, 3.5])
+        axes = figure.add_subplot(121, projection="mollweide")
+        mesh = plot_sky_density(sky, axes)
+        figure.colorbar(mesh, ax=axes, label="counts", shrink=0.7)
+        axes.set_xlabel(f"{ra_name} (deg)")
+        axes.set_ylabel(f"{dec_name} (deg)")
+        axes = figure.add_subplot(122)
+        plot_histogram(redshift.coarsened(30), axes)
+        axes.set_xlabel(redshift_name)
+        axes.set_ylabel("counts")
+        figure.tight_layout()
+
 
 class TrainingSet(Catalog):
     """
@@ -91,11 +185,15 @@ class TrainingSet(Catalog):
         Catalog (_type_): _description_
     """
 
-    def plot(self, mag_name=None, savefig=False):
+    def plot(self, mag_name=None, savefig=False, binned=None):
         """Very basic plots to characterize a Training Set.
 
         Args:
             savefig: option to save PNG figure (boolean)
+            binned: plot histograms and the redshift-magnitude
+                density, computed in chunks with constant memory,
+                instead of every point (boolean). Defaults to True
+                only for streamed batches.
         """
 
         redshift_name = None
@@ -109,6 +207,13 @@ class TrainingSet(Catalog):
             print(f"Redshift: {redshift_name}")
             return None
 
+        if binned is None:
+            binned = self._binned_by_default()
+
+        if binned:
+            self._plot_binned(redshift_name, mag_name)
+            return self._save(savefig)
+
         redshift_min = self.data[redshift_name].min() - 0.1
         if self.data[redshift_name].min() <= 0.1:
             redshift_min = 0.0
@@ -153,9 +258,64 @@ class TrainingSet(Catalog):
 
             plt.tight_layout()
 
+        return self._save(savefig)
+
+    @staticmethod
+    def _save(savefig):
         if savefig:
             filename = "train_set.png"
             plt.savefig(filename)
             return filename
 
         return None
+
+    def _plot_binned(self, redshift_name, mag_name):
+        defaults = {redshift_name: REDSHIFT_RANGE}
+        if mag_name:
+            defaults[mag_name] = MAGNITUDE_RANGE
+        ranges = self._binned_ranges(defaults)
+        mag_range = ranges.get(mag_name, MAGNITUDE_RANGE)
+
+        redshift = Histogram(ranges[redshift_name], REDSHIFT_BINS)
+        magnitude = Histogram(mag_range, MAGNITUDE_BINS)
+        density = Histogram2D(
+            ranges[redshift_name],
+            mag_range,
+            (REDSHIFT_BINS // 10, MAGNITUDE_BINS // 5),
+        )
+        for chunk in iter_chunks(self.data, list(defaults)):
+            redshift.update(chunk[redshift_name])
+            if mag_name:
+                magnitude.update(chunk[mag_name])
+                density.update(chunk[redshift_name], chunk[mag_name])
+        self._report_outside(
+            {redshift_name: redshift, mag_name: magnitude}
+            if mag_name
+            else {redshift_name: redshift}
+        )
+
+        if mag_name is None:
+            plot_histogram(redshift.coarsened(30))
+            plt.xlabel(redshift_name)
+            plt.ylabel("counts")
+            plt.tight_layout()
+            return
+
+        plt.figure(figsize=[12, 4])
+        plt.subplot(131)
+        plot_histogram(magnitude.coarsened(30))
+        plt.xlabel(mag_name)
+        plt.ylabel("counts")
+
+        plt.subplot(132)
+        plot_histogram(redshift.coarsened(30))
+        plt.xlabel(redshift_name)
+        plt.ylabel("counts")
+
+        plt.subplot(133)
+        mesh = plot_density(density)
+        plt.colorbar(mesh, label="counts")
+        plt.xlabel(redshift_name)
+        plt.ylabel(mag_name)
+
+        plt.tight_layout()
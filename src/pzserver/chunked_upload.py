@@ -0,0 +1,314 @@
+"""
+Streaming bodies and resume journal used to upload large files
+"""
+
+import hashlib
+import json
+import mimetypes
+import os
+import pathlib
+import threading
+import uuid
+
+
+class FileSlice:
+    """
+    Read-only view of a byte range of a file, streamed from disk.
+
+    Used as a request body: requests reads it in blocks and takes its
+    length from __len__, so the range is never loaded in memory.
+    """
+
+    def __init__(self, path, offset=0, length=None):
+        """
+        FileSlice class constructor
+
+        Args:
+            path (str): file path
+            offset (int, optional): first byte of the range. Defaults to 0.
+            length (int, optional): size of the range. Defaults to the rest
+                of the file.
+        """
+
+        self.path = pathlib.Path(path)
+        self.offset = offset
+        size = self.path.stat().st_size
+        self.length = size - offset if length is None else min(length, size - offset)
+        self._position = 0
+        self._file = None
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1) -> bytes:
+        """
+        Reads up to size bytes of the range.
+
+        Args:
+            size (int, optional): number of bytes (-1 reads to the end).
+
+        Returns:
+            bytes: data read
+        """
+
+        remaining = self.length - self._position
+        if remaining <= 0:
+            self.close()
+            return b""
+
+        if self._file is None:
+            self._file = open(self.path, "rb")  # pylint: disable=consider-using-with
+            self._file.seek(self.offset + self._position)
+
+        size = remaining if size is None or size < 0 else min(size, remaining)
+        data = self._file.read(size)
+        self._position += len(data)
+        return data
+
+    def seek(self, position, whence=os.SEEK_SET):
+        """
+        Moves the read position inside the range.
+
+        Args:
+            position (int): offset
+            whence (int, optional): os.SEEK_SET, os.SEEK_CUR or os.SEEK_END
+        """
+
+        if whence == os.SEEK_CUR:
+            position += self._position
+        elif whence == os.SEEK_END:
+            position += self.length
+
+        self._position = min(max(position, 0), self.length)
+        if self._file is not None:
+            self._file.seek(self.offset + self._position)
+        return self._position
+
+    def tell(self) -> int:
+        """Current read position inside the range."""
+        return self._position
+
+    def close(self):
+        """Closes the underlying file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class MultipartStream:
+    """
+    multipart/form-data body streamed from disk.
+
+    Form fields are encoded in memory; file contents are read from disk
+    in blocks while the request is sent, and the files are closed as
+    soon as they are consumed.
+    """
+
+    def __init__(self, fields=None, files=None):
+        """
+        MultipartStream class constructor
+
+        Args:
+            fields (dict, optional): form fields (None values are skipped).
+            files (dict, optional): form field name -> file path.
+        """
+
+        self.boundary = uuid.uuid4().hex
+        self._parts = []
+
+        for name, value in (fields or {}).items():
+            if value is None:
+                continue
+            self._parts.append(
+                self._head(name)
+                + b"\r\n"
+                + str(value).encode("utf-8")
+                + b"\r\n"
+            )
+
+        for name, path in (files or {}).items():
+            path = pathlib.Path(path)
+            mimetype = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            self._parts.append(
+                self._head(name, path.name)
+                + f"Content-Type: {mimetype}\r\n\r\n".encode("utf-8")
+            )
+            self._parts.append(FileSlice(path))
+            self._parts.append(b"\r\n")
+
+        self._parts.append(f"--{self.boundary}--\r\n".encode("utf-8"))
+        self._index = 0
+        self._offset = 0
+
+    def _head(self, name, filename=None) -> bytes:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        head = f"--{self.boundary}\r\nContent-Disposition: {disposition}\r\n"
+        return head.encode("utf-8")
+
+    @property
+    def content_type(self) -> str:
+        """Content-Type header of the body."""
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return sum(len(part) for part in self._parts)
+
+    def read(self, size=-1) -> bytes:
+        """
+        Reads up to size bytes of the body.
+
+        Args:
+            size (int, optional): number of bytes (-1 reads to the end).
+
+        Returns:
+            bytes: data read
+        """
+
+        if size is None or size < 0:
+            size = len(self)
+
+        chunks = []
+        while size > 0 and self._index < len(self._parts):
+            part = self._parts[self._index]
+            if isinstance(part, FileSlice):
+                data = part.read(size)
+            else:
+                data = part[self._offset : self._offset + size]
+                self._offset += len(data)
+
+            if not data:
+                self._index += 1
+                self._offset = 0
+                continue
+
+            chunks.append(data)
+            size -= len(data)
+
+        return b"".join(chunks)
+
+    def seek(self, position, whence=os.SEEK_SET):
+        """
+        Rewinds the body so it can be sent again (only position 0).
+        """
+
+        if position != 0 or whence != os.SEEK_SET:
+            raise OSError("MultipartStream can only be rewound to the start")
+
+        for part in self._parts:
+            if isinstance(part, FileSlice):
+                part.close()
+                part.seek(0)
+        self._index = 0
+        self._offset = 0
+        return 0
+
+    def close(self):
+        """Closes every open file."""
+        for part in self._parts:
+            if isinstance(part, FileSlice):
+                part.close()
+
+
+class UploadJournal:
+    """
+    Local record of a chunked upload, so it can be resumed after a crash.
+
+    The journal is keyed by the product, the file role and the file
+    identity (absolute path, size and modification time): a modified file
+    starts a new upload.
+    """
+
+    def __init__(self, directory, product_id, filepath, role):
+        """
+        UploadJournal class constructor
+
+        Args:
+            directory (str): directory where journals are kept
+            product_id (int): product id
+            filepath (str): file being uploaded
+            role (str): file role
+        """
+
+        filepath = pathlib.Path(filepath).resolve()
+        stat = filepath.stat()
+        identity = json.dumps(
+            [product_id, role, str(filepath), stat.st_size, stat.st_mtime_ns]
+        )
+        key = hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+        self.directory = pathlib.Path(directory).expanduser()
+        self.path = self.directory / f"{key}.json"
+        self.size = stat.st_size
+        self.upload_id = None
+        self.chunk_size = None
+        self.parts = set()
+        self._lock = threading.Lock()
+
+        try:
+            saved = json.loads(self.path.read_text(encoding="utf-8"))
+            self.upload_id = saved["upload_id"]
+            self.chunk_size = saved["chunk_size"]
+            self.parts = set(saved["parts"])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    @property
+    def n_parts(self) -> int:
+        """Number of parts of the upload."""
+        return max(1, -(-self.size // self.chunk_size))
+
+    def missing_parts(self) -> list:
+        """Indexes of the parts not uploaded yet."""
+        return [index for index in range(self.n_parts) if index not in self.parts]
+
+    def start(self, upload_id, chunk_size):
+        """
+        Records a new upload.
+
+        Args:
+            upload_id (str): upload id returned by the server
+            chunk_size (int): size of each part in bytes
+        """
+
+        self.upload_id = upload_id
+        self.chunk_size = chunk_size
+        self.parts = set()
+        self.save()
+
+    def mark_done(self, index):
+        """
+        Records that a part was uploaded.
+
+        Args:
+            index (int): part index
+        """
+
+        with self._lock:
+            self.parts.add(index)
+            self._save()
+
+    def save(self):
+        """Persists the journal."""
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        tmp_path.write_text(
+            json.dumps(
+                {
+                    "upload_id": self.upload_id,
+                    "chunk_size": self.chunk_size,
+                    "parts": sorted(self.parts),
+                }
+            ),
+            encoding="utf-8",
+        )
+        tmp_path.replace(self.path)
+
+    def remove(self):
+        """Removes the journal once the upload is complete."""
+        self.path.unlink(missing_ok=True)
@@ -2,44 +2,114 @@
 Classes to communicate with the Pz Server app
 """
 
+import copy
+import heapq
 import json
 import pathlib
 import re
+import threading
 import time
-from email.message import Message
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urljoin
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from .api_common import (ENVIRONMENTS, MAPPING_FILTERS, MAX_POLL_INTERVAL,
+                         POLL_BACKOFF, check_download_archive,
+                         download_destination, download_total_size,
+                         filename_from_content_disposition, filters_params,
+                         main_file_info_from_data, next_poll_interval,
+                         page_params, partial_size, response_data,
+                         unique_result, validate_filters)
+from .chunked_upload import FileSlice, MultipartStream, UploadJournal
+from .instrumentation import RequestEvents, endpoint_template
+from .integrity import DownloadDigests, expected_digest
+from .remote_file import RemoteFile
+from .response_cache import ResponseCache
+from .retry import RetryPolicy
 
 
 # pylint: disable=too-many-lines,too-many-public-methods
-class PzRequests:
+class PzRequests:  # pylint: disable=too-many-instance-attributes
     """
     Responsible for managing all requests to the Pz Server app.
     """
 
     _token = None
     _base_api_url = None
-    _filter_options = {}
-    _mapping_filters = {
-        "product_type": "product_type_name",
-        "product_type__or": "product_type_name__or",
-        "release": "release_name",
-        "release__or": "release_name__or",
-    }
-    _enviroments = {
-        "localhost": "http://localhost/api/",
-        "pz-dev": "https://pzserver-dev.linea.org.br/api/",
-        "pz": "https://pzserver.linea.org.br/api/",
+    _session = None
+    _session_lock = threading.Lock()
+    _pool_options = {}
+    _keep_alive = True
+    _download_connections = 1
+    _metadata_cache = None
+    _retry_policy = RetryPolicy()
+    _events = None
+    _upload_chunk_size = None
+    _max_poll_interval = MAX_POLL_INTERVAL
+    _poll_backoff = POLL_BACKOFF
+    _upload_journal_dir = "~/.cache/pzserver/uploads"
+    _file_roles = {
+        "main": 0,
+        "description": 1,
+        "auxiliary": 2,
     }
+    # entities whose records are served from the cache until they expire;
+    # the records of other entities are revalidated on every request
+    _static_entities = ("product-types", "releases", "pipelines", "users")
+    _min_range_size = 8 * 1024**2
+    _digest_block_size = 8 * 1024**2
+    _filter_options = {}
+    _mapping_filters = MAPPING_FILTERS
+    _enviroments = ENVIRONMENTS
 
-    def __init__(self, token, host="pz"):
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        token,
+        host="pz",
+        *,
+        pool_connections=10,
+        pool_maxsize=10,
+        pool_block=False,
+        keep_alive=True,
+        download_connections=1,
+        metadata_cache=None,
+        retry_policy=None,
+        upload_chunk_size=None,
+        upload_journal_dir=None,
+    ):
         """
         Initializes communication with the Pz Server app.
 
         Args:
             token (str): token to access the API.
             host (str, optional): host key. Defaults to "pz".
+            pool_connections (int, optional): number of per-host connection
+                pools kept by the session. Defaults to 10.
+            pool_maxsize (int, optional): maximum number of connections kept
+                open for a single host. Defaults to 10.
+            pool_block (bool, optional): whether to block, instead of opening
+                an extra connection, when all connections to a host are busy.
+                Defaults to False.
+            keep_alive (bool, optional): reuse connections between requests.
+                Defaults to True.
+            download_connections (int, optional): number of concurrent
+                connections used to download a file in byte ranges. With 1
+                the file is streamed over a single connection. Defaults to 1.
+            metadata_cache (bool or ResponseCache, optional): cache for the
+                metadata responses (get, get_all, get_by_name, options and
+                get_main_file_info). True uses an in-memory ResponseCache.
+                Defaults to None (no cache).
+            retry_policy (RetryPolicy, optional): policy used to retry
+                transient failures (429, 502, 503, 504 and connection
+                errors). Defaults to RetryPolicy().
+            upload_chunk_size (int, optional): files larger than this many
+                bytes are uploaded in parts of this size with the resumable
+                chunked upload protocol. Defaults to None (single request).
+            upload_journal_dir (str, optional): directory where the progress
+                of chunked uploads is kept. Defaults to
+                "~/.cache/pzserver/uploads".
         """
 
         if host in self._enviroments:
@@ -48,8 +118,139 @@ class PzRequests:
             self._base_api_url = host
 
         self._token = token
+        self._pool_options = {
+            "pool_connections": pool_connections,
+            "pool_maxsize": pool_maxsize,
+            "pool_block": pool_block,
+        }
+        self._keep_alive = keep_alive
+        self._download_connections = download_connections
+        self._metadata_cache = (
+            ResponseCache() if metadata_cache is True else metadata_cache or None
+        )
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._upload_chunk_size = upload_chunk_size
+        if upload_journal_dir:
+            self._upload_journal_dir = upload_journal_dir
         self._check_token()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        Returns the HTTP session shared by every request of this instance.
+
+        The session is created on first use and keeps a pool of open
+        connections to the Pz Server, so consecutive requests do not pay
+        a new TCP/TLS handshake.
+
+        Returns:
+            requests.Session: pooled session
+        """
+
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._create_session(**self._pool_options)
+        return self._session
+
+    @staticmethod
+    def _create_session(
+        pool_connections=10, pool_maxsize=10, pool_block=False
+    ) -> requests.Session:
+        """
+        Creates a session with a connection-pooling adapter mounted for
+        both http and https.
+
+        Args:
+            pool_connections (int): number of per-host pools.
+            pool_maxsize (int): maximum connections per host.
+            pool_block (bool): block when the per-host pool is exhausted.
+
+        Returns:
+            requests.Session: configured session
+        """
+
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    @property
+    def events(self) -> RequestEvents:
+        """
+        Returns the events emitted for every request.
+
+        Callbacks subscribed with events.subscribe() receive the method,
+        endpoint template, status, duration, request/response bytes and
+        number of retries of each request (see RequestEvents).
+
+        Returns:
+            RequestEvents: request events
+        """
+
+        if self._events is None:
+            self._events = RequestEvents()
+        return self._events
+
+    def _emit_event(self, kind, method, url, **fields):
+        """
+        Emits a request event if there are subscribed callbacks.
+
+        Args:
+            kind (str): "request" or "transfer"
+            method (str): HTTP method
+            url (str): request url
+            **fields: remaining event fields
+        """
+
+        if not self._events:
+            return
+
+        event = {
+            "kind": kind,
+            "method": method,
+            "url": url,
+            "endpoint": endpoint_template(url, self._base_api_url),
+            "status_code": None,
+            "success": False,
+            "duration": None,
+            "request_bytes": None,
+            "response_bytes": None,
+            "retries": 0,
+        }
+        event.update(fields)
+        self._events.emit(event)
+
+    @staticmethod
+    def _body_size(body):
+        if body is None:
+            return 0
+        if isinstance(body, (bytes, str)):
+            return len(body)
+        if hasattr(body, "__len__"):
+            return len(body)
+        return getattr(body, "len", None)
+
+    def close(self):
+        """
+        Closes the pooled session and every connection it keeps open.
+        """
+
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
     @staticmethod
     def safe_list_get(_list, idx, default) -> list:
         """
@@ -84,93 +285,11 @@ class PzRequests:
             filter_opt = self.options(entity)
             self._filter_options[entity] = filter_opt
 
-        api_params = []
-
-        # adds the filter_classes as acceptable attributes on the endpoint
-        # for filtering entries.
-        for filter_class in filter_opt.get("filter_classes", []):
-            api_params.append(filter_class["name"])
-
-        # adds the filterset_fields as acceptable attributes on the endpoint
-        # for filtering entries.
-        for filter_name in filter_opt.get("filterset", []):
-            api_params.append(filter_name)
-
-        # add search with acceptable parameters if configured.
-        if "search" in filter_opt:
-            api_params.append("search")
-
-        for uitem in filters:
-            item = self._mapping_filters.get(uitem, uitem)
-            if not item in api_params:
-                lib_params = self.__reverse_filters(api_params)
-                raise ValueError(
-                    "Invalid filter key was detected.\n"
-                    "Valid filter keys are:\n  - {}".format("\n  - ".join(lib_params))
-                )
-
-    def __reverse_filters(self, api_params) -> list:
-        """
-        Reverts filter mapping
-
-        Args:
-            api_params (list): available filters
-
-        Returns:
-            list: filters matching
-        """
-
-        def check_filter(filter_name):
-            """
-            Check filter name
-
-            Args:
-                filter_name (str): filter name
-
-            Returns:
-                list: filter names
-            """
+        self._validate_filters(filter_opt, filters)
 
-            for key, value in self._mapping_filters.items():
-                if filter_name == value:
-                    return key
-            return filter_name
-
-        return list(set(map(check_filter, api_params)))
-
-    def _check_response(self, api_response) -> dict:
-        """
-        Checks for possible HTTP errors in the response.
-
-        Args:
-            api_response (request.Response): Response object
-
-        Returns:
-            dict: response content.
-        """
-        status_code = api_response.status_code
-
-        data = {
-            "status_code": status_code,
-            "message": str(),
-            "data": str(),
-            "response_object": api_response,
-        }
-
-        if 200 <= status_code < 300:
-            content_type = api_response.headers.get("content-type", "")
-            data.update({"success": True, "message": "Request completed"})
-            if status_code != 204 and content_type.strip().startswith(
-                "application/json"
-            ):
-                data.update({"data": api_response.json()})
-        else:
-            msg = api_response.text
-            # msg = txt.get("detail", txt)
-            # msg = txt.get("error", msg)
-            data.update({"success": False, "message": msg})
-
-        return data
+    _validate_filters = staticmethod(validate_filters)
+    _filters_params = staticmethod(filters_params)
+    _check_response = staticmethod(response_data)
 
     def _send_request(
         self,
@@ -207,7 +326,8 @@ class PzRequests:
         #     "message": str,
         #     "data": str,
         #     "success": bool,
-        #     "response_object": request.Response
+        #     "response_object": request.Response,
+        #     "retries": int
         # }
 
         data = {
@@ -216,59 +336,132 @@ class PzRequests:
             "response_object": None,
         }
 
-        try:
-            api_session = requests.Session()
-            api_response = api_session.send(
-                prerequest,
-                stream=stream,
-                timeout=timeout,
-                verify=verify,
-                cert=cert,
-                proxies=proxies,
-            )
+        if not self._keep_alive:
+            prerequest.headers.setdefault("Connection", "close")
+
+        policy = self._retry_policy
+        attempt = 0
+        started_at = time.perf_counter()
+
+        while True:
+            attempt += 1
+            try:
+                api_response = self.session.send(
+                    prerequest,
+                    stream=stream,
+                    timeout=timeout,
+                    verify=verify,
+                    cert=cert,
+                    proxies=proxies,
+                )
+            except requests.exceptions.RequestException as error:
+                if policy.should_retry_error(
+                    prerequest.method, error, attempt
+                ) and self._rewind_body(prerequest):
+                    time.sleep(policy.delay(attempt))
+                    continue
+
+                data.update({"success": False, "message": self._error_message(error)})
+                break
+
+            if policy.should_retry_status(
+                prerequest.method, api_response.status_code, attempt
+            ) and self._rewind_body(prerequest):
+                retry_after = api_response.headers.get("Retry-After")
+                api_response.close()
+                time.sleep(policy.delay(attempt, retry_after))
+                continue
+
             data.update(self._check_response(api_response))
-        except requests.exceptions.HTTPError as errh:
-            message = f"Http Error: {errh}"
-            data.update(
-                {
-                    "success": False,
-                    "message": message,
-                }
-            )
-        except requests.exceptions.ConnectionError as errc:
-            message = f"Connection Error: {errc}"
-            data.update(
-                {
-                    "success": False,
-                    "message": message,
-                }
-            )
-        except requests.exceptions.Timeout as errt:
-            message = f"Timeout Error: {errt}"
-            data.update(
-                {
-                    "success": False,
-                    "message": message,
-                }
-            )
-        except requests.exceptions.RequestException as err:
-            message = f"Request Error: {err}"
-            data.update(
-                {
-                    "success": False,
-                    "message": message,
-                }
-            )
+            break
+
+        data["retries"] = attempt - 1
+
+        if self._events:
+            self._emit_request_event(prerequest, data, stream, started_at)
 
         return data
 
-    def _get_request(self, url, params=None) -> dict:
+    def _emit_request_event(self, prerequest, data, stream, started_at):
+        """
+        Emits the event of a sent request.
+
+        Args:
+            prerequest (requests.PreparedRequest): sent request
+            data (dict): response content returned by _send_request
+            stream (bool): whether the response content is streamed
+            started_at (float): perf_counter time of the first attempt
+        """
+
+        response = data.get("response_object")
+        if response is None:
+            response_bytes = None
+        elif stream:
+            response_bytes = response.headers.get("Content-Length")
+            response_bytes = int(response_bytes) if response_bytes else None
+        else:
+            response_bytes = len(response.content)
+
+        self._emit_event(
+            "request",
+            prerequest.method,
+            prerequest.url,
+            status_code=data.get("status_code"),
+            success=data.get("success", False),
+            duration=time.perf_counter() - started_at,
+            request_bytes=self._body_size(prerequest.body),
+            response_bytes=response_bytes,
+            retries=data["retries"],
+        )
+
+    @staticmethod
+    def _error_message(error) -> str:
+        """
+        Formats a request error message according to its type.
+
+        Args:
+            error (requests.exceptions.RequestException): raised error
+
+        Returns:
+            str: error message
+        """
+
+        if isinstance(error, requests.exceptions.HTTPError):
+            return f"Http Error: {error}"
+        if isinstance(error, requests.exceptions.ConnectionError):
+            return f"Connection Error: {error}"
+        if isinstance(error, requests.exceptions.Timeout):
+            return f"Timeout Error: {error}"
+        return f"Request Error: {error}"
+
+    @staticmethod
+    def _rewind_body(prerequest) -> bool:
+        """
+        Prepares the request body to be sent again.
+
+        Args:
+            prerequest (requests.PreparedRequest): PreparedRequest object
+
+        Returns:
+            bool: False when the body is a stream that cannot be rewound
+        """
+
+        body = prerequest.body
+        if body is None or isinstance(body, (bytes, str)):
+            return True
+        if hasattr(body, "seek"):
+            body.seek(0)
+            return True
+        return False
+
+    def _get_request(self, url, params=None, headers=None) -> dict:
         """
         Get a record from the API.
 
         Args:
             url (str): url to get
             params (dict, optional): params to get. Defaults to None.
+            headers (dict, optional): extra headers. Defaults to None.
 
         Returns:
             dict: data of the request.
@@ -283,18 +476,19 @@ class PzRequests:
                     "Accept": "application/json",
                     "Content-Type": "application/json",
                     "Authorization": f"Token {self._token}",
-                }
+                },
+                **(headers or {}),
             ),
         )
         return self._send_request(req.prepare())
 
-    def _options_request(self, url) -> dict:
+    def _options_request(self, url, headers=None) -> dict:
         """
         Returns the options and settings for a given endpoint.
 
         Args:
             url (str): url to get
-            params (dict, optional): params to get. Defaults to None.
+            headers (dict, optional): extra headers. Defaults to None.
 
         Returns:
             dict: data of the request.
@@ -307,11 +501,95 @@ class PzRequests:
                     "Accept": "application/json",
                     "Content-Type": "application/json",
                     "Authorization": f"Token {self._token}",
-                }
+                },
+                **(headers or {}),
             ),
         )
         return self._send_request(req.prepare())
 
+    def _cached_request(self, url, params=None, method="GET", ttl=None) -> dict:
+        """
+        Sends a GET (or OPTIONS) request through the metadata cache.
+
+        Fresh entries are served from the cache. Expired entries are
+        revalidated with If-None-Match/If-Modified-Since and served from
+        the cache when the server answers 304 Not Modified.
+
+        Args:
+            url (str): url to get
+            params (dict, optional): params to get. Defaults to None.
+            method (str, optional): "GET" or "OPTIONS". Defaults to "GET".
+            ttl (float, optional): seconds an entry is served without
+                revalidation. Defaults to the cache ttl.
+
+        Returns:
+            dict: data of the request.
+        """
+
+        cache = self._metadata_cache
+
+        if cache is None:
+            if method == "OPTIONS":
+                return self._options_request(url)
+            return self._get_request(url, params=params)
+
+        key = cache.make_key(method, url, params, self._token)
+        entry = cache.get(key)
+
+        if entry is not None and cache.is_fresh(entry, ttl):
+            return self._cached_response(entry)
+
+        headers = {}
+        if entry is not None and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        if method == "OPTIONS":
+            resp = self._options_request(url, headers=headers)
+        else:
+            resp = self._get_request(url, params=params, headers=headers)
+
+        if resp.get("status_code") == 304 and entry is not None:
+            cache.touch(key)
+            return self._cached_response(entry)
+
+        if resp.get("success", False):
+            resp_headers = getattr(resp.get("response_object"), "headers", {})
+            cache.set(
+                key,
+                copy.deepcopy(resp.get("data")),
+                etag=resp_headers.get("ETag"),
+                last_modified=resp_headers.get("Last-Modified"),
+            )
+
+        return resp
+
+    @staticmethod
+    def _cached_response(entry) -> dict:
+        return {
+            "success": True,
+            "status_code": 200,
+            "message": "Request completed",
+            "data": copy.deepcopy(entry["data"]),
+            "response_object": None,
+        }
+
+    def _entity_ttl(self, entity):
+        """
+        Returns the ttl used to cache the records of an entity.
+
+        Args:
+            entity (str): entity name  e.g. "releases", "products", "product-types"
+
+        Returns:
+            float: ttl in seconds (0 means always revalidate)
+        """
+
+        if self._metadata_cache is None or entity not in self._static_entities:
+            return 0
+        return self._metadata_cache.ttl
+
     def _check_token(self):
         """
         Checks if the token is valid, otherwise stops class
@@ -326,79 +604,96 @@ class PzRequests:
             msg = cntxt.get("message", "Unforeseen error")
             raise requests.exceptions.RequestException(f"Status code {stcode}: {msg}")
 
-    @staticmethod
-    def _filename_from_content_disposition(content_disposition):
-        message = Message()
-        message["content-disposition"] = content_disposition or ""
-        filename = message.get_filename()
-        if filename:
-            return filename
+    _filename_from_content_disposition = staticmethod(
+        filename_from_content_disposition
+    )
+    _download_total_size = staticmethod(download_total_size)
 
-        return "download"
-
-    @staticmethod
-    def _download_total_size(response, fallback_size=None):
-        content_range = response.headers.get("Content-Range", "")
-        match = re.match(r"bytes \d+-\d+/(\d+)$", content_range)
-        if match:
-            return int(match.group(1))
-
-        content_length = response.headers.get("Content-Length")
-        if content_length is None:
-            return fallback_size
-
-        content_length = int(content_length)
-        if response.status_code == 206 and fallback_size is not None:
-            return fallback_size + content_length
-        return content_length
-
-    def _download_response(self, url, start_byte=None):
+    def _download_response(self, url, start_byte=None, end_byte=None):
         headers = {"Authorization": f"Token {self._token}"}
-        if start_byte:
-            headers["Range"] = f"bytes={start_byte}-"
+        if start_byte or end_byte is not None:
+            last_byte = "" if end_byte is None else end_byte
+            headers["Range"] = f"bytes={start_byte or 0}-{last_byte}"
 
         req = requests.Request("GET", url, headers=headers)
         return self._send_request(req.prepare(), stream=True)
 
-    def _download_request(  # pylint: disable=too-many-locals
-        self, url, save_in=".", max_attempts=3
-    ):
+    def _emit_transfer_event(self, url, response, transfer):
+        """
+        Emits the event of a streamed download body.
+
+        Args:
+            url (str): download url
+            response (requests.Response): streamed response
+            transfer (dict): bytes written, perf_counter start time and the
+                error that interrupted the stream, if any
+        """
+
+        self._emit_event(
+            "transfer",
+            "GET",
+            url,
+            status_code=response.status_code,
+            success=transfer.get("error") is None,
+            duration=time.perf_counter() - transfer["started_at"],
+            request_bytes=0,
+            response_bytes=transfer["bytes"],
+        )
+
+    # pylint: disable-next=too-many-locals,too-many-branches,too-many-statements
+    def _download_request(self, url, save_in=".", max_attempts=3, connections=None):
         """
         Download a record from the API.
 
+        The bytes are hashed as they are written: the sha256 of each block
+        is kept in a "<file>.digests" manifest next to the file, and the
+        digest of the whole file is compared with the one sent by the
+        server (Repr-Digest, Digest or X-Checksum-Sha256 headers), if any.
+        A resumed ".part" file is checked against its manifest and only
+        its corrupted blocks are fetched again.
+
         Args:
             url (str): url to get
             save_in (str): location where the file will be saved
             max_attempts (int): number of attempts when streaming is interrupted
+            connections (int, optional): number of concurrent byte-range
+                connections. Defaults to the download_connections option.
         """
 
         save_dir = pathlib.Path(save_in)
         save_dir.mkdir(parents=True, exist_ok=True)
-        filename = None
-        destination = None
-        partial_destination = None
+
+        connections = connections or self._download_connections
+        if connections > 1:
+            data = self._parallel_download_request(
+                url, save_dir, connections, max_attempts
+            )
+            # None means the server does not serve byte ranges
+            if data is not None:
+                return data
+
+        destination, partial_destination = self._resumable_destination(url, save_dir)
+        digests = None
+        if partial_destination is not None:
+            digests = self._partial_digests(destination)
+            self._verify_partial_download(url, partial_destination, digests)
+
+        server_digest = None
         last_error = None
 
         for _attempt in range(max_attempts):
-            start_byte = (
-                partial_destination.stat().st_size
-                if partial_destination and partial_destination.exists()
-                else None
-            )
+            start_byte = partial_size(partial_destination)
             data = self._download_response(url, start_byte=start_byte)
             if not data.get("success", False):
                 return data
 
             resp_obj = data.get("response_object", None)
-            if filename is None:
-                content_disposition = resp_obj.headers.get("Content-Disposition", "")
-                filename = self._filename_from_content_disposition(content_disposition)
-                destination = save_dir / filename
-                partial_destination = destination.with_name(f"{destination.name}.part")
-
-                if partial_destination.exists():
-                    resp_obj.close()
-                    continue
+            server_digest = expected_digest(resp_obj.headers) or server_digest
+            if destination is None:
+                destination, partial_destination = download_destination(
+                    save_dir, resp_obj.headers
+                )
+                digests = self._partial_digests(destination)
 
             if resp_obj.status_code != 206 and partial_destination.exists():
                 partial_destination.unlink()
@@ -406,26 +701,44 @@ class PzRequests:
 
             mode = "ab" if resp_obj.status_code == 206 and start_byte else "wb"
             expected_size = self._download_total_size(resp_obj, start_byte)
+            if mode == "wb":
+                digests.reset()
+            if server_digest is not None:
+                digests.use_algorithm(server_digest[0])
 
+            transfer = {"bytes": 0, "started_at": time.perf_counter()}
             try:
                 with open(partial_destination, mode) as filedown:
                     for chunk in resp_obj.iter_content(chunk_size=1024 * 1024):
                         if chunk:
                             filedown.write(chunk)
+                            digests.update(chunk)
+                            transfer["bytes"] += len(chunk)
             except requests.exceptions.RequestException as error:
-                last_error = error
+                last_error = transfer["error"] = error
                 continue
             finally:
                 resp_obj.close()
+                self._emit_transfer_event(url, resp_obj, transfer)
 
             actual_size = partial_destination.stat().st_size
-            if expected_size is None or actual_size == expected_size:
+            if expected_size is not None and actual_size != expected_size:
+                last_error = requests.exceptions.ChunkedEncodingError(
+                    f"Incomplete download: {actual_size} of {expected_size} bytes"
+                )
+                continue
+
+            if self._check_download_digest(
+                url, partial_destination, digests, server_digest
+            ):
                 partial_destination.replace(destination)
+                digests.move(destination.with_name(f"{destination.name}.digests"))
                 data.update({"message": str(destination)})
                 return data
 
-            last_error = requests.exceptions.ChunkedEncodingError(
-                f"Incomplete download: {actual_size} of {expected_size} bytes"
+            last_error = requests.exceptions.ContentDecodingError(
+                f"Checksum mismatch: {digests.algorithm} {digests.digest} "
+                f"instead of {server_digest[1]}"
             )
 
         partial_path = str(partial_destination) if partial_destination else "unknown"
@@ -434,6 +747,272 @@ class PzRequests:
             f"Partial file kept at: {partial_path}"
         ) from last_error
 
+    def _resumable_destination(self, url, save_dir):
+        """
+        Paths of a download whose ".part" file is left in save_dir, so the
+        first GET already resumes it. The file name is asked with a HEAD
+        request, only sent when save_dir holds some partial download.
+
+        Args:
+            url (str): url to get
+            save_dir (pathlib.Path): location where the file will be saved
+
+        Returns:
+            tuple: destination and partial destination (None, None when
+                there is nothing to resume)
+        """
+
+        if not any(save_dir.glob("*.part")):
+            return None, None
+
+        req = requests.Request(
+            "HEAD", url, headers={"Authorization": f"Token {self._token}"}
+        )
+        data = self._send_request(req.prepare())
+        if not data.get("success", False):
+            return None, None
+
+        paths = download_destination(save_dir, data["response_object"].headers)
+        return paths if paths[1].exists() else (None, None)
+
+    def _partial_digests(self, destination):
+        """Digests manifest of the ".part" file of a download."""
+        return DownloadDigests(
+            destination.with_name(f"{destination.name}.part.digests"),
+            self._digest_block_size,
+        )
+
+    def _verify_partial_download(self, url, partial_path, digests):
+        """
+        Checks a ".part" file left by a previous download against its
+        digests manifest, fetching again only its corrupted blocks. When
+        they cannot be fetched, the download restarts from scratch.
+
+        Args:
+            url (str): url to get
+            partial_path (pathlib.Path): ".part" file
+            digests (DownloadDigests): digests of the download
+        """
+
+        size = partial_path.stat().st_size
+        corrupted = digests.resume(partial_path, size)
+        if corrupted and not self._refetch_ranges(
+            url, partial_path, digests, corrupted
+        ):
+            partial_path.unlink()
+            digests.reset()
+
+    def _refetch_ranges(self, url, path, digests, ranges) -> bool:
+        """
+        Fetches byte ranges of a file again, writing them in place.
+
+        Args:
+            url (str): url to get
+            path (pathlib.Path): file being downloaded
+            digests (DownloadDigests): digests of the download
+            ranges (list): (start, end) byte ranges, aligned to the blocks
+
+        Returns:
+            bool: False when the server did not return the ranges
+        """
+
+        with open(path, "r+b") as filedown:
+            for start, end in ranges:
+                data = self._download_response(url, start_byte=start, end_byte=end)
+                resp_obj = data.get("response_object")
+                if resp_obj is None:
+                    return False
+
+                try:
+                    content = resp_obj.content if resp_obj.status_code == 206 else b""
+                except requests.exceptions.RequestException:
+                    content = b""
+                finally:
+                    resp_obj.close()
+
+                if len(content) != end - start + 1:
+                    return False
+
+                filedown.seek(start)
+                filedown.write(content)
+                digests.repair(start // digests.block_size, content)
+
+        return True
+
+    def _check_download_digest(self, url, path, digests, server_digest) -> bool:
+        """
+        Compares the digest of a downloaded file with the server digest.
+
+        On mismatch, the blocks that no longer match the manifest (damaged
+        on disk) are fetched again; if none is found, the bytes were
+        corrupted before being written and the download restarts.
+
+        Args:
+            url (str): url to get
+            path (pathlib.Path): downloaded file
+            digests (DownloadDigests): digests of the download
+            server_digest (tuple): algorithm and hex digest sent by the
+                server, or None
+
+        Returns:
+            bool: True when the file is valid
+        """
+
+        digest = digests.finish(path)
+        if server_digest is None or digest == server_digest[1]:
+            return True
+
+        corrupted = digests.corrupted_blocks(path)
+        if corrupted and self._refetch_ranges(url, path, digests, corrupted):
+            if digests.finish(path, rehash=True) == server_digest[1]:
+                return True
+
+        path.unlink()
+        return False
+
+    def _parallel_download_request(  # pylint: disable=too-many-locals
+        self, url, save_dir, connections, max_attempts=3
+    ):
+        """
+        Downloads a file splitting it in byte ranges fetched concurrently.
+
+        The ranges are written in place into a preallocated ".part" file.
+        The progress of each range is kept in a ".part.ranges" journal,
+        so an interrupted download resumes only the missing bytes.
+
+        Args:
+            url (str): url to get
+            save_dir (pathlib.Path): location where the file will be saved
+            connections (int): number of concurrent connections
+            max_attempts (int): number of attempts for each range
+
+        Returns:
+            dict: response content, or None when the server does not
+                return partial content (206) for range requests.
+        """
+
+        data = self._download_response(url, start_byte=0, end_byte=0)
+        if not data.get("success", False):
+            return data
+
+        resp_obj = data.get("response_object")
+        resp_obj.close()
+        match = re.match(
+            r"bytes \d+-\d+/(\d+)$", resp_obj.headers.get("Content-Range", "")
+        )
+        if resp_obj.status_code != 206 or not match:
+            return None
+
+        total_size = int(match.group(1))
+        if total_size < 2 * self._min_range_size:
+            return None
+
+        filename = self._filename_from_content_disposition(
+            resp_obj.headers.get("Content-Disposition", "")
+        )
+        destination = save_dir / filename
+        partial_destination = destination.with_name(f"{destination.name}.part")
+        journal = _RangeJournal(
+            destination.with_name(f"{destination.name}.part.ranges"),
+            partial_destination,
+            total_size,
+            connections,
+        )
+
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            futures = [
+                executor.submit(
+                    self._download_range, url, journal, index, max_attempts
+                )
+                for index in range(len(journal.segments))
+            ]
+            errors = [future.exception() for future in futures]
+
+        journal.save()
+        errors = [error for error in errors if error is not None]
+        if errors:
+            raise requests.exceptions.RequestException(
+                f"Download interrupted after {max_attempts} attempts. "
+                f"Partial file kept at: {partial_destination}"
+            ) from errors[0]
+
+        # ranges are written out of order, so the file is read once to be
+        # checked; on mismatch it is downloaded again as a single stream,
+        # which is checked block by block
+        server_digest = expected_digest(resp_obj.headers)
+        if server_digest is not None:
+            digests = DownloadDigests(
+                destination.with_name(f"{destination.name}.digests"),
+                self._digest_block_size,
+                server_digest[0],
+            )
+            digests.reset()
+            digests.resume(partial_destination, total_size)
+            if digests.finish(partial_destination) != server_digest[1]:
+                partial_destination.unlink()
+                journal.remove()
+                digests.remove()
+                return None
+
+        partial_destination.replace(destination)
+        journal.remove()
+        data.update({"message": str(destination)})
+        return data
+
+    def _download_range(self, url, journal, index, max_attempts=3):
+        """
+        Fetches one byte range of a parallel download, resuming from the
+        last byte written when the stream is interrupted.
+
+        Args:
+            url (str): url to get
+            journal (_RangeJournal): ranges journal
+            index (int): segment index
+            max_attempts (int): number of attempts
+        """
+
+        last_error = None
+
+        with open(journal.partial_path, "r+b") as filedown:
+            for _attempt in range(max_attempts):
+                position, end = journal.remaining(index)
+                if position > end:
+                    return
+
+                data = self._download_response(url, start_byte=position, end_byte=end)
+                if not data.get("success", False):
+                    last_error = requests.exceptions.RequestException(data["message"])
+                    continue
+
+                resp_obj = data.get("response_object")
+                if resp_obj.status_code != 206:
+                    resp_obj.close()
+                    raise requests.exceptions.RequestException(
+                        f"Server ignored the range request for bytes {position}-{end}"
+                    )
+
+                transfer = {"bytes": 0, "started_at": time.perf_counter()}
+                try:
+                    filedown.seek(position)
+                    for chunk in resp_obj.iter_content(chunk_size=1024 * 1024):
+                        if chunk:
+                            filedown.write(chunk)
+                            journal.advance(index, len(chunk))
+                            transfer["bytes"] += len(chunk)
+                except requests.exceptions.RequestException as error:
+                    last_error = transfer["error"] = error
+                    continue
+                finally:
+                    filedown.flush()
+                    resp_obj.close()
+                    self._emit_transfer_event(url, resp_obj, transfer)
+
+            position, end = journal.remaining(index)
+            if position <= end:
+                raise requests.exceptions.ChunkedEncodingError(
+                    f"Incomplete range: bytes {position}-{end} missing"
+                ) from last_error
+
     def _resolve_api_url(self, url):
         return urljoin(self._base_api_url, url)
 
@@ -469,29 +1048,60 @@ class PzRequests:
         """
         Posts a record to the API.
 
+        The multipart body is streamed from disk, so the files are never
+        loaded in memory.
+
         Args:
             url (str): url to post.
             payload (str): payload to post.
+            upload_files (dict, optional): form field name -> file path.
 
         Returns:
             dict: data of the request.
         """
 
-        files = {}
+        body = MultipartStream(payload, upload_files)
 
-        if upload_files:
-            for key, value in upload_files.items():
-                files[key] = open(value, "rb")  # pylint: disable=consider-using-with
+        try:
+            req = requests.Request(
+                "POST",
+                url,
+                data=body,
+                headers=dict(
+                    {
+                        "Authorization": f"Token {self._token}",
+                        "Content-Type": body.content_type,
+                    }
+                ),
+            )
+            return self._send_request(req.prepare())
+        finally:
+            body.close()
+
+    def _put_request(self, url, body, headers=None) -> dict:
+        """
+        Puts raw content to the API.
+
+        Args:
+            url (str): url to put.
+            body (bytes or file-like): content to put.
+            headers (dict, optional): extra headers. Defaults to None.
+
+        Returns:
+            dict: data of the request.
+        """
 
         req = requests.Request(
-            "POST",
+            "PUT",
             url,
-            data=payload,
-            files=files,
+            data=body,
             headers=dict(
                 {
+                    "Accept": "application/json",
+                    "Content-Type": "application/octet-stream",
                     "Authorization": f"Token {self._token}",
-                }
+                },
+                **(headers or {}),
             ),
         )
         return self._send_request(req.prepare())
@@ -582,29 +1192,92 @@ class PzRequests:
 
         return list(resp.keys())
 
-    def get_all(self, entity, ordering=None) -> list:
+    def _iter_pages(self, url, params=None, cache_ttl=None):
         """
-        Returns a list with all records of the entity.
+        Iterates over the records of a paginated endpoint.
+
+        Follows the "next" links of the paginated responses lazily. While
+        the caller consumes the records of one page, the next page is
+        fetched in the background.
+
+        Args:
+            url (str): url of the first page
+            params (dict, optional): query params of the first page.
+            cache_ttl (float, optional): when given, pages go through the
+                metadata cache with this ttl. Defaults to None (no cache).
+
+        Yields:
+            dict: record
+        """
+
+        def get_page(page_url, query=None):
+            if cache_ttl is None:
+                return self._get_request(page_url, params=query)
+            return self._cached_request(page_url, query, ttl=cache_ttl)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            resp = get_page(url, params)
+
+            while True:
+                if "success" in resp and resp["success"] is False:
+                    raise requests.exceptions.RequestException(resp["message"])
+
+                page = resp.get("data")
+
+                # endpoints without pagination return the records directly
+                if not isinstance(page, dict):
+                    yield from page or []
+                    return
+
+                next_url = page.get("next")
+                next_page = (
+                    executor.submit(get_page, next_url) if next_url else None
+                )
+
+                try:
+                    yield from page.get("results") or []
+                except GeneratorExit:
+                    if next_page:
+                        next_page.cancel()
+                    raise
+
+                if next_page is None:
+                    return
+
+                resp = next_page.result()
+
+    def iter_all(self, entity, ordering=None, page_size=None):
+        """
+        Iterates over all records of the entity, page by page.
 
         Args:
             entity (str): entity name  e.g. "releases", "products", "product-types"
             ordering (None or str): column name to be ordered
+            page_size (int, optional): number of records requested per page.
 
-        Returns:
-            list: list of records
+        Yields:
+            dict: record
         """
 
-        uri = f"{self._base_api_url}{entity}/"
+        yield from self._iter_pages(
+            f"{self._base_api_url}{entity}/",
+            page_params(ordering, page_size),
+            cache_ttl=self._entity_ttl(entity)
+        )
 
-        if ordering:
-            uri += f"?ordering={ordering}"
+    def get_all(self, entity, ordering=None) -> list:
+        """
+        Returns a list with all records of the entity.
 
-        resp = self._get_request(uri)
+        Args:
+            entity (str): entity name  e.g. "releases", "products", "product-types"
+            ordering (None or str): column name to be ordered
 
-        if "success" in resp and resp["success"] is False:
-            raise requests.exceptions.RequestException(resp["message"])
+        Returns:
+            list: list of records
+        """
 
-        return resp.get("data").get("results")
+        return list(self.iter_all(entity, ordering=ordering))
 
     def get(self, entity, _id) -> dict:
         """
@@ -618,7 +1291,9 @@ class PzRequests:
             dict: record metadata
         """
 
-        data = self._get_request(f"{self._base_api_url}{entity}/{_id}/")
+        data = self._cached_request(
+            f"{self._base_api_url}{entity}/{_id}/", ttl=self._entity_ttl(entity)
+        )
 
         if "success" in data and data["success"] is False:
             raise requests.exceptions.RequestException(data["message"])
@@ -637,16 +1312,7 @@ class PzRequests:
             dict: record metadata
         """
 
-        data = self.get_by_attribute(entity, "name", name)
-
-        nobj = data.get("count")
-        if nobj > 1:
-            raise requests.exceptions.RequestException(
-                f"The return should be unique [return = {nobj} objects]"
-            )
-
-        result = data.get("results")
-        return result[0] if result else None
+        return unique_result(self.get_by_attribute(entity, "name", name))
 
     def get_by_attribute(self, entity, attribute, value) -> dict:
         """
@@ -661,7 +1327,11 @@ class PzRequests:
             dict: record metadata
         """
 
-        data = self._get_request(f"{self._base_api_url}{entity}/?{attribute}={value}")
+        data = self._cached_request(
+            f"{self._base_api_url}{entity}/",
+            {attribute: value},
+            ttl=self._entity_ttl(entity),
+        )
 
         if "success" in data and data["success"] is False:
             raise requests.exceptions.RequestException(data["message"])
@@ -679,7 +1349,7 @@ class PzRequests:
             dict: options metadata (filters, search and ordering).
         """
 
-        opt = self._options_request(f"{self._base_api_url}{entity}/")
+        opt = self._cached_request(f"{self._base_api_url}{entity}/", method="OPTIONS")
         if "success" in opt and opt["success"] is False:
             raise requests.exceptions.RequestException(opt["message"])
 
@@ -693,7 +1363,8 @@ class PzRequests:
             _id (int): record id
             save_in (str): location where the file will be saved
             timeout (int): maximum seconds to wait for archive preparation
-            poll_interval (int): seconds between status checks
+            poll_interval (int): seconds before the first status check; the
+                interval then grows up to 30 seconds
 
         Returns:
             dict: record data
@@ -714,6 +1385,102 @@ class PzRequests:
             save_in,
         )
 
+    def open_main_file_archive(self, _id, timeout=1800, poll_interval=2):
+        """
+        Opens the prepared main file archive of a record for random
+        access, so single members can be read without downloading it.
+
+        Args:
+            _id (int): record id
+            timeout (int): maximum seconds to wait for archive preparation
+            poll_interval (int): seconds before the first status check; the
+                interval then grows up to 30 seconds
+
+        Returns:
+            RemoteFile: seekable file object, or None when the server does
+                not serve byte ranges
+        """
+
+        archive = self._prepare_product_main_file_download(_id)
+        archive = self._wait_for_product_download_ready(
+            _id,
+            archive,
+            timeout=timeout,
+            poll_interval=poll_interval,
+            status_getter=self._get_product_main_file_download_status,
+            download_name="Product main file",
+        )
+
+        return self._open_remote_file(self._resolve_api_url(archive["download_url"]))
+
+    def _open_remote_file(self, url):
+        """
+        Probes a download url with a one-byte range request.
+
+        Args:
+            url (str): url of the file
+
+        Returns:
+            RemoteFile: seekable file object, or None when the server does
+                not return partial content (206) for range requests
+        """
+
+        data = self._download_response(url, start_byte=0, end_byte=0)
+        if not data.get("success", False):
+            raise requests.exceptions.RequestException(data["message"])
+
+        resp_obj = data.get("response_object")
+        resp_obj.close()
+        match = re.match(
+            r"bytes \d+-\d+/(\d+)$", resp_obj.headers.get("Content-Range", "")
+        )
+        if resp_obj.status_code != 206 or not match:
+            return None
+
+        return RemoteFile(
+            lambda start, end: self._fetch_range(url, start, end),
+            int(match.group(1)),
+        )
+
+    def _fetch_range(self, url, start, end) -> bytes:
+        """
+        Fetches a byte range of a file.
+
+        Args:
+            url (str): url of the file
+            start (int): first byte
+            end (int): last byte (inclusive)
+
+        Returns:
+            bytes: content of the range
+        """
+
+        data = self._download_response(url, start_byte=start, end_byte=end)
+        if not data.get("success", False):
+            raise requests.exceptions.RequestException(data["message"])
+
+        resp_obj = data.get("response_object")
+        transfer = {"bytes": 0, "started_at": time.perf_counter()}
+        try:
+            if resp_obj.status_code != 206:
+                raise requests.exceptions.RequestException(
+                    f"Server ignored the range request for bytes {start}-{end}"
+                )
+            content = resp_obj.content
+            transfer["bytes"] = len(content)
+        except requests.exceptions.RequestException as error:
+            transfer["error"] = error
+            raise
+        finally:
+            resp_obj.close()
+            self._emit_transfer_event(url, resp_obj, transfer)
+
+        if len(content) != end - start + 1:
+            raise requests.exceptions.ChunkedEncodingError(
+                f"Incomplete range: got {len(content)} of bytes {start}-{end}"
+            )
+        return content
+
     def get_product_files(self, product_id) -> list:
         """
         Gets all files from a product.
@@ -725,15 +1492,13 @@ class PzRequests:
             list: list of files
         """
 
-        data = self._get_request(
-            f"{self._base_api_url}product-files/?product_id={product_id}"
+        return list(
+            self._iter_pages(
+                f"{self._base_api_url}product-files/",
+                {"product_id": product_id},
+            )
         )
 
-        if "success" in data and data["success"] is False:
-            raise requests.exceptions.RequestException(data["message"])
-
-        return data.get("data").get("results")
-
     def delete_product_file(self, file_id) -> None:
         """
         Deletes a file from a product.
@@ -775,29 +1540,16 @@ class PzRequests:
             dict: record data
         """
 
-        resp = self._get_request(
-            f"{self._base_api_url}products/{_id}/main_file_info/",
+        resp = self._cached_request(
+            f"{self._base_api_url}products/{_id}/main_file_info/", ttl=0
         )
 
         if "success" in resp and resp["success"] is False:
             raise requests.exceptions.RequestException(resp["message"])
 
-        data = resp.get("data").get("main_file")
-
-        if data.get("associated_columns", None):
-            columns = []
-            assoc_cols = []
-            for col in data.get("associated_columns"):
-                columns.append(col.get("column_name"))
-
-                if col.get("alias", None):
-                    assoc_cols.append(col)
-
-            data["columns"] = columns
-            data["columns_association"] = assoc_cols
-            del data["associated_columns"]
+        return self._main_file_info_from_data(resp.get("data").get("main_file"))
 
-        return data
+    _main_file_info_from_data = staticmethod(main_file_info_from_data)
 
     def _prepare_product_download(self, _id):
         data = self._post_request(
@@ -818,7 +1570,7 @@ class PzRequests:
         if "success" in data and data["success"] is False:
             raise requests.exceptions.RequestException(data["message"])
 
-        return data.get("data")
+        return self._archive_with_retry_after(data)
 
     def _prepare_product_main_file_download(self, _id):
         data = self._post_request(
@@ -839,7 +1591,34 @@ class PzRequests:
         if "success" in data and data["success"] is False:
             raise requests.exceptions.RequestException(data["message"])
 
-        return data.get("data")
+        return self._archive_with_retry_after(data)
+
+    @staticmethod
+    def _archive_with_retry_after(data):
+        """
+        Returns the archive status, keeping the Retry-After header of the
+        response as the "retry_after" hint used by the poller.
+
+        Args:
+            data (dict): response of a download status request
+
+        Returns:
+            dict: archive status
+        """
+
+        archive = data.get("data")
+        response = data.get("response_object")
+
+        if isinstance(archive, dict) and response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after is not None:
+                archive.setdefault("retry_after", retry_after)
+
+        return archive
+
+    @classmethod
+    def _next_poll_interval(cls, interval, archive, max_interval):
+        return next_poll_interval(interval, archive, max_interval, cls._poll_backoff)
 
     def _wait_for_product_download_ready(
         self,
@@ -848,38 +1627,140 @@ class PzRequests:
         timeout=1800,
         poll_interval=2,
         *,
+        max_poll_interval=None,
+        status_getter=None,
+        download_name="Product download",
+    ):
+        for _, ready, error in self._iter_ready_archives(
+            {_id: archive},
+            timeout=timeout,
+            poll_interval=poll_interval,
+            max_poll_interval=max_poll_interval,
+            status_getter=status_getter,
+            download_name=download_name,
+        ):
+            if error is not None:
+                raise error
+            return ready
+
+        return self._check_download_archive(archive, download_name)
+
+    def _iter_ready_archives(
+        self,
+        archives,
+        timeout=1800,
+        poll_interval=2,
+        *,
+        max_poll_interval=None,
         status_getter=None,
         download_name="Product download",
     ):
+        """
+        Waits for many download archives from a single polling loop.
+
+        Each archive has its own schedule: the first check happens after
+        poll_interval seconds and the interval then grows exponentially
+        up to max_poll_interval, or follows the server hints (see
+        _next_poll_interval). Archives are yielded as soon as they leave
+        the pending/running states.
+
+        Args:
+            archives (dict): product id -> archive status returned by the
+                prepare request
+            timeout (int): maximum seconds to wait for all the archives
+            poll_interval (float): seconds before the first status check
+            max_poll_interval (float, optional): maximum seconds between
+                status checks. Defaults to 30.
+            status_getter (callable, optional): function returning the
+                archive status of a product id.
+            download_name (str, optional): name used in error messages
+
+        Yields:
+            tuple: product id, archive status (None on errors) and the
+                RequestException raised for it (None when ready)
+        """
+
         deadline = time.monotonic() + timeout
         status_getter = status_getter or self._get_product_download_status
+        if max_poll_interval is None:
+            max_poll_interval = max(self._max_poll_interval, poll_interval)
+        schedule = []
+
+        for order, (_id, archive) in enumerate(archives.items()):
+            if archive and archive.get("status") in ("pending", "running"):
+                # the server hint or poll_interval, with no growth yet
+                self._schedule_poll(
+                    schedule,
+                    (order, _id),
+                    next_poll_interval(
+                        poll_interval, archive, max_poll_interval, backoff=1
+                    ),
+                )
+            else:
+                yield self._settle_archive(_id, archive, download_name)
+
+        while schedule:
+            due, order, _id, interval = heapq.heappop(schedule)
 
-        while archive and archive.get("status") in ("pending", "running"):
             if time.monotonic() >= deadline:
-                raise requests.exceptions.RequestException(
-                    f"{download_name} is still being prepared. Please try again later."
+                yield from self._expire_polls(schedule, _id, download_name)
+                return
+
+            time.sleep(max(0, min(due, deadline) - time.monotonic()))
+
+            try:
+                archive = status_getter(_id)
+            except requests.exceptions.RequestException as error:
+                yield _id, None, error
+                continue
+
+            if archive and archive.get("status") in ("pending", "running"):
+                self._schedule_poll(
+                    schedule,
+                    (order, _id),
+                    self._next_poll_interval(interval, archive, max_poll_interval),
                 )
+            else:
+                yield self._settle_archive(_id, archive, download_name)
 
-            time.sleep(poll_interval)
-            archive = status_getter(_id)
+    @staticmethod
+    def _schedule_poll(schedule, entry, interval):
+        """
+        Schedules the next status check of an archive.
 
-        if archive and archive.get("status") == "failed":
-            raise requests.exceptions.RequestException(
-                archive.get("error_message") or f"Failed to prepare {download_name}."
-            )
+        Args:
+            schedule (list): heap of (due time, order, id, interval)
+            entry (tuple): order and id of the archive
+            interval (float): seconds before the check
+        """
 
-        if not archive or archive.get("status") != "ready":
-            raise requests.exceptions.RequestException(
-                f"{download_name} archive is not ready."
-            )
+        order, _id = entry
+        heapq.heappush(schedule, (time.monotonic() + interval, order, _id, interval))
 
-        download_url = archive.get("download_url")
-        if not download_url:
-            raise requests.exceptions.RequestException(
-                f"{download_name} archive is ready but no download URL was returned."
-            )
+    @staticmethod
+    def _expire_polls(schedule, _id, download_name):
+        """
+        Reports the archive being checked and the scheduled ones as not
+        ready once the timeout is over.
 
-        return archive
+        Yields:
+            tuple: product id, None and the RequestException
+        """
+
+        error = requests.exceptions.RequestException(
+            f"{download_name} is still being prepared. Please try again later."
+        )
+        yield _id, None, error
+        for _, _, pending_id, _ in sorted(schedule):
+            yield pending_id, None, error
+
+    def _settle_archive(self, _id, archive, download_name):
+        try:
+            return _id, self._check_download_archive(archive, download_name), None
+        except requests.exceptions.RequestException as error:
+            return _id, None, error
+
+    _check_download_archive = staticmethod(check_download_archive)
 
     def download_product(self, _id, save_in=".", timeout=1800, poll_interval=2):
         """
@@ -889,7 +1770,8 @@ class PzRequests:
             _id (int): record id
             save_in (str): location where the file will be saved
             timeout (int): maximum seconds to wait for archive preparation
-            poll_interval (int): seconds between status checks
+            poll_interval (int): seconds before the first status check; the
+                interval then grows up to 30 seconds
 
         Returns:
             dict: record data
@@ -908,6 +1790,74 @@ class PzRequests:
             save_in,
         )
 
+    def download_products(  # pylint: disable=too-many-arguments,too-many-locals
+        self,
+        ids,
+        save_in=".",
+        *,
+        timeout=1800,
+        poll_interval=2,
+        max_poll_interval=None,
+        max_workers=4,
+    ):
+        """
+        Downloads many products to local.
+
+        The archives of all the products are prepared at once and waited
+        for from a single polling loop; each archive is downloaded as soon
+        as it is ready, while the others are still being prepared.
+
+        Args:
+            ids (list): record ids
+            save_in (str): location where the files will be saved
+            timeout (int): maximum seconds to wait for archive preparation
+            poll_interval (int): seconds before the first status check
+            max_poll_interval (int, optional): maximum seconds between
+                status checks. Defaults to 30.
+            max_workers (int, optional): maximum number of simultaneous
+                downloads. Defaults to 4.
+
+        Returns:
+            dict: record id -> response of each download (success, message)
+        """
+
+        results = {}
+        archives = {}
+
+        for _id in ids:
+            try:
+                archives[_id] = self._prepare_product_download(_id)
+            except requests.exceptions.RequestException as error:
+                results[_id] = {"success": False, "message": str(error)}
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {}
+
+            for _id, archive, error in self._iter_ready_archives(
+                archives,
+                timeout=timeout,
+                poll_interval=poll_interval,
+                max_poll_interval=max_poll_interval,
+            ):
+                if error is not None:
+                    results[_id] = {"success": False, "message": str(error)}
+                    continue
+
+                future = executor.submit(
+                    self._download_request,
+                    self._resolve_api_url(archive["download_url"]),
+                    save_in,
+                )
+                futures[future] = _id
+
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except (OSError, requests.exceptions.RequestException) as error:
+                    results[futures[future]] = {"success": False, "message": str(error)}
+
+        return {_id: results[_id] for _id in ids}
+
     def start_process(self, data, files=None):
         """
         Start process in Pz Server
@@ -997,7 +1947,9 @@ class PzRequests:
 
         return upload.get("data")
 
-    def upload_file(self, product_id, filepath, role, mimetype=None):
+    def upload_file(  # pylint: disable=too-many-arguments
+        self, product_id, filepath, role, mimetype=None, chunk_size=None
+    ):
         """Upload file
 
         Args:
@@ -1005,17 +1957,18 @@ class PzRequests:
             filepath (str): filepath
             role (str): file role
             mimetype (str, optional): file mimetype. Defaults to None.
+            chunk_size (int, optional): upload files larger than this many
+                bytes in resumable parts. Defaults to the upload_chunk_size
+                option.
         """
 
-        file_roles = {
-            "main": 0,
-            "description": 1,
-            "auxiliary": 2,
-        }
+        chunk_size = chunk_size or self._upload_chunk_size
+        if chunk_size and pathlib.Path(filepath).stat().st_size > chunk_size:
+            return self._chunked_upload(product_id, filepath, role, mimetype, chunk_size)
 
         upload_file_data = {
             "product": product_id,
-            "role": file_roles.get(role),
+            "role": self._file_roles.get(role),
             "type": mimetype,
         }
 
@@ -1032,6 +1985,130 @@ class PzRequests:
 
         return upload.get("data")
 
+    def _chunked_upload(  # pylint: disable=too-many-arguments
+        self, product_id, filepath, role, mimetype, chunk_size
+    ):
+        """
+        Uploads a file in fixed-size parts.
+
+        Protocol (under product-files/uploads/):
+            POST   uploads/           starts an upload and returns its "id"
+                                      (the server may adjust "chunk_size");
+            PUT    uploads/{id}/      sends one part, with a Content-Range
+                                      header, as raw bytes;
+            GET    uploads/{id}/      lists the "parts" already received;
+            POST   uploads/{id}/complete/
+                                      assembles the file and returns the
+                                      product file record.
+
+        Each part is streamed from disk and retried according to the
+        retry policy. Progress is kept in a local journal: calling
+        upload_file again after a failure or a crash sends only the
+        missing parts.
+
+        Args:
+            product_id (int): product id
+            filepath (str): filepath
+            role (str): file role
+            mimetype (str): file mimetype
+            chunk_size (int): size of each part in bytes
+
+        Returns:
+            dict: product file record
+        """
+
+        uploads_url = f"{self._base_api_url}product-files/uploads/"
+        journal = self._resumed_upload_journal(uploads_url, product_id, filepath, role)
+
+        if not journal.upload_id:
+            created = self._post_request(
+                uploads_url,
+                payload={
+                    "product": product_id,
+                    "role": self._file_roles.get(role),
+                    "type": mimetype,
+                    "filename": pathlib.Path(filepath).name,
+                    "size": journal.size,
+                    "chunk_size": chunk_size,
+                },
+            )
+            if "success" in created and created["success"] is False:
+                raise requests.exceptions.RequestException(created["message"])
+
+            created = created.get("data")
+            journal.start(created["id"], created.get("chunk_size") or chunk_size)
+
+        upload_url = f"{uploads_url}{journal.upload_id}/"
+        self._upload_missing_parts(upload_url, filepath, journal)
+
+        upload = self._post_request(f"{upload_url}complete/", payload={})
+
+        if "success" in upload and upload["success"] is False:
+            raise requests.exceptions.RequestException(upload["message"])
+
+        journal.remove()
+        return upload.get("data")
+
+    def _resumed_upload_journal(self, uploads_url, product_id, filepath, role):
+        """
+        Loads the journal of a chunked upload, updated with the parts the
+        server already received. An upload unknown to the server is
+        started again.
+
+        Args:
+            uploads_url (str): url of the uploads endpoint
+            product_id (int): product id
+            filepath (str): filepath
+            role (str): file role
+
+        Returns:
+            UploadJournal: journal (without upload_id for a new upload)
+        """
+
+        journal = UploadJournal(self._upload_journal_dir, product_id, filepath, role)
+
+        if journal.upload_id:
+            status = self._get_request(f"{uploads_url}{journal.upload_id}/")
+            if status.get("success", False):
+                # the server is the reference for the parts already received
+                journal.parts = set(status.get("data", {}).get("parts", []))
+                journal.save()
+            else:
+                journal.upload_id = None
+
+        return journal
+
+    def _upload_missing_parts(self, upload_url, filepath, journal):
+        """
+        Sends the parts of a chunked upload the journal does not record
+        as received, recording each one as it is sent.
+
+        Args:
+            upload_url (str): url of the upload
+            filepath (str): filepath
+            journal (UploadJournal): journal of the upload
+        """
+
+        for index in journal.missing_parts():
+            offset = index * journal.chunk_size
+            part = FileSlice(filepath, offset, journal.chunk_size)
+            last_byte = offset + len(part) - 1
+            try:
+                resp = self._put_request(
+                    upload_url,
+                    part,
+                    headers={"Content-Range": f"bytes {offset}-{last_byte}/{journal.size}"},
+                )
+            finally:
+                part.close()
+
+            if "success" in resp and resp["success"] is False:
+                raise requests.exceptions.RequestException(
+                    f"Upload of part {index + 1}/{journal.n_parts} failed: "
+                    f"{resp['message']}. Call upload_file again to resume."
+                )
+            journal.mark_done(index)
+
     def registry_upload(self, product_id):
         """Registry upload
 
@@ -1098,35 +2175,155 @@ class PzRequests:
 
         return update.get("data")
 
-    def get_products(self, filters=None, status=1) -> list:
+    def _products_params(self, filters=None, status=1) -> dict:
         """
-        Returns list of products according to a filter
+        Builds the query params used to list products.
 
         Args:
             filters (dict): products filter   ex: {'release': 'LSST'}
             status (int): products status (1 is viewing only completed products)
 
         Returns:
-            list: list of records
+            dict: query params
         """
 
-        url = f"{self._base_api_url}/products/?"
+        params = {}
 
         if status:
-            url += f"status={str(status)}"
+            params["status"] = str(status)
 
         if filters:
             self._check_filters("products", filters)
-            for key, value in filters.items():
-                value = (
-                    list(map(str, value)) if isinstance(value, list) else [str(value)]
-                )
-                key = self._mapping_filters.get(key, key)
-                url += f"&{key}={','.join(value)}"
+            params.update(self._filters_params(filters))
 
-        resp = self._get_request(url)
+        return params
 
-        if "success" in resp and resp["success"] is False:
-            raise requests.exceptions.RequestException(resp["message"])
+    def iter_products(self, filters=None, status=1, page_size=None):
+        """
+        Iterates over the products according to a filter, page by page.
+
+        Args:
+            filters (dict): products filter   ex: {'release': 'LSST'}
+            status (int): products status (1 is viewing only completed products)
+            page_size (int, optional): number of records requested per page.
+
+        Yields:
+            dict: product record
+        """
+
+        params = self._products_params(filters, status)
+
+        if page_size:
+            params["page_size"] = page_size
+
+        yield from self._iter_pages(f"{self._base_api_url}products/", params)
+
+    def get_products(self, filters=None, status=1) -> list:
+        """
+        Returns list of products according to a filter
+
+        Args:
+            filters (dict): products filter   ex: {'release': 'LSST'}
+            status (int): products status (1 is viewing only completed products)
+
+        Returns:
+            list: list of records
+        """
+
+        return list(self.iter_products(filters, status=status))
+
+
+class _RangeJournal:
+    """
+    Progress of a parallel ranged download, persisted next to the
+    ".part" file so an interrupted download can be resumed.
+    """
+
+    _save_interval = 1.0
+
+    def __init__(self, path, partial_path, total_size, connections):
+        """
+        Loads the journal or creates it, preallocating the partial file.
+
+        Args:
+            path (pathlib.Path): journal file path
+            partial_path (pathlib.Path): ".part" file path
+            total_size (int): size of the complete file in bytes
+            connections (int): number of segments for a new download
+        """
+
+        self.path = pathlib.Path(path)
+        self.partial_path = pathlib.Path(partial_path)
+        self.total_size = total_size
+        self.segments = None
+        self._lock = threading.Lock()
+        self._saved_at = time.monotonic()
+
+        if self.path.exists() and self.partial_path.exists():
+            try:
+                saved = json.loads(self.path.read_text(encoding="utf-8"))
+                if saved.get("size") == total_size:
+                    self.segments = [list(segment) for segment in saved["segments"]]
+            except (ValueError, KeyError):
+                self.segments = None
+
+        if self.segments is None:
+            # an existing single-stream ".part" file is a completed prefix
+            done = 0
+            if self.partial_path.exists() and not self.path.exists():
+                done = min(self.partial_path.stat().st_size, total_size)
+
+            step = max(1, -(-(total_size - done) // connections))
+            self.segments = [
+                [start, min(start + step, total_size) - 1, 0]
+                for start in range(done, total_size, step)
+            ]
+            if done:
+                self.segments.insert(0, [0, done - 1, done])
+
+            with open(self.partial_path, "ab") as partial:
+                partial.truncate(total_size)
+            self.save()
+
+    def remaining(self, index):
+        """
+        Returns the next byte to fetch and the last byte of a segment.
+        """
+
+        with self._lock:
+            start, end, written = self.segments[index]
+            return start + written, end
+
+    def advance(self, index, size):
+        """
+        Records that size bytes of a segment were written.
+        """
+
+        with self._lock:
+            self.segments[index][2] += size
+            if time.monotonic() - self._saved_at >= self._save_interval:
+                self._save()
+
+    def save(self):
+        """
+        Persists the journal.
+        """
+
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        tmp_path.write_text(
+            json.dumps({"size": self.total_size, "segments": self.segments}),
+            encoding="utf-8",
+        )
+        tmp_path.replace(self.path)
+        self._saved_at = time.monotonic()
+
+    def remove(self):
+        """
+        Removes the journal once the download is complete.
+        """
 
-        return resp.get("data").get("results")
+        self.path.unlink(missing_ok=True)
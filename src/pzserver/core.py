@@ -2,22 +2,25 @@
 Classes responsible for managing user interaction
 """
 
-import importlib
-import pathlib
 import tempfile
 import time
-import zipfile
 
 import pandas as pd
-import requests
+import pyarrow as pa
 import tables_io
-from astropy.table import Table
 from IPython.display import display
 
 from .catalog import SpeczCatalog, TrainingSet
 from .communicate import PzRequests
+from .hats_catalog import HatsCatalogMixin
+from .many_products import ManyProductsMixin
 from .process import CRCProcess, TSMProcess
 from .product import PzProduct
+from .product_cache import ProductCache
+from .product_files import ProductFilesMixin
+from .readers import (check_return_type, convert_table, from_astropy,
+                      parse_filters, read_main_table, resolve_columns)
+from .spill import write_mapped
 from .upload import PzUpload, UploadData
 
 pd.options.display.max_colwidth = None
@@ -26,19 +29,31 @@ pd.options.display.max_rows = 6
 
 FONTCOLORERR = "\033[38;2;255;0;0m"
 FONTCOLOREND = "\033[0m"
-HATS_DIRECTORY_MESSAGE = (
-    "This product main file is a directory-based dataset, such as a "
-    "HATS collection."
+PRODUCT_NOT_FOUND = (
+    f"product not found.\n{FONTCOLORERR}"
+    "Please find the list of products available with "
+    f"display_products_list() or get_products_list(){FONTCOLOREND}"
 )
-MAX_IN_MEMORY_PRODUCT_SIZE_BYTES = 200 * 1024**2
 
 
-class PzServer:
+class PzServer(HatsCatalogMixin, ManyProductsMixin, ProductFilesMixin):
     """
     Responsible for managing user interactions with the Pz Server app.
     """
 
-    def __init__(self, token=None, host="pz"):
+    cache = None
+    memory_budget = None
+    spill_directory = None
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        token=None,
+        host="pz",
+        cache=False,
+        memory_budget=None,
+        spill_directory=None,
+        **api_options,
+    ):
         """
         PzServer class constructor
 
@@ -48,6 +63,24 @@ class PzServer:
                         "pz-dev" (test environment) or
                         "localhost" (dev environment) or
                         "api url"
+            cache (bool or ProductCache, optional): persistent cache of
+                downloaded product files used by get_product and
+                download_product. True uses a ProductCache in
+                "~/.cache/pzserver/products", which may grow up to
+                10 GB, including the parsed Arrow copies written by
+                get_product; pass a ProductCache to choose another
+                directory or size budget. Defaults to False (no files
+                are kept on disk).
+            memory_budget (int, optional): bytes of memory get_product
+                may use without get_big_products=True. Defaults to half
+                of the available memory.
+            spill_directory (str, optional): directory of the
+                memory-mapped files written by get_product(spill=True).
+                Defaults to the system temporary directory.
+            **api_options: connection options forwarded to PzRequests
+                (e.g. pool_connections, pool_maxsize, pool_block,
+                keep_alive, download_connections, metadata_cache,
+                retry_policy, upload_chunk_size, upload_journal_dir).
         """
 
         if token is None:
@@ -55,7 +88,25 @@ class PzServer:
                 f"{FONTCOLORERR}Please provide a valid token.{FONTCOLOREND}"
             )
 
-        self.api = PzRequests(token, host)
+        self.api = PzRequests(token, host, **api_options)
+
+        if cache is True:
+            cache = ProductCache()
+        self.cache = cache or None
+        self.memory_budget = memory_budget
+        self.spill_directory = spill_directory
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Closes the connections kept open to the Photo-z Server.
+        """
+        self.api.close()
 
     # ---- methods to get general info ----#
     def get_product_types(self) -> list:
@@ -176,6 +227,26 @@ class PzServer:
         """
         return self.api.get_products(filters)
 
+    def iter_products_list(self, filters=None, page_size=None):
+        """
+        Iterates over the data products available.
+
+        Same as get_products_list(), but the products are
+        fetched page by page while they are consumed, so
+        long listings are never held in memory at once.
+
+        Args:
+            filters (dict): dictionary with a string
+                (or a list of strings) patterns to
+                filter the results.
+            page_size (int, optional): number of products
+                requested per page.
+
+        Yields:
+            data product metadata (dict)
+        """
+        yield from self.api.iter_products(filters, page_size=page_size)
+
     def display_products_list(self, filters=None):
         """
         Displays the list of data products as dataframe
@@ -190,22 +261,24 @@ class PzServer:
                 (or a list of strings) patterns to
                 filter the results.
         """
-        results_dict = self.get_products_list(filters)
-        dataframe = pd.DataFrame(
-            results_dict,
-            columns=[
-                "id",
-                "internal_name",
-                "display_name",
-                "product_type_name",
-                "release_name",
-                "uploaded_by",
-                "official_product",
-                "pz_code",
-                "description",
-                "created_at",
-            ],
+        columns = [
+            "id",
+            "internal_name",
+            "display_name",
+            "product_type_name",
+            "release_name",
+            "uploaded_by",
+            "official_product",
+            "pz_code",
+            "description",
+            "created_at",
+        ]
+        # keeps only the displayed fields of each product while paging
+        records = (
+            tuple(product.get(column) for column in columns)
+            for product in self.iter_products_list(filters)
         )
+        dataframe = pd.DataFrame.from_records(records, columns=columns)
 
         dataframe.rename(
             columns={
@@ -244,11 +317,7 @@ class PzServer:
                 plist = self.api.get_products({"internal_name": product_id})
                 metaprod = dict(plist[0])
         except Exception as excp:
-            msg = f"product not found.\n{FONTCOLORERR}"
-            msg += "Please find the list of products available with "
-            msg += "display_products_list() or get_products_list()"
-            msg += FONTCOLOREND
-            raise ValueError(msg) from excp
+            raise ValueError(PRODUCT_NOT_FOUND) from excp
 
         if mainfile_info:
             metaprod["main_file"] = self.api.get_main_file_info(metaprod["id"])
@@ -333,34 +402,18 @@ class PzServer:
         """
         return PzProduct(product_id, self.api)
 
-    def download_product(self, product_id=None, save_in="."):
-        """
-        Download the data to local.
-
-        Connects to the Photo-z Server's database and
-        download a compressed zip file containing all
-        the data and metadata of a given data product.
-
-        Args:
-            product_id (str or int): data product
-                unique identifier (product id
-                number or internal_name)
-            save_in (str): location where the file will
-                be saved
-
-        """
-        print("Connecting to PZ Server...")
-
-        prodid = self.get_product_metadata(product_id, mainfile_info=False)["id"]
-
-        results_dict = self.api.download_product(prodid, save_in)
-        if results_dict.get("success", False):
-            print(f"File saved as: {results_dict['message']}")
-            print("Done!")
-        else:
-            print(f"{FONTCOLORERR}Error: {results_dict['message']}{FONTCOLORERR}")
-
-    def get_product(self, product_id=None, get_big_products=False):
+    def get_product(  # pylint: disable=too-many-arguments,too-many-locals
+        self,
+        product_id=None,
+        get_big_products=False,
+        *,
+        columns=None,
+        filters=None,
+        return_type="astropy",
+        lazy=False,
+        region=None,
+        spill=False,
+    ):
         """
         Fetches the data product contents to local.
 
@@ -368,225 +421,154 @@ class PzServer:
         fetches the tabular data stored as registered
         data product.
 
+        With the product cache enabled, the parsed contents of
+        the main file are stored once as an Arrow IPC file and
+        memory-mapped by later calls instead of parsing the main
+        file again; numeric columns are shared with every process
+        reading the same product until they are modified.
+
         Args:
             product_id (str or int): data product
                 unique identifier (product id
                 number or internal name)
             get_big_products (bool, optional): allow products whose
-                stored main file is larger than 200 MB to be loaded
-                into memory. Defaults to False.
-           
+                estimated memory footprint is over the memory budget
+                (see estimate_product_memory) to be loaded into memory.
+                Without row count information, products whose stored
+                main file is larger than 200 MB. Defaults to False.
+            columns (list, optional): columns to read, by name,
+                alias or UCD (e.g. ["ra", "dec", "z"]). Defaults
+                to all columns.
+            filters (str, tuple or list, optional): row filters
+                such as "z < 1.5" or ("z", "<", 1.5), or a list
+                of them (all must hold). Columns may be given by
+                name, alias or UCD. Filters are pushed down to
+                parquet and HATS readers and applied chunk by
+                chunk to CSV and HDF5 files.
+            return_type (str, optional): container of the returned
+                data: "astropy", "pandas", "arrow" (pyarrow.Table) or
+                "polars" (requires polars). Parquet, CSV and HDF5
+                contents are read as Arrow tables, so "arrow" and
+                "polars" cost no copy, "pandas" one copy with a peak
+                close to one copy, and "astropy" one copy. Other
+                formats (e.g. FITS) are read as astropy tables, so
+                every other container costs one copy. HATS catalogs
+                are computed as pandas.DataFrame, so "pandas" costs
+                no copy. Defaults to "astropy".
+            lazy (bool, optional): for HATS products, return the
+                opened LSDB catalog instead of computing it (see
+                open_hats_product). Defaults to False.
+            region (lsdb search, optional): sky region of a HATS
+                product, e.g. lsdb.ConeSearch(ra, dec, radius_arcsec),
+                lsdb.BoxSearch or lsdb.PolygonSearch. Only the
+                partitions intersecting the region are downloaded
+                (when the server serves byte ranges), and the size
+                limit of get_big_products does not apply.
+            spill (bool, optional): instead of refusing a product
+                over the memory budget, read it in batches cast to
+                the cheapest registered column types and spill them
+                to a memory-mapped Arrow file. The returned table is
+                backed by the mapped file rather than heap memory
+                (for pandas and astropy, numeric columns without
+                nulls are mapped numpy arrays). Defaults to False.
+
         Returns:
-            astropy.Table
+            astropy.Table, pandas.DataFrame, pyarrow.Table,
+            polars.DataFrame or lsdb.Catalog (lazy=True)
 
         """
+        check_return_type(return_type)
+
         print("Connecting to PZ Server...")
         metadata = self.get_product_metadata(product_id)
-        self._validate_product_size(metadata, product_id, get_big_products)
-        prod_type = metadata["product_type_internal_name"]
 
-        if prod_type in ("validation_results", "training_results"):
-            msg = f"does not support non-tabular data\n{FONTCOLORERR}"
-            msg += "The method get_product() only supports simple tabular "
-            msg += "data (product types: redshift_catalog, training_set). "
-            msg += f"For {prod_type}, please use method download_product()."
-            msg += FONTCOLOREND
-            raise ValueError(msg)
+        if lazy:
+            return self._open_hats_product(metadata, columns, filters, region=region)
+
+        needs_spill = False
+        if region is None:
+            needs_spill = self._validate_product_size(
+                metadata,
+                product_id,
+                get_big_products,
+                columns=columns,
+                return_type=return_type,
+                spill=spill,
+            )
+        self._check_tabular_product(metadata, product_id)
 
-        if not metadata["main_file"]:
-            raise FileNotFoundError(f"Product ID ({product_id}): main file not found")
+        columns = resolve_columns(columns, metadata["main_file"])
+        filters = parse_filters(filters, metadata["main_file"])
+        hats_options = self._hats_open_options(columns, filters, region)
+
+        if needs_spill:
+            return self._spill_product(metadata, columns, filters, return_type)
 
         if metadata["main_file"].get("is_directory"):
-            return self._get_hats_product(metadata)
+            if region is not None:
+                return convert_table(
+                    self._get_hats_region(metadata, **hats_options), return_type
+                )
+            return convert_table(
+                self._get_hats_product(metadata, **hats_options), return_type
+            )
 
-        file_extension = metadata["main_file"]["extension"]
+        parsed_path = self._cached_parsed_table(metadata) if region is None else None
+        if parsed_path is not None:
+            return self._read_parsed_table(parsed_path, columns, filters, return_type)
 
         with tempfile.TemporaryDirectory() as tmpdirname:
-            results_dict = self.api.download_main_file(metadata["id"], tmpdirname)
-
-            if not results_dict.get("success", False):
-                message = results_dict.get("message", "Failed to download main file.")
-                raise requests.exceptions.RequestException(message)
-
-            file_path = pathlib.Path(results_dict["message"])
+            file_path = self._main_file_path(metadata, tmpdirname)
             if file_path.suffix.lower() == ".zip":
-                return self._read_hats_archive(
+                data = self._read_hats_archive(
                     file_path,
                     metadata["main_file"].get("name"),
+                    **hats_options,
+                )
+            elif region is not None:
+                raise ValueError("region is only supported for HATS products.")
+            else:
+                data = self._parse_main_file(
+                    file_path, metadata["main_file"], columns, filters
                 )
 
-            if file_extension == ".csv":
-                # TBD: add CSV to tables_io supported formats
-                delimiter = metadata["main_file"].get("delimiter", None)
-                has_header = metadata["main_file"].get("has_header", False)
-                if has_header:
-                    dataframe = pd.read_csv(
-                        file_path,
-                        header=0,
-                        delimiter=delimiter,
-                    )
-                else:
-                    dataframe = pd.read_csv(
-                        file_path,
-                        header=None,
-                        names=metadata["main_file"].get("columns"),
-                        delimiter=delimiter,
-                    )
-                return Table.from_pandas(dataframe)
-            table = tables_io.read(file_path, tables_io.types.AP_TABLE)
-            return table
-
-    @staticmethod
-    def _validate_product_size(metadata, product_id, get_big_products):
-        """Prevent large products from being loaded into memory by default."""
-        main_file = metadata.get("main_file") or {}
-        size_bytes = main_file.get("size")
-        try:
-            is_too_large = float(size_bytes) > MAX_IN_MEMORY_PRODUCT_SIZE_BYTES
-        except (TypeError, ValueError):
-            is_too_large = False
-
-        if not is_too_large or get_big_products:
-            return
-
-        product_name = metadata.get("internal_name") or product_id
-        raise ValueError(
-            f"Product '{product_name}' is larger than 200 MB and cannot be loaded "
-            "into memory by default. PZ Server may store products in compressed "
-            "form, so this product can use substantially more RAM when decompressed. "
-            "We recommend downloading it and reading it locally with pandas, Dask, "
-            "or LSDB (for HATS catalogs):\n\n"
-            "from pathlib import Path\n\n"
-            f"prod_name = {product_name!r}\n"
-            'caminho = Path("./downloaded_data")\n'
-            "caminho.mkdir(parents=True, exist_ok=True)\n"
-            "pz_server.download_product(product_id=prod_name, save_in=caminho)\n\n"
-            "To continue anyway, call "
-            "get_product(product_id=prod_name, get_big_products=True)."
-        )
-
-    def _get_hats_product(self, metadata):
-        """Download a directory-based HATS main file and load it with LSDB."""
-        lsdb = self._import_lsdb()
-
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            archive_path = self._download_hats_main_file(metadata, tmpdirname)
-            return self._read_hats_archive(
-                archive_path,
-                metadata["main_file"].get("name"),
-                lsdb=lsdb,
-            )
+            if not (columns or filters) and file_path.suffix.lower() != ".zip":
+                self._cache_parsed_table(metadata, data)
 
-    def _download_hats_main_file(self, metadata, destination):
-        results_dict = self.api.download_main_file(metadata["id"], destination)
-        if results_dict.get("success", False):
-            return pathlib.Path(results_dict["message"])
-
-        raise requests.exceptions.RequestException(
-            results_dict.get("message", "Failed to download HATS main file.")
-        )
+            return convert_table(data, return_type)
 
     @staticmethod
-    def _import_lsdb():
-        try:
-            return importlib.import_module("lsdb")
-        except ImportError as exc:
-            raise ImportError(
-                f"{HATS_DIRECTORY_MESSAGE} Reading it with get_product() requires "
-                "the optional dependency 'lsdb'. Install it and try again."
-            ) from exc
-
-    def _read_hats_archive(self, archive_path, main_file_name, lsdb=None):
-        if lsdb is None:
-            lsdb = self._import_lsdb()
+    def _check_tabular_product(metadata, product_id):
+        """Checks that get_product can read a product."""
+        prod_type = metadata["product_type_internal_name"]
 
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            extracted_dir = pathlib.Path(tmpdirname, "extracted")
-            self._extract_zip_safely(archive_path, extracted_dir)
+        if prod_type in ("validation_results", "training_results"):
+            msg = f"does not support non-tabular data\n{FONTCOLORERR}"
+            msg += "The method get_product() only supports simple tabular "
+            msg += "data (product types: redshift_catalog, training_set). "
+            msg += f"For {prod_type}, please use method download_product()."
+            msg += FONTCOLOREND
+            raise ValueError(msg)
 
-            catalog = self._open_hats_catalog_from_directory(
-                lsdb,
-                extracted_dir,
-                main_file_name,
-            )
-            return self._lsdb_catalog_to_table(catalog)
+        if not metadata["main_file"]:
+            raise FileNotFoundError(f"Product ID ({product_id}): main file not found")
 
     @staticmethod
-    def _extract_zip_safely(archive_path, destination):
-        """Extract a zip archive while preventing paths outside destination."""
-        destination = pathlib.Path(destination).resolve()
-        destination.mkdir(parents=True, exist_ok=True)
-
-        with zipfile.ZipFile(archive_path) as archive:
-            for member in archive.infolist():
-                target = (destination / member.filename).resolve()
-                try:
-                    target.relative_to(destination)
-                except ValueError as exc:
-                    raise ValueError(
-                        f"Unsafe path in product archive: {member.filename}"
-                    ) from exc
-
-            archive.extractall(destination)
-
-    def _open_hats_catalog_from_directory(self, lsdb, extracted_dir, main_file_name):
-        errors = []
-        for candidate in self._hats_open_candidates(extracted_dir, main_file_name):
-            try:
-                return lsdb.open_catalog(path=str(candidate))
-            except Exception as exc:  # pylint: disable=broad-exception-caught
-                errors.append(f"{candidate}: {exc}")
-
-        raise ValueError(
-            f"{HATS_DIRECTORY_MESSAGE} Could not open it with LSDB. Tried: "
-            + "; ".join(errors)
-        )
-
-    def _hats_open_candidates(self, extracted_dir, main_file_name):
-        extracted_dir = pathlib.Path(extracted_dir)
-        candidates = []
-
-        if main_file_name:
-            candidates.append(extracted_dir / main_file_name)
-
-        for filename in ("collection.properties", "hats.properties", "properties"):
-            candidates.extend(path.parent for path in extracted_dir.rglob(filename))
-
-        candidates.append(extracted_dir)
-
-        unique_candidates = []
-        seen = set()
-        for candidate in candidates:
-            candidate = candidate.resolve()
-            if candidate in seen or not candidate.is_dir():
-                continue
-            seen.add(candidate)
-            unique_candidates.append(candidate)
-
-        return unique_candidates
+    def _parse_main_file(file_path, main_file, columns, filters):
+        """Reads a main file (other than HATS) into an Arrow or astropy table."""
+        if columns or filters:
+            return PzServer._read_selection(file_path, main_file, columns, filters)
+        table = read_main_table(file_path, main_file)
+        if table is None:
+            return tables_io.read(file_path, tables_io.types.AP_TABLE)
+        return table
 
     @staticmethod
-    def _lsdb_catalog_to_table(catalog):
-        if hasattr(catalog, "compute"):
-            data = catalog.compute()
-        elif hasattr(catalog, "to_pandas"):
-            data = catalog.to_pandas()
-        else:
-            ddf = getattr(catalog, "_ddf", None)
-            if ddf is None:
-                raise TypeError(
-                    "Could not convert LSDB catalog to an astropy Table."
-                )
-            data = ddf.compute()
-
-        if isinstance(data, Table):
-            return data
-        if isinstance(data, pd.DataFrame):
-            return Table.from_pandas(data)
-        if hasattr(data, "to_pandas"):
-            return Table.from_pandas(data.to_pandas())
-
-        raise TypeError("Could not convert LSDB catalog data to an astropy Table.")
+    def _parse_to_mapped(file_path, main_file, columns, filters, destination):
+        """Parses a main file into an Arrow IPC file (run in worker processes)."""
+        data = PzServer._parse_main_file(file_path, main_file, columns, filters)
+        table = data if isinstance(data, pa.Table) else from_astropy(data)
+        return str(write_mapped(table, destination))
 
     def upload(  # pylint: disable=too-many-positional-arguments
         self,
@@ -597,6 +579,7 @@ class PzServer:
         pz_code: str = None,
         auxiliary_files: list = None,
         description: str = None,
+        max_workers: int = 4,
     ):
         """Make upload
 
@@ -608,6 +591,8 @@ class PzServer:
             auxiliary_files (list, optional): auxiliary files path list. Defaults to None.
             pz_code (str, optional): pz code. Defaults to None.
             description (str, optional): description. Defaults to None.
+            max_workers (int, optional): maximum number of auxiliary files
+                uploaded simultaneously. Defaults to 4.
 
         Args:
             upload (PzUpload): Upload object
@@ -624,7 +609,7 @@ class PzServer:
         }
 
         prod = UploadData(**data)
-        return PzUpload(prod, self.api)
+        return PzUpload(prod, self.api, max_workers=max_workers)
 
     def delete_product(self, product_id):
         """Delete product
@@ -0,0 +1,353 @@
+"""
+Binned densities of catalog columns, accumulated chunk by chunk
+"""
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from astropy.table import Table
+from matplotlib.colors import LogNorm
+
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+
+def _as_float(values):
+    """Converts a column slice to float64, with NaN for missing values."""
+    if isinstance(values, (pa.Array, pa.ChunkedArray)):
+        values = values.to_numpy(zero_copy_only=False)
+    elif isinstance(values, pd.Series):
+        return values.to_numpy(dtype=np.float64, na_value=np.nan)
+    return np.ma.filled(np.ma.asarray(values, dtype=np.float64), np.nan)
+
+
+def iter_chunks(data, columns, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Reads columns of a table in chunks of float64 arrays, so binned
+    densities of large catalogs use constant memory.
+
+    Args:
+        data: pandas.DataFrame, astropy.table.Table, pyarrow.Table,
+            pyarrow.RecordBatch, or an iterable of them (e.g. the
+            batches of PzServer.iter_product_batches)
+        columns (list): column names
+        chunk_size (int, optional): number of rows of each chunk.
+            Defaults to 1000000.
+
+    Yields:
+        dict: column name -> numpy.ndarray (NaN for missing values)
+    """
+
+    if isinstance(data, (pd.DataFrame, Table, pa.Table, pa.RecordBatch)):
+        data = [data]
+
+    for table in data:
+        for start in range(0, len(table), chunk_size):
+            rows = slice(start, start + chunk_size)
+            if isinstance(table, pd.DataFrame):
+                yield {name: _as_float(table[name].iloc[rows]) for name in columns}
+            else:
+                yield {name: _as_float(table[name][rows]) for name in columns}
+
+
+def value_ranges(data, columns, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Smallest and largest finite values of columns, read chunk by chunk.
+
+    Args:
+        data: table or iterable of tables, as in iter_chunks (an
+            iterator is consumed)
+        columns (list): column names
+        chunk_size (int, optional): number of rows of each chunk.
+            Defaults to 1000000.
+
+    Returns:
+        dict: column name -> (min, max), or None without finite values
+    """
+
+    ranges = dict.fromkeys(columns)
+    for chunk in iter_chunks(data, columns, chunk_size):
+        for name, values in chunk.items():
+            values = values[np.isfinite(values)]
+            if values.size == 0:
+                continue
+            low, high = values.min(), values.max()
+            if ranges[name] is not None:
+                low = min(low, ranges[name][0])
+                high = max(high, ranges[name][1])
+            ranges[name] = (float(low), float(high))
+    return ranges
+
+
+def _bin_index(values, low, high, bins):
+    """Index of the regular bin of each value, -1 outside the range."""
+    values = np.asarray(values, dtype=np.float64)
+    index = np.full(values.shape, -1, dtype=np.int64)
+    inside = (values >= low) & (values <= high)
+    scaled = (values[inside] - low) * (bins / (high - low))
+    index[inside] = np.minimum(scaled.astype(np.int64), bins - 1)
+    return index
+
+
+class Histogram:
+    """
+    Counts of values in regular bins, accumulated chunk by chunk.
+
+    Values outside the range (and NaN) are not counted; the number of
+    finite values outside the range is kept in outside.
+    """
+
+    def __init__(self, value_range, bins):
+        """
+        Histogram class constructor
+
+        Args:
+            value_range (tuple): lower and upper edges
+            bins (int): number of bins
+        """
+
+        self.edges = np.linspace(value_range[0], value_range[1], bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.outside = 0
+
+    def update(self, values):
+        """
+        Adds values to the counts.
+
+        Args:
+            values (array-like): values
+
+        Returns:
+            Histogram: self
+        """
+
+        values = np.asarray(values, dtype=np.float64)
+        index = _bin_index(values, self.edges[0], self.edges[-1], len(self.counts))
+        self.counts += np.bincount(index[index >= 0], minlength=len(self.counts))
+        self.outside += int(np.count_nonzero((index < 0) & np.isfinite(values)))
+        return self
+
+    def occupied(self):
+        """
+        Range of the bins from the first to the last non-empty one.
+
+        Returns:
+            slice: bins range (empty when nothing was counted)
+        """
+
+        nonzero = np.flatnonzero(self.counts)
+        if not nonzero.size:
+            return slice(0, 0)
+        return slice(nonzero[0], nonzero[-1] + 1)
+
+    def coarsened(self, bins):
+        """
+        Merges the bins of the occupied range into at most bins bins.
+
+        Args:
+            bins (int): maximum number of bins
+
+        Returns:
+            Histogram: merged histogram
+        """
+
+        occupied = self.occupied()
+        counts = self.counts[occupied]
+        if counts.size == 0:
+            return self
+
+        factor = -(-len(counts) // bins)
+        counts = np.pad(counts, (0, -len(counts) % factor))
+        width = (self.edges[-1] - self.edges[0]) / len(self.counts) * factor
+
+        merged = Histogram((0, 1), len(counts) // factor)
+        merged.counts = counts.reshape(-1, factor).sum(axis=1)
+        merged.outside = self.outside
+        merged.edges = self.edges[occupied.start] + width * np.arange(
+            len(merged.counts) + 1
+        )
+        return merged
+
+
+class Histogram2D:
+    """
+    Counts of pairs of values in a regular grid, accumulated chunk by
+    chunk.
+
+    Pairs outside the ranges (or with NaN) are not counted; the number
+    of finite pairs outside the ranges is kept in outside.
+    """
+
+    def __init__(self, x_range, y_range, bins=(200, 200)):
+        """
+        Histogram2D class constructor
+
+        Args:
+            x_range (tuple): lower and upper edges of x
+            y_range (tuple): lower and upper edges of y
+            bins (tuple, optional): number of bins of x and y.
+                Defaults to (200, 200).
+        """
+
+        self.x_edges = np.linspace(x_range[0], x_range[1], bins[0] + 1)
+        self.y_edges = np.linspace(y_range[0], y_range[1], bins[1] + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.outside = 0
+
+    def update(self, x, y):
+        """
+        Adds pairs of values to the counts.
+
+        Args:
+            x (array-like): x values
+            y (array-like): y values
+
+        Returns:
+            Histogram2D: self
+        """
+
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        n_x, n_y = self.counts.shape
+        index_x = _bin_index(x, self.x_edges[0], self.x_edges[-1], n_x)
+        index_y = _bin_index(y, self.y_edges[0], self.y_edges[-1], n_y)
+        inside = (index_x >= 0) & (index_y >= 0)
+        flat = index_x[inside] * n_y + index_y[inside]
+        self.counts += np.bincount(flat, minlength=n_x * n_y).reshape(n_x, n_y)
+        finite = np.isfinite(x) & np.isfinite(y)
+        self.outside += int(np.count_nonzero(~inside & finite))
+        return self
+
+    def occupied(self):
+        """
+        Ranges of the bins containing every counted pair.
+
+        Returns:
+            tuple: x and y bins ranges (slices)
+        """
+
+        x_nonzero = np.flatnonzero(self.counts.any(axis=1))
+        y_nonzero = np.flatnonzero(self.counts.any(axis=0))
+        if not x_nonzero.size:
+            return slice(0, 0), slice(0, 0)
+        return (
+            slice(x_nonzero[0], x_nonzero[-1] + 1),
+            slice(y_nonzero[0], y_nonzero[-1] + 1),
+        )
+
+
+class SkyHistogram(Histogram2D):
+    """
+    Counts of sky positions in equal-area bins (regular in RA and in
+    the sine of Dec), accumulated chunk by chunk.
+    """
+
+    def __init__(self, bins=(360, 180)):
+        """
+        SkyHistogram class constructor
+
+        Args:
+            bins (tuple, optional): number of bins of RA and Dec.
+                Defaults to (360, 180).
+        """
+
+        super().__init__((0.0, 360.0), (-1.0, 1.0), bins)
+
+    def update(self, x, y):
+        """
+        Adds sky positions to the counts.
+
+        Args:
+            x (array-like): RA (deg)
+            y (array-like): Dec (deg)
+
+        Returns:
+            SkyHistogram: self
+        """
+
+        ra = np.mod(np.asarray(x, dtype=np.float64), 360.0)
+        sin_dec = np.sin(np.radians(np.asarray(y, dtype=np.float64)))
+        return super().update(ra, sin_dec)
+
+
+def _log_norm(counts):
+    return LogNorm(vmin=1, vmax=counts.max()) if counts.max() > 0 else None
+
+
+def plot_sky_density(histogram, ax=None, cmap="viridis"):
+    """
+    Draws a SkyHistogram on a Mollweide projection, with RA increasing
+    to the left.
+
+    Args:
+        histogram (SkyHistogram): counts of sky positions
+        ax (matplotlib axes, optional): axes with the "mollweide"
+            projection. Defaults to a new subplot.
+        cmap (str, optional): colormap. Defaults to "viridis".
+
+    Returns:
+        matplotlib.collections.QuadMesh: drawn mesh (for colorbars)
+    """
+
+    if ax is None:
+        ax = plt.subplot(projection="mollweide")
+
+    longitude = np.radians(180.0 - histogram.x_edges)
+    latitude = np.arcsin(histogram.y_edges)
+    counts = np.ma.masked_equal(histogram.counts.T, 0)
+    mesh = ax.pcolormesh(
+        longitude, latitude, counts, cmap=cmap, norm=_log_norm(histogram.counts)
+    )
+
+    ticks = np.arange(-120, 180, 60)
+    ax.set_xticks(np.radians(ticks))
+    ax.set_xticklabels([f"{(180 - tick) % 360}°" for tick in ticks])
+    ax.grid(True)
+    return mesh
+
+
+def plot_density(histogram, ax=None, cmap="viridis"):
+    """
+    Draws a Histogram2D as a density map limited to its occupied bins.
+
+    Args:
+        histogram (Histogram2D): counts of pairs of values
+        ax (matplotlib axes, optional): axes. Defaults to the current
+            axes.
+        cmap (str, optional): colormap. Defaults to "viridis".
+
+    Returns:
+        matplotlib.collections.QuadMesh: drawn mesh (for colorbars)
+    """
+
+    if ax is None:
+        ax = plt.gca()
+
+    mesh = ax.pcolormesh(
+        histogram.x_edges,
+        histogram.y_edges,
+        np.ma.masked_equal(histogram.counts.T, 0),
+        cmap=cmap,
+        norm=_log_norm(histogram.counts),
+    )
+
+    x_bins, y_bins = histogram.occupied()
+    if x_bins.stop:
+        ax.set_xlim(histogram.x_edges[x_bins.start], histogram.x_edges[x_bins.stop])
+        ax.set_ylim(histogram.y_edges[y_bins.start], histogram.y_edges[y_bins.stop])
+    return mesh
+
+
+def plot_histogram(histogram, ax=None):
+    """
+    Draws a Histogram as bars.
+
+    Args:
+        histogram (Histogram): counts of values
+        ax (matplotlib axes, optional): axes. Defaults to the current
+            axes.
+    """
+
+    if ax is None:
+        ax = plt.gca()
+    ax.stairs(histogram.counts, histogram.edges, fill=True)
@@ -0,0 +1,434 @@
+"""
+Reading of HATS products (directory-based catalogs) with LSDB
+"""
+
+import importlib
+import pathlib
+import re
+import shutil
+import tempfile
+import zipfile
+
+import pandas as pd
+import pyarrow as pa
+import requests
+from astropy.table import Table
+
+from .product_cache import ProductCache
+from .readers import iter_hats_batches, parse_filters, resolve_columns
+
+DEFAULT_HATS_DIRECTORY = "~/.cache/pzserver/hats"
+HATS_PARTITION_PATTERN = re.compile(r"/Norder=(\d+)/Dir=\d+/Npix=(\d+)(?:\.|/)")
+# catalog files needed to plan a partial read (sky maps and statistics
+# are skipped; dataset/_metadata only when there is no partition_info.csv)
+HATS_METADATA_FILES = (
+    "hats.properties",
+    "properties",
+    "partition_info.csv",
+    "_common_metadata",
+)
+HATS_PRIMARY_TABLE_PATTERN = re.compile(r"^hats_primary_table_url\s*=\s*(\S+)", re.M)
+HATS_OBJECT_CATALOG_PATTERN = re.compile(
+    r"^(dataproduct_type|catalog_type)\s*=\s*object", re.M
+)
+HATS_DIRECTORY_MESSAGE = (
+    "This product main file is a directory-based dataset, such as a "
+    "HATS collection."
+)
+
+
+class HatsCatalogMixin:
+    """
+    Opens and reads the HATS products of PzServer with LSDB.
+    """
+
+    def open_hats_product(  # pylint: disable=too-many-arguments
+        self, product_id, columns=None, filters=None, directory=None, region=None
+    ):
+        """
+        Opens a HATS product as a lazy LSDB catalog.
+
+        The archive is downloaded once to a persistent local copy and
+        the catalog is opened inside it without loading its partitions,
+        so cone searches, column selections and partition-parallel Dask
+        operations only read the partitions they need. The local copy
+        is reused while the product is unchanged on the server.
+
+        Args:
+            product_id (str or int): data product
+                unique identifier (product id
+                number or internal name)
+            columns (list, optional): columns to load, by name,
+                alias or UCD. Defaults to all columns.
+            filters (str, tuple or list, optional): row filters,
+                as in get_product.
+            directory (str, optional): directory of the local copies.
+                Defaults to "hats" in the product cache directory,
+                or "~/.cache/pzserver/hats" without a cache. Local
+                copies are not counted in the cache size budget.
+            region (lsdb search, optional): sky region the catalog
+                is restricted to (see get_product).
+
+        Returns:
+            lsdb.Catalog: opened catalog
+        """
+
+        metadata = self.get_product_metadata(product_id)
+        return self._open_hats_product(
+            metadata, columns, filters, directory, region=region
+        )
+
+    def _open_hats_product(  # pylint: disable=too-many-arguments
+        self, metadata, columns, filters, directory=None, region=None
+    ):
+        main_file = metadata.get("main_file")
+        if not main_file:
+            raise FileNotFoundError(
+                f"Product ID ({metadata['id']}): main file not found"
+            )
+
+        lsdb = self._import_lsdb()
+        archive_path = self._hats_local_copy(metadata, directory)
+        return self._open_hats_catalog_from_archive(
+            lsdb,
+            archive_path,
+            main_file.get("name"),
+            archive_path.parent / "extracted",
+            **self._hats_open_options(
+                resolve_columns(columns, main_file),
+                parse_filters(filters, main_file),
+                region,
+            ),
+        )
+
+    def _hats_local_copy(self, metadata, directory=None):
+        """Keeps the HATS archive of a product in a persistent directory."""
+        if directory is None:
+            directory = (
+                self.cache.directory / "hats"
+                if self.cache is not None
+                else DEFAULT_HATS_DIRECTORY
+            )
+        directory = pathlib.Path(directory).expanduser()
+        directory.mkdir(parents=True, exist_ok=True)
+
+        version = ProductCache.version_marker(metadata, metadata.get("main_file"))
+        if version is None:
+            target = directory / str(metadata["id"])
+        else:
+            key = ProductCache.make_key(metadata["id"], "hats", version)
+            target = directory / key.replace(":", "-")
+            archives = sorted(target.glob("*.zip"))
+            if archives:
+                return archives[0]
+
+        with tempfile.TemporaryDirectory(dir=directory) as tmpdirname:
+            results_dict = self._cached_download(
+                metadata,
+                "main_file",
+                tmpdirname,
+                lambda tmpdir: self.api.download_main_file(metadata["id"], tmpdir),
+            )
+            if not results_dict.get("success", False):
+                raise requests.exceptions.RequestException(
+                    results_dict.get("message", "Failed to download HATS main file.")
+                )
+
+            archive_path = pathlib.Path(results_dict["message"])
+            if archive_path.suffix.lower() != ".zip":
+                raise ValueError(
+                    "Lazy loading is only supported for HATS products. "
+                    "Use get_product() or iter_product_batches() instead."
+                )
+
+            shutil.rmtree(target, ignore_errors=True)
+            target.mkdir()
+            return archive_path.replace(target / archive_path.name)
+
+    def _get_hats_region(  # pylint: disable=too-many-locals
+        self, metadata, **open_options
+    ):
+        """Reads the partitions of a HATS product that intersect a region.
+
+        The catalog metadata is read from the remote archive with byte
+        range requests, the intersecting HEALPix pixels are computed
+        with hats, and only their partition files are fetched.
+        """
+        lsdb = self._import_lsdb()
+        hats = importlib.import_module("hats")
+
+        remote = self.api.open_main_file_archive(metadata["id"])
+        if remote is None:
+            # the server does not serve byte ranges
+            return self._get_hats_product(metadata, **open_options)
+
+        with tempfile.TemporaryDirectory() as tmpdirname, zipfile.ZipFile(
+            remote
+        ) as archive:
+            catalog_dir = pathlib.Path(tmpdirname, "catalog")
+            prefix = self._zip_catalog_prefix(
+                archive, metadata["main_file"].get("name")
+            )
+
+            names = [name for name in archive.namelist() if name.startswith(prefix)]
+            metadata_files = set(HATS_METADATA_FILES)
+            if f"{prefix}partition_info.csv" not in names:
+                metadata_files.add("_metadata")
+
+            partitions = {}
+            for name in names:
+                match = HATS_PARTITION_PATTERN.search(name)
+                if match and not name.endswith("/"):
+                    pixel = (int(match.group(1)), int(match.group(2)))
+                    partitions.setdefault(pixel, []).append(name)
+                elif pathlib.PurePosixPath(name).name in metadata_files:
+                    self._extract_member(archive, name, prefix, catalog_dir)
+
+            hc_catalog = hats.read_hats(catalog_dir)
+            region = open_options["search_filter"]
+            for pixel in region.filter_hc_catalog(hc_catalog).get_healpix_pixels():
+                for name in partitions.get((pixel.order, pixel.pixel), []):
+                    self._extract_member(archive, name, prefix, catalog_dir)
+
+            catalog = lsdb.open_catalog(path=str(catalog_dir), **open_options)
+            return self._lsdb_catalog_to_data(catalog)
+
+    @staticmethod
+    def _zip_catalog_prefix(archive, main_file_name):
+        """Member prefix of the object catalog inside a HATS archive."""
+        names = archive.namelist()
+
+        for name in names:
+            path = pathlib.PurePosixPath(name)
+            if path.name == "collection.properties":
+                properties = archive.read(name).decode("utf-8", "replace")
+                match = HATS_PRIMARY_TABLE_PATTERN.search(properties)
+                if match:
+                    primary = path.parent / match.group(1).strip("/")
+                    return "" if str(primary) == "." else f"{primary}/"
+
+        catalogs = []
+        for name in names:
+            path = pathlib.PurePosixPath(name)
+            if path.name not in ("hats.properties", "properties"):
+                continue
+            properties = archive.read(name).decode("utf-8", "replace")
+            if HATS_OBJECT_CATALOG_PATTERN.search(properties):
+                catalogs.append(path.parent)
+
+        if not catalogs:
+            raise ValueError(f"{HATS_DIRECTORY_MESSAGE} No HATS catalog found in it.")
+
+        catalogs.sort(key=lambda path: (path.name != main_file_name, len(path.parts)))
+        return "" if str(catalogs[0]) == "." else f"{catalogs[0]}/"
+
+    @staticmethod
+    def _extract_member(archive, name, prefix, destination):
+        """Extracts one archive member, relative to prefix, into destination."""
+        destination = pathlib.Path(destination).resolve()
+        target = (destination / name[len(prefix) :]).resolve()
+        try:
+            target.relative_to(destination)
+        except ValueError as exc:
+            raise ValueError(f"Unsafe path in product archive: {name}") from exc
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with archive.open(name) as src, open(target, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024**2)
+
+    def _get_hats_product(self, metadata, **open_options):
+        """Download a directory-based HATS main file and load it with LSDB."""
+        lsdb = self._import_lsdb()
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            archive_path = self._download_hats_main_file(metadata, tmpdirname)
+            return self._read_hats_archive(
+                archive_path,
+                metadata["main_file"].get("name"),
+                lsdb=lsdb,
+                **open_options,
+            )
+
+    def _download_hats_main_file(self, metadata, destination):
+        results_dict = self._cached_main_file(metadata, destination)
+        if results_dict.get("success", False):
+            return pathlib.Path(results_dict["message"])
+
+        raise requests.exceptions.RequestException(
+            results_dict.get("message", "Failed to download HATS main file.")
+        )
+
+    @staticmethod
+    def _import_lsdb():
+        try:
+            return importlib.import_module("lsdb")
+        except ImportError as exc:
+            raise ImportError(
+                f"{HATS_DIRECTORY_MESSAGE} Reading it with get_product() requires "
+                "the optional dependency 'lsdb'. Install it and try again."
+            ) from exc
+
+    def _read_hats_archive(
+        self, archive_path, main_file_name, lsdb=None, **open_options
+    ):
+        if lsdb is None:
+            lsdb = self._import_lsdb()
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            catalog = self._open_hats_catalog_from_archive(
+                lsdb,
+                archive_path,
+                main_file_name,
+                pathlib.Path(tmpdirname, "extracted"),
+                **open_options,
+            )
+            return self._lsdb_catalog_to_data(catalog)
+
+    @staticmethod
+    def _extract_zip_safely(archive_path, destination):
+        """Extract a zip archive while preventing paths outside destination."""
+        destination = pathlib.Path(destination).resolve()
+        destination.mkdir(parents=True, exist_ok=True)
+
+        with zipfile.ZipFile(archive_path) as archive:
+            for member in archive.infolist():
+                target = (destination / member.filename).resolve()
+                try:
+                    target.relative_to(destination)
+                except ValueError as exc:
+                    raise ValueError(
+                        f"Unsafe path in product archive: {member.filename}"
+                    ) from exc
+
+            archive.extractall(destination)
+
+    def _open_hats_catalog_from_archive(  # pylint: disable=too-many-arguments
+        self, lsdb, archive_path, main_file_name, extracted_dir, **open_options
+    ):
+        """Opens a HATS catalog inside a zip archive without extracting it.
+
+        LSDB reads the catalog through a zip-backed filesystem, so only
+        the metadata and the partitions actually used are decompressed.
+        The archive is extracted to extracted_dir only if no catalog is
+        found in it; other errors (e.g. unknown columns) are raised.
+        """
+        errors = []
+        for candidate in self._zip_hats_candidates(archive_path, main_file_name):
+            try:
+                return lsdb.open_catalog(path=candidate, **open_options)
+            except OSError as exc:
+                # no catalog (properties file) at this location
+                errors.append(f"{candidate}: {exc}")
+
+        self._extract_zip_safely(archive_path, extracted_dir)
+        try:
+            return self._open_hats_catalog_from_directory(
+                lsdb, extracted_dir, main_file_name, **open_options
+            )
+        except ValueError as exc:
+            raise ValueError(f"{exc}; " + "; ".join(errors)) from exc
+
+    @staticmethod
+    def _zip_hats_candidates(archive_path, main_file_name):
+        """Catalog locations inside a zip archive, as fsspec zip URLs."""
+        archive_path = pathlib.Path(archive_path).resolve()
+        with zipfile.ZipFile(archive_path) as archive:
+            names = [pathlib.PurePosixPath(name) for name in archive.namelist()]
+
+        directories = {str(parent) for name in names for parent in name.parents}
+        directories.update(str(name) for name in names)
+
+        candidates = []
+        if main_file_name and main_file_name.strip("/") in directories:
+            candidates.append(main_file_name.strip("/"))
+
+        for name in names:
+            if name.name in ("collection.properties", "hats.properties", "properties"):
+                candidates.append(str(name.parent))
+
+        candidates.append(".")
+
+        return [
+            f"zip://{'' if candidate == '.' else candidate}::file://{archive_path}"
+            for candidate in dict.fromkeys(candidates)
+        ]
+
+    def _open_hats_catalog_from_directory(
+        self, lsdb, extracted_dir, main_file_name, **open_options
+    ):
+        errors = []
+        for candidate in self._hats_open_candidates(extracted_dir, main_file_name):
+            try:
+                return lsdb.open_catalog(path=str(candidate), **open_options)
+            except OSError as exc:
+                errors.append(f"{candidate}: {exc}")
+
+        raise ValueError(
+            f"{HATS_DIRECTORY_MESSAGE} Could not open it with LSDB. Tried: "
+            + "; ".join(errors)
+        )
+
+    def _hats_open_candidates(self, extracted_dir, main_file_name):
+        extracted_dir = pathlib.Path(extracted_dir)
+        candidates = []
+
+        if main_file_name:
+            candidates.append(extracted_dir / main_file_name)
+
+        for filename in ("collection.properties", "hats.properties", "properties"):
+            candidates.extend(path.parent for path in extracted_dir.rglob(filename))
+
+        candidates.append(extracted_dir)
+
+        unique_candidates = []
+        seen = set()
+        for candidate in candidates:
+            candidate = candidate.resolve()
+            if candidate in seen or not candidate.is_dir():
+                continue
+            seen.add(candidate)
+            unique_candidates.append(candidate)
+
+        return unique_candidates
+
+    @staticmethod
+    def _lsdb_catalog_to_data(catalog):
+        if hasattr(catalog, "compute"):
+            data = catalog.compute()
+        elif hasattr(catalog, "to_pandas"):
+            data = catalog.to_pandas()
+        else:
+            ddf = getattr(catalog, "_ddf", None)
+            if ddf is None:
+                raise TypeError(
+                    "Could not compute the LSDB catalog."
+                )
+            data = ddf.compute()
+
+        if isinstance(data, (Table, pd.DataFrame, pa.Table)):
+            return data
+        if hasattr(data, "to_pandas"):
+            return data.to_pandas()
+
+        raise TypeError("Could not convert LSDB catalog data to a table.")
+
+    def _iter_hats_archive_batches(  # pylint: disable=too-many-arguments
+        self, archive_path, main_file_name, extracted_dir, batch_size, **open_options
+    ):
+        lsdb = self._import_lsdb()
+        catalog = self._open_hats_catalog_from_archive(
+            lsdb, archive_path, main_file_name, extracted_dir, **open_options
+        )
+        return iter_hats_batches(catalog, batch_size)
+
+    @staticmethod
+    def _hats_open_options(columns, filters, region=None):
+        """Column projection, filters and region passed to lsdb.open_catalog."""
+        options = {}
+        if region is not None:
+            options["search_filter"] = region
+        if columns:
+            options["columns"] = columns
+        if filters:
+            options["filters"] = [tuple(predicate) for predicate in filters]
+        return options
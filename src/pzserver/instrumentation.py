@@ -0,0 +1,194 @@
+"""
+Instrumentation of the requests sent to the Pz Server app
+"""
+
+import re
+import threading
+from urllib.parse import urlsplit
+
+import pandas as pd
+
+
+def endpoint_template(url, base_api_url=None) -> str:
+    """
+    Converts a request url to its endpoint template.
+
+    The query string is dropped and numeric path segments are replaced
+    by "{id}", e.g. "https://.../api/products/42/main_file_info/" becomes
+    "products/{id}/main_file_info/".
+
+    Args:
+        url (str): request url
+        base_api_url (str, optional): API root removed from the path.
+
+    Returns:
+        str: endpoint template
+    """
+
+    path = urlsplit(url).path
+    if base_api_url:
+        base_path = urlsplit(base_api_url).path
+        if path.startswith(base_path):
+            path = path[len(base_path) :]
+
+    return re.sub(r"(^|/)\d+(?=/|$)", r"\1{id}", path.lstrip("/")) or "/"
+
+
+class RequestEvents:
+    """
+    Dispatches the events emitted for every request to the subscribed
+    callbacks.
+
+    Each event is a dict with the keys:
+        kind (str): "request" (one API call, including retries) or
+            "transfer" (the body of a streamed download);
+        method (str): HTTP method;
+        url (str): request url;
+        endpoint (str): endpoint template, see endpoint_template();
+        status_code (int): response status (None on connection errors);
+        success (bool): whether the request succeeded;
+        duration (float): seconds spent;
+        request_bytes (int): size of the request body (None if unknown);
+        response_bytes (int): size of the response body (None if unknown);
+        retries (int): number of retries.
+    """
+
+    def __init__(self):
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """
+        Registers a callback called with each event.
+
+        Args:
+            callback (callable): function receiving the event dict
+
+        Returns:
+            callable: the callback, so it can be used as a decorator
+        """
+
+        with self._lock:
+            self._callbacks = [*self._callbacks, callback]
+        return callback
+
+    def unsubscribe(self, callback):
+        """
+        Removes a registered callback.
+
+        Args:
+            callback (callable): function registered with subscribe()
+        """
+
+        with self._lock:
+            self._callbacks = [cb for cb in self._callbacks if cb is not callback]
+
+    def __bool__(self):
+        return bool(self._callbacks)
+
+    def emit(self, event):
+        """
+        Sends an event to every registered callback.
+
+        Errors raised by callbacks are ignored, so instrumentation never
+        breaks a request.
+
+        Args:
+            event (dict): event
+        """
+
+        for callback in self._callbacks:
+            try:
+                callback(event)
+            except Exception:  # pylint: disable=broad-exception-caught
+                pass
+
+
+class RequestStats:
+    """
+    Aggregates request events by endpoint.
+
+    Usage:
+        stats = RequestStats()
+        pz_server.api.events.subscribe(stats)
+        ...
+        stats.print_summary()
+    """
+
+    def __init__(self):
+        self._durations = {}
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        key = (event.get("kind"), event.get("method"), event.get("endpoint"))
+
+        with self._lock:
+            self._durations.setdefault(key, []).append(event.get("duration") or 0.0)
+            totals = self._totals.setdefault(
+                key, {"errors": 0, "retries": 0, "request_bytes": 0, "response_bytes": 0}
+            )
+            totals["errors"] += 0 if event.get("success") else 1
+            totals["retries"] += event.get("retries") or 0
+            totals["request_bytes"] += event.get("request_bytes") or 0
+            totals["response_bytes"] += event.get("response_bytes") or 0
+
+    @staticmethod
+    def _percentile(sorted_values, fraction):
+        index = max(0, -(-int(fraction * 100) * len(sorted_values) // 100) - 1)
+        return sorted_values[min(index, len(sorted_values) - 1)]
+
+    def summary(self) -> list:
+        """
+        Returns the statistics of each endpoint, slowest total first.
+
+        Returns:
+            list: one dict per (kind, method, endpoint) with count, errors,
+                retries, total/p50/p95/p99 duration in seconds and bytes.
+        """
+
+        rows = []
+
+        with self._lock:
+            for key, durations in self._durations.items():
+                kind, method, endpoint = key
+                values = sorted(durations)
+                rows.append(
+                    {
+                        "kind": kind,
+                        "method": method,
+                        "endpoint": endpoint,
+                        "count": len(values),
+                        **self._totals[key],
+                        "total_s": sum(values),
+                        "p50_s": self._percentile(values, 0.50),
+                        "p95_s": self._percentile(values, 0.95),
+                        "p99_s": self._percentile(values, 0.99),
+                    }
+                )
+
+        return sorted(rows, key=lambda row: row["total_s"], reverse=True)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Returns the statistics as a dataframe.
+
+        Returns:
+            pandas.DataFrame: statistics by endpoint
+        """
+        return pd.DataFrame(self.summary())
+
+    def print_summary(self):
+        """
+        Prints the latency percentiles by endpoint.
+        """
+        print(self.to_dataframe().to_string(index=False, float_format="{:.3f}".format))
+
+    def reset(self):
+        """
+        Discards the collected statistics.
+        """
+
+        with self._lock:
+            self._durations.clear()
+            self._totals.clear()
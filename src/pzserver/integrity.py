@@ -0,0 +1,321 @@
+"""
+Integrity checks of downloaded files
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import pathlib
+import re
+
+# names used in the Digest/Repr-Digest headers -> hashlib names
+DIGEST_ALGORITHMS = {
+    "sha-256": "sha256",
+    "sha256": "sha256",
+    "sha-512": "sha512",
+    "sha512": "sha512",
+    "md5": "md5",
+}
+
+
+def _to_hex(value):
+    value = value.strip().strip(":")
+    if re.fullmatch(r"[0-9a-fA-F]{32,128}", value) and len(value) % 2 == 0:
+        return value.lower()
+
+    try:
+        return base64.b64decode(value, validate=True).hex()
+    except (binascii.Error, ValueError):
+        return None
+
+
+def expected_digest(headers):
+    """
+    Reads the digest of the complete file sent by the server.
+
+    Supports the Repr-Digest (RFC 9530) and Digest (RFC 3230) headers,
+    which describe the whole file even in partial (206) responses, and
+    the X-Checksum-Sha256 header.
+
+    Args:
+        headers (dict): response headers
+
+    Returns:
+        tuple: hashlib algorithm name and hex digest, or None
+    """
+
+    for header in ("Repr-Digest", "Digest"):
+        for item in (headers.get(header) or "").split(","):
+            name, _, encoded = item.strip().partition("=")
+            algorithm = DIGEST_ALGORITHMS.get(name.strip().lower())
+            hexdigest = _to_hex(encoded) if algorithm and encoded else None
+            if hexdigest:
+                return algorithm, hexdigest
+
+    hexdigest = _to_hex(headers.get("X-Checksum-Sha256") or "")
+    if hexdigest:
+        return "sha256", hexdigest
+
+    return None
+
+
+class DownloadDigests:  # pylint: disable=too-many-instance-attributes
+    """
+    Digests of a file computed while it is downloaded.
+
+    The sha256 of each block of block_size bytes is recorded in a sidecar
+    JSON manifest as the bytes are written, together with the digest of
+    the whole file. When a download is resumed, the blocks already on
+    disk are checked against the manifest, so only the corrupted ranges
+    need to be fetched again.
+    """
+
+    def __init__(self, path, block_size=8 * 1024**2, algorithm="sha256"):
+        """
+        Loads the manifest or starts a new one.
+
+        Args:
+            path (pathlib.Path): manifest path
+            block_size (int, optional): size of each block. Defaults to 8 MB.
+            algorithm (str, optional): hashlib algorithm of the whole file
+                digest. Defaults to "sha256".
+        """
+
+        self.path = pathlib.Path(path)
+        self.block_size = block_size
+        self.algorithm = algorithm
+        self.blocks = []
+        self.digest = None
+
+        try:
+            saved = json.loads(self.path.read_text(encoding="utf-8"))
+            if saved.get("block_size") == block_size:
+                self.blocks = list(saved["blocks"])
+        except (OSError, ValueError, KeyError):
+            pass
+
+        self.reset(keep_blocks=True)
+
+    def reset(self, keep_blocks=False):
+        """
+        Restarts hashing from the first byte.
+
+        Args:
+            keep_blocks (bool, optional): keep the recorded block digests,
+                used to check a resumed file. Defaults to False.
+        """
+
+        if not keep_blocks:
+            self.blocks = []
+        self.position = 0
+        self._block = hashlib.sha256()
+        self._full = hashlib.new(self.algorithm)
+        self.digest = None
+
+    def use_algorithm(self, algorithm):
+        """
+        Changes the algorithm of the whole file digest, rehashing the file
+        when bytes were already hashed with another one.
+
+        Args:
+            algorithm (str): hashlib algorithm name
+
+        Returns:
+            bool: False when the bytes already hashed must be read again
+        """
+
+        if algorithm == self.algorithm:
+            return True
+
+        self.algorithm = algorithm
+        self._full = hashlib.new(algorithm) if self.position == 0 else None
+        return self._full is not None
+
+    def update(self, data):
+        """
+        Hashes bytes written sequentially after the current position.
+
+        Args:
+            data (bytes): bytes written
+        """
+
+        if self._full is not None:
+            self._full.update(data)
+
+        view = memoryview(data)
+        while view:
+            room = self.block_size - self.position % self.block_size
+            self._block.update(view[:room])
+            self.position += min(room, len(view))
+            view = view[room:]
+
+            if self.position % self.block_size == 0:
+                index = self.position // self.block_size - 1
+                self._record(index, self._block.hexdigest())
+                self._block = hashlib.sha256()
+
+    def _record(self, index, hexdigest):
+        if index < len(self.blocks):
+            self.blocks[index] = hexdigest
+        else:
+            self.blocks.append(hexdigest)
+            self.save()
+
+    def resume(self, file_path, size):
+        """
+        Checks the first size bytes of a partial file against the manifest
+        and hashes them, so the download can continue from there.
+
+        Blocks without a recorded digest are trusted.
+
+        Args:
+            file_path (pathlib.Path): partial file
+            size (int): number of bytes already downloaded
+
+        Returns:
+            list: (start, end) byte ranges of the corrupted blocks
+        """
+
+        known = list(self.blocks)
+        self.reset()
+        corrupted = []
+
+        with open(file_path, "rb") as src:
+            while self.position < size:
+                index = self.position // self.block_size
+                data = src.read(min(self.block_size, size - self.position))
+                if not data:
+                    break
+                self.update(data)
+
+                if (
+                    self.position % self.block_size == 0
+                    and index < len(known)
+                    and known[index] != self.blocks[index]
+                ):
+                    self.blocks[index] = known[index]
+                    corrupted.append(self.block_range(index, size))
+
+        if corrupted:
+            # the whole file digest includes corrupted bytes
+            self._full = None
+        self.save()
+        return corrupted
+
+    def block_range(self, index, size=None):
+        """
+        Returns the first and last byte of a block.
+
+        Args:
+            index (int): block index
+            size (int, optional): file size, limiting the last block.
+
+        Returns:
+            tuple: first and last byte
+        """
+
+        start = index * self.block_size
+        end = start + self.block_size - 1
+        return start, end if size is None else min(end, size - 1)
+
+    def repair(self, index, data):
+        """
+        Records the digest of a block fetched again.
+
+        Args:
+            index (int): block index
+            data (bytes): content of the block
+        """
+        self._record(index, hashlib.sha256(data).hexdigest())
+
+    def finish(self, file_path, rehash=False):
+        """
+        Records the digest of the last block and of the whole file,
+        reading the file only if some bytes could not be hashed as they
+        were written.
+
+        Args:
+            file_path (pathlib.Path): downloaded file
+            rehash (bool, optional): read the file again to compute the
+                whole file digest (after repairs). Defaults to False.
+
+        Returns:
+            str: hex digest of the whole file
+        """
+
+        if rehash:
+            self._full = None
+
+        if self.position % self.block_size:
+            self._record(self.position // self.block_size, self._block.hexdigest())
+        del self.blocks[-(-self.position // self.block_size) :]
+
+        if self._full is None:
+            self._full = hashlib.new(self.algorithm)
+            with open(file_path, "rb") as src:
+                for block in iter(lambda: src.read(1024**2), b""):
+                    self._full.update(block)
+
+        self.digest = self._full.hexdigest()
+        self.save()
+        return self.digest
+
+    def corrupted_blocks(self, file_path):
+        """
+        Reads the file and compares each block with the manifest.
+
+        Args:
+            file_path (pathlib.Path): downloaded file
+
+        Returns:
+            list: (start, end) byte ranges of the corrupted blocks
+        """
+
+        size = pathlib.Path(file_path).stat().st_size
+        corrupted = []
+
+        with open(file_path, "rb") as src:
+            for index, hexdigest in enumerate(self.blocks):
+                data = src.read(self.block_size)
+                if hashlib.sha256(data).hexdigest() != hexdigest:
+                    corrupted.append(self.block_range(index, size))
+
+        return corrupted
+
+    def save(self):
+        """
+        Persists the manifest.
+        """
+
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        tmp_path.write_text(
+            json.dumps(
+                {
+                    "block_size": self.block_size,
+                    "blocks": self.blocks,
+                    "algorithm": self.algorithm,
+                    "digest": self.digest,
+                }
+            ),
+            encoding="utf-8",
+        )
+        tmp_path.replace(self.path)
+
+    def move(self, path):
+        """
+        Moves the manifest next to the complete file.
+
+        Args:
+            path (pathlib.Path): new manifest path
+        """
+
+        path = pathlib.Path(path)
+        self.path.replace(path)
+        self.path = path
+
+    def remove(self):
+        """
+        Removes the manifest.
+        """
+        self.path.unlink(missing_ok=True)
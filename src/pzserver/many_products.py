@@ -0,0 +1,275 @@
+"""
+Concurrent retrieval of many data products
+"""
+
+import contextlib
+import multiprocessing
+import pathlib
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+
+from .readers import (check_return_type, convert_table, parse_filters,
+                      resolve_columns)
+from .spill import read_mapped
+
+
+class ManyProductsMixin:
+    """
+    Fetches many data products at once for PzServer, overlapping their
+    downloads with the parsing of their main files.
+    """
+
+    def get_products_many(  # pylint: disable=too-many-arguments,too-many-locals
+        self,
+        product_ids,
+        *,
+        max_workers=4,
+        memory_budget=None,
+        columns=None,
+        filters=None,
+        return_type="astropy",
+        get_big_products=False,
+        parse_processes=None,
+    ):
+        """
+        Fetches the contents of many data products, yielding each one
+        as soon as it is read.
+
+        The metadata requests and main file downloads of the products
+        run concurrently in threads, and the main files are parsed in a
+        process pool while the next ones are still being downloaded.
+        Parsed tables are handed back from the worker processes as
+        memory-mapped Arrow IPC files (see get_product), not copied
+        through pipes. A failing product is reported and does not stop
+        the others.
+
+        Args:
+            product_ids (list): data products unique identifiers
+                (product id numbers or internal_names)
+            max_workers (int, optional): maximum number of
+                simultaneous metadata requests and downloads.
+                Defaults to 4.
+            memory_budget (int, optional): maximum estimated memory
+                (bytes, see estimate_product_memory) of the products
+                parsed at the same time. A product over it is parsed
+                alone. Defaults to the memory budget of the server.
+            columns (list, optional): columns to read from every
+                product, as in get_product.
+            filters (str, tuple or list, optional): row filters
+                applied to every product, as in get_product.
+            return_type (str, optional): container of the returned
+                data, as in get_product. Defaults to "astropy".
+            get_big_products (bool, optional): as in get_product.
+                Defaults to False.
+            parse_processes (int, optional): number of worker
+                processes parsing main files; 0 parses them in the
+                download threads. Defaults to max_workers.
+
+        Yields:
+            tuple: product id (as given), contents (None on errors)
+                and the exception raised for it (None on success),
+                in completion order
+        """
+        check_return_type(return_type)
+
+        print("Connecting to PZ Server...")
+        budget = memory_budget if memory_budget is not None else self._memory_budget()
+        if parse_processes is None:
+            parse_processes = max_workers
+
+        with contextlib.ExitStack() as stack:
+            tmpdirname = stack.enter_context(tempfile.TemporaryDirectory())
+            threads, processes = self._many_executors(
+                stack, max_workers, parse_processes
+            )
+            parsers = processes or threads
+
+            pending = {}
+            for order, product_id in enumerate(product_ids):
+                task = {
+                    "product_id": product_id,
+                    "destination": pathlib.Path(tmpdirname, str(order)),
+                }
+                future = threads.submit(
+                    self._fetch_for_many,
+                    product_id,
+                    task["destination"],
+                    columns=columns,
+                    filters=filters,
+                    return_type=return_type,
+                    get_big_products=get_big_products,
+                )
+                pending[future] = task
+
+            queued = deque()
+            parsing = 0
+            try:
+                while pending or queued:
+                    while queued and (
+                        not parsing
+                        or budget is None
+                        or parsing + queued[0]["cost"] <= budget
+                    ):
+                        task = queued.popleft()
+                        main_file = task["metadata"]["main_file"]
+                        future = parsers.submit(
+                            self._parse_to_mapped,
+                            str(task["file_path"]),
+                            main_file,
+                            resolve_columns(columns, main_file),
+                            parse_filters(filters, main_file),
+                            str(task["destination"].with_suffix(".arrow")),
+                        )
+                        pending[future] = task
+                        parsing += task["cost"]
+
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        task = pending.pop(future)
+                        if "file_path" in task:
+                            parsing -= task["cost"]
+                        try:
+                            kind, data = self._many_result(
+                                task, future, columns or filters, return_type
+                            )
+                        # a failing product must not abort the others
+                        # pylint: disable-next=broad-exception-caught
+                        except Exception as error:
+                            yield task["product_id"], None, error
+                            continue
+
+                        if kind == "file":
+                            task["file_path"] = data
+                            task["cost"] = self._parse_cost(
+                                task["metadata"], columns, return_type
+                            )
+                            queued.append(task)
+                        else:
+                            yield task["product_id"], data, None
+            finally:
+                # when the caller stops early, only the running downloads
+                # and parses are waited for
+                for future in pending:
+                    future.cancel()
+                threads.shutdown(cancel_futures=True)
+                if processes is not None:
+                    processes.shutdown(cancel_futures=True)
+
+    @staticmethod
+    def _many_executors(stack, max_workers, parse_processes):
+        """Download threads and parse processes of get_products_many."""
+        threads = stack.enter_context(
+            ThreadPoolExecutor(max_workers=max(1, max_workers))
+        )
+        if parse_processes <= 0:
+            return threads, None
+
+        methods = multiprocessing.get_all_start_methods()
+        # forking a process with running download threads is unsafe
+        processes = stack.enter_context(
+            ProcessPoolExecutor(
+                max_workers=parse_processes,
+                mp_context=multiprocessing.get_context(
+                    "forkserver" if "forkserver" in methods else None
+                ),
+            )
+        )
+        return threads, processes
+
+    def _many_result(self, task, future, is_selection, return_type):
+        """Outcome of a finished fetch or parse of get_products_many.
+
+        Returns:
+            tuple: "data" and the contents of the product, or "file" and
+                the downloaded main file to parse
+        """
+        if "file_path" not in task:
+            task["metadata"], kind, data = future.result()
+            return kind, data
+
+        shutil.rmtree(task["destination"], ignore_errors=True)
+        data = self._read_parsed_many(
+            task["metadata"], future.result(), is_selection, return_type
+        )
+        return "data", data
+
+    def _fetch_for_many(
+        self,
+        product_id,
+        destination,
+        *,
+        columns,
+        filters,
+        return_type,
+        get_big_products,
+    ):
+        """Fetch stage of get_products_many: metadata, checks and download.
+
+        Returns:
+            tuple: metadata, "data" and the contents of the product (HATS
+                products and parsed tables in the product cache), or
+                "file" and the downloaded main file to parse
+        """
+        metadata = self.get_product_metadata(product_id)
+        self._validate_product_size(
+            metadata,
+            product_id,
+            get_big_products,
+            return_type=return_type,
+            columns=columns,
+        )
+        self._check_tabular_product(metadata, product_id)
+
+        main_file = metadata["main_file"]
+        columns = resolve_columns(columns, main_file)
+        filters = parse_filters(filters, main_file)
+        hats_options = self._hats_open_options(columns, filters)
+
+        if main_file.get("is_directory"):
+            data = self._get_hats_product(metadata, **hats_options)
+            return metadata, "data", convert_table(data, return_type)
+
+        parsed_path = self._cached_parsed_table(metadata)
+        if parsed_path is not None:
+            data = self._read_parsed_table(parsed_path, columns, filters, return_type)
+            return metadata, "data", data
+
+        destination.mkdir(parents=True, exist_ok=True)
+        file_path = self._main_file_path(metadata, destination)
+        if file_path.suffix.lower() == ".zip":
+            data = self._read_hats_archive(
+                file_path, main_file.get("name"), **hats_options
+            )
+            return metadata, "data", convert_table(data, return_type)
+        return metadata, "file", file_path
+
+    def _parse_cost(self, metadata, columns, return_type):
+        """Estimated memory of parsing a product, for get_products_many."""
+        estimate = self._estimate_product_memory(
+            metadata, columns, return_type, read_footer=False
+        )
+        if estimate is not None:
+            return estimate["bytes"]
+        try:
+            return float(metadata["main_file"].get("size") or 0)
+        except (TypeError, ValueError):
+            return 0
+
+    def _read_parsed_many(self, metadata, path, is_selection, return_type):
+        """Maps a table parsed by a worker, keeping full tables in the cache."""
+        path = pathlib.Path(path)
+        version = None if is_selection else self._parsed_table_version(metadata)
+        if version is not None:
+            path = self.cache.put(metadata["id"], "parsed", version, path)
+
+        data = read_mapped(path, return_type)
+        if version is None:
+            # the mapping keeps the data alive (not possible on Windows)
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        return data
@@ -0,0 +1,263 @@
+"""
+In-memory size estimation of product contents
+"""
+
+import os
+
+import h5py
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .readers import column_types, resolve_columns
+
+# bytes per value assumed when the type of a column is unknown
+DEFAULT_VALUE_BYTES = 8
+# average length assumed for string values without file statistics
+DEFAULT_STRING_LENGTH = 16
+# bytes of a Python str object besides its characters, plus the pointer
+# held by the pandas object column
+PYTHON_STRING_OVERHEAD = 57
+
+
+def column_sizes_from_metadata(main_file, n_rows):
+    """
+    Estimates the Arrow size of each column from the registered columns.
+
+    Args:
+        main_file (dict): main file info (columns and column_types)
+        n_rows (int): number of rows
+
+    Returns:
+        dict: column name -> (bytes, is_string)
+    """
+
+    types = column_types(main_file)
+    sizes = {}
+    for name in main_file.get("columns") or []:
+        type_ = types.get(name)
+        if type_ is not None and pa.types.is_string(type_):
+            # offsets and characters
+            sizes[name] = (n_rows * (4 + DEFAULT_STRING_LENGTH), True)
+        elif type_ is not None and type_.bit_width > 1:
+            sizes[name] = (n_rows * type_.bit_width // 8, False)
+        else:
+            sizes[name] = (n_rows * DEFAULT_VALUE_BYTES, False)
+    return sizes
+
+
+def column_sizes_from_parquet(source):
+    """
+    Reads the uncompressed size of each column from a parquet footer.
+
+    Only the footer is read, so source may be a RemoteFile.
+
+    Args:
+        source (str or file object): parquet file
+
+    Returns:
+        tuple: number of rows and column name -> (bytes, is_string)
+    """
+
+    metadata = pq.ParquetFile(source).metadata
+    schema = metadata.schema.to_arrow_schema()
+    sizes = {name: 0 for name in schema.names}
+
+    for index in range(metadata.num_row_groups):
+        row_group = metadata.row_group(index)
+        for position in range(row_group.num_columns):
+            column = row_group.column(position)
+            name = column.path_in_schema.split(".")[0]
+            if name in sizes:
+                sizes[name] += column.total_uncompressed_size
+
+    return metadata.num_rows, {
+        name: (
+            sizes[name],
+            pa.types.is_string(schema.field(name).type)
+            or pa.types.is_large_string(schema.field(name).type),
+        )
+        for name in schema.names
+    }
+
+
+def column_sizes_from_hdf5(source):
+    """
+    Reads the size of each column from the HDF5 dataset headers.
+
+    Supports the layouts read by readers.iter_hdf5_batches (pandas
+    tables, compound datasets and groups of one-dimensional datasets);
+    only the headers are read, so source may be a RemoteFile.
+
+    Args:
+        source (str or file object): HDF5 file
+
+    Returns:
+        tuple: number of rows and column name -> (bytes, is_string)
+    """
+
+    n_rows = 0
+    sizes = {}
+
+    def visit(_name, node):
+        nonlocal n_rows
+        if not isinstance(node, h5py.Dataset) or not node.shape:
+            return
+        rows = node.shape[0]
+        if node.dtype.names:
+            n_rows = max(n_rows, rows)
+            for field in node.dtype.names:
+                dtype = node.dtype.fields[field][0]
+                sizes[field] = (rows * dtype.itemsize, dtype.kind in "SUO")
+        elif len(node.shape) == 1:
+            n_rows = max(n_rows, rows)
+            field = node.name.rsplit("/", 1)[-1]
+            sizes[field] = (rows * node.dtype.itemsize, node.dtype.kind in "SUO")
+
+    with h5py.File(source, "r") as h5file:
+        h5file.visititems(visit)
+
+    return n_rows, sizes
+
+
+def container_bytes(column_sizes, n_rows, return_type="astropy"):
+    """
+    Predicts the memory used to load columns in a return container,
+    including the Arrow buffers alive during the conversion.
+
+    Args:
+        column_sizes (dict): column name -> (Arrow bytes, is_string)
+        n_rows (int): number of rows
+        return_type (str, optional): "astropy", "pandas", "arrow" or
+            "polars". Defaults to "astropy".
+
+    Returns:
+        dict: column name -> predicted bytes
+    """
+
+    predicted = {}
+    for name, (size, is_string) in column_sizes.items():
+        if return_type in ("arrow", "polars"):
+            predicted[name] = size
+        elif is_string:
+            length = max(size / n_rows - 4, 1) if n_rows else 0
+            if return_type == "pandas":
+                container = n_rows * (PYTHON_STRING_OVERHEAD + length)
+            else:
+                # fixed-width UCS-4 strings as long as the longest value,
+                # taken as twice the average
+                container = n_rows * 4 * 2 * length
+            predicted[name] = int(container + size)
+        else:
+            # numeric buffers are copied once; pandas releases the Arrow
+            # buffers column by column
+            predicted[name] = size if return_type == "pandas" else 2 * size
+    return predicted
+
+
+def available_memory():
+    """
+    Reads the memory available to new allocations.
+
+    Returns:
+        int: bytes, or None when it cannot be determined
+    """
+
+    try:
+        with open("/proc/meminfo", encoding="utf-8") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def suggest_columns(predicted, budget, preferred=()):
+    """
+    Selects columns whose predicted size fits in a memory budget,
+    keeping the preferred columns (e.g. associated ones) first.
+
+    Args:
+        predicted (dict): column name -> predicted bytes
+        budget (int): memory budget in bytes
+        preferred (list, optional): columns selected first.
+
+    Returns:
+        list: column names, in file order
+    """
+
+    order = [name for name in preferred if name in predicted]
+    order += [name for name in predicted if name not in order]
+
+    selected = set()
+    total = 0
+    for name in order:
+        if total + predicted[name] <= budget:
+            selected.add(name)
+            total += predicted[name]
+
+    return [name for name in predicted if name in selected]
+
+
+def estimate_memory(  # pylint: disable=too-many-arguments
+    main_file,
+    n_rows=None,
+    *,
+    columns=None,
+    return_type="astropy",
+    column_sizes=None,
+    budget=None,
+):
+    """
+    Estimates the memory needed to load a product main file.
+
+    Args:
+        main_file (dict): main file info of the product
+        n_rows (int, optional): number of rows. Defaults to the n_rows
+            of the main file info.
+        columns (list, optional): columns to load, by name, alias or UCD.
+            Defaults to all columns.
+        return_type (str, optional): container of the data.
+            Defaults to "astropy".
+        column_sizes (dict, optional): column name -> (Arrow bytes,
+            is_string), e.g. read from a file footer. Defaults to an
+            estimate from the registered columns.
+        budget (int, optional): memory budget used to suggest columns.
+
+    Returns:
+        dict: n_rows, bytes (total), columns (name -> bytes), source
+            ("footer" or "metadata") and suggested_columns (columns that
+            fit in the budget), or None without enough information
+    """
+
+    source = "footer"
+    if column_sizes is None:
+        source = "metadata"
+        n_rows = n_rows if n_rows is not None else main_file.get("n_rows")
+        if not n_rows or not main_file.get("columns"):
+            return None
+        column_sizes = column_sizes_from_metadata(main_file, int(n_rows))
+
+    predicted = container_bytes(column_sizes, int(n_rows or 0), return_type)
+    selected = resolve_columns(columns, main_file)
+    if selected:
+        predicted = {name: predicted[name] for name in selected if name in predicted}
+
+    preferred = [
+        association.get("column_name")
+        for association in main_file.get("columns_association") or []
+    ]
+    return {
+        "n_rows": int(n_rows or 0),
+        "bytes": int(np.sum(list(predicted.values()), dtype=np.int64)),
+        "columns": predicted,
+        "source": source,
+        "suggested_columns": (
+            suggest_columns(predicted, budget, preferred) if budget else None
+        ),
+    }
@@ -4,6 +4,8 @@ Classes responsible for managing user interaction with products
 
 import mimetypes
 
+from .upload import UploadError, run_concurrently
+
 
 class PzProduct:
     """Responsible for managing user interactions with product."""
@@ -85,6 +87,34 @@ class PzProduct:
         """
         return self.__attach_file(filepath, "description")
 
+    def attach_auxiliary_files(self, filepaths, max_workers=4):
+        """Attach auxiliary files, uploading them simultaneously
+        Args:
+            filepaths (list): file paths
+            max_workers (int, optional): maximum number of simultaneous
+                uploads. Defaults to 4.
+        Returns:
+            list: ids of the attached files, in the order of filepaths
+        Raises:
+            UploadError: if some files could not be uploaded; the files
+                attached successfully are kept.
+        """
+        return self.__attach_files(filepaths, "auxiliary", max_workers)
+
+    def attach_description_files(self, filepaths, max_workers=4):
+        """Attach description files, uploading them simultaneously
+        Args:
+            filepaths (list): file paths
+            max_workers (int, optional): maximum number of simultaneous
+                uploads. Defaults to 4.
+        Returns:
+            list: ids of the attached files, in the order of filepaths
+        Raises:
+            UploadError: if some files could not be uploaded; the files
+                attached successfully are kept.
+        """
+        return self.__attach_files(filepaths, "description", max_workers)
+
     def get_auxiliary_files(self):
         """Get auxiliary files
         Returns:
@@ -150,6 +180,38 @@ class PzProduct:
         self.__files.append(data)
         self.__get_files()
 
+    def __attach_files(self, filepaths, file_type, max_workers):
+        """Attach files simultaneously
+        Args:
+            filepaths (list): file paths
+            file_type (str): file type
+            max_workers (int): maximum number of simultaneous uploads
+        Returns:
+            list: ids of the attached files
+        """
+
+        if self.__attributes.get("is_owner", False) is False:
+            raise ValueError("You are not the owner of this product")
+
+        results, errors = run_concurrently(
+            lambda filepath: self.__api.upload_file(
+                self.product_id, filepath, file_type,
+                mimetype=self.__check_mimetype(filepath)
+            ),
+            filepaths,
+            max_workers,
+        )
+
+        attached = [data for data in results if data is not None]
+        if attached:
+            self.main_file, self.__files = self.__get_files()
+        files_id = [data.get("id") for data in attached]
+
+        if errors:
+            raise UploadError(files_id, errors)
+
+        return files_id
+
     def __get_files_by_type(self, file_type):
         """Get a files by type
         Args:
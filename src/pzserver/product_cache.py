@@ -0,0 +1,337 @@
+"""
+Persistent on-disk cache of downloaded product files
+"""
+
+import hashlib
+import json
+import pathlib
+import shutil
+import threading
+import time
+import uuid
+
+DEFAULT_CACHE_DIRECTORY = "~/.cache/pzserver/products"
+DEFAULT_CACHE_MAX_BYTES = 10 * 1024**3
+
+# fields of the product and main file metadata that change when the
+# stored files change
+VERSION_FIELDS = (
+    "checksum",
+    "sha256",
+    "md5",
+    "size",
+    "updated_at",
+    "modified",
+    "created_at",
+)
+
+
+class ProductCache:
+    """
+    Content-addressed cache of product files.
+
+    Files are stored once per content (by their sha256 digest) and
+    indexed by product id, kind ("main_file", "archive" or "parsed", the
+    main file converted to an Arrow IPC file) and a version marker built
+    from the server metadata, so a product updated on the server is
+    downloaded again. The least recently used files are evicted when the
+    cache grows over its size budget.
+
+    Layout of the cache directory:
+        index.json                  entries and access times
+        blobs/<sha256>/<filename>   cached files (original name kept)
+    """
+
+    def __init__(
+        self, directory=DEFAULT_CACHE_DIRECTORY, max_bytes=DEFAULT_CACHE_MAX_BYTES
+    ):
+        """
+        ProductCache class constructor
+
+        Args:
+            directory (str, optional): cache directory.
+                Defaults to "~/.cache/pzserver/products".
+            max_bytes (int, optional): size budget in bytes. Defaults to 10 GB.
+        """
+
+        self.directory = pathlib.Path(directory).expanduser()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+
+    @property
+    def _index_path(self):
+        return self.directory / "index.json"
+
+    @property
+    def _blobs_dir(self):
+        return self.directory / "blobs"
+
+    @staticmethod
+    def version_marker(*metadata):
+        """
+        Builds the version marker of a product from its metadata.
+
+        Args:
+            *metadata (dict): product metadata and/or main file info
+
+        Returns:
+            str: version marker or None when the metadata has no version
+                information (the product is then not cached)
+        """
+
+        values = []
+        for data in metadata:
+            data = data or {}
+            values.extend(
+                (field, data[field]) for field in VERSION_FIELDS if data.get(field)
+            )
+
+        if not values:
+            return None
+        return json.dumps(values, sort_keys=True, default=str)
+
+    @staticmethod
+    def make_key(product_id, kind, version) -> str:
+        """
+        Builds the index key of a cached file.
+
+        Args:
+            product_id (int): product id
+            kind (str): "main_file", "archive" or "parsed"
+            version (str): version marker
+
+        Returns:
+            str: index key
+        """
+        return f"{product_id}:{kind}:{hashlib.sha256(version.encode()).hexdigest()[:16]}"
+
+    def _read_index(self) -> dict:
+        try:
+            return json.loads(self._index_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._index_path.with_name(f"index.{uuid.uuid4().hex}.tmp")
+        tmp_path.write_text(json.dumps(index), encoding="utf-8")
+        tmp_path.replace(self._index_path)
+
+    def _blob_path(self, entry) -> pathlib.Path:
+        return self._blobs_dir / entry["sha256"] / entry["filename"]
+
+    def get(self, product_id, kind, version, verify=False):
+        """
+        Gets a cached file.
+
+        The size of the file is always checked; with verify=True its
+        sha256 digest is also recomputed. Corrupted files are discarded.
+
+        Args:
+            product_id (int): product id
+            kind (str): "main_file", "archive" or "parsed"
+            version (str): version marker
+            verify (bool, optional): check the file digest. Defaults to False.
+
+        Returns:
+            pathlib.Path: path of the cached file or None
+        """
+
+        key = self.make_key(product_id, kind, version)
+
+        with self._lock:
+            index = self._read_index()
+            entry = index.get(key)
+
+            if entry is None or not self._is_intact(entry, verify):
+                if entry is not None:
+                    self._discard(index, key)
+                    self._write_index(index)
+                self.misses += 1
+                return None
+
+            entry["last_access"] = time.time()
+            self._write_index(index)
+            self.hits += 1
+            return self._blob_path(entry)
+
+    def _is_intact(self, entry, verify):
+        path = self._blob_path(entry)
+        try:
+            if path.stat().st_size != entry["size"]:
+                return False
+        except OSError:
+            return False
+
+        return not verify or self.file_digest(path) == entry["sha256"]
+
+    @staticmethod
+    def file_digest(path) -> str:
+        """
+        Computes the sha256 digest of a file.
+
+        Args:
+            path (str): file path
+
+        Returns:
+            str: hex digest
+        """
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as src:
+            for block in iter(lambda: src.read(1024**2), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def put(self, product_id, kind, version, path):
+        """
+        Moves a downloaded file into the cache.
+
+        Args:
+            product_id (int): product id
+            kind (str): "main_file", "archive" or "parsed"
+            version (str): version marker
+            path (str): downloaded file (it is moved, not copied)
+
+        Returns:
+            pathlib.Path: path of the cached file
+        """
+
+        path = pathlib.Path(path)
+        sha256 = self.file_digest(path)
+        entry = {
+            "product_id": product_id,
+            "kind": kind,
+            "sha256": sha256,
+            "filename": path.name,
+            "size": path.stat().st_size,
+            "last_access": time.time(),
+        }
+        blob = self._blob_path(entry)
+
+        with self._lock:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            if blob.is_file() and blob.stat().st_size == entry["size"]:
+                path.unlink()
+            else:
+                shutil.move(str(path), blob)
+
+            index = self._read_index()
+            index[self.make_key(product_id, kind, version)] = entry
+            self._prune(index, self.max_bytes, keep=sha256)
+            self._write_index(index)
+
+        return blob
+
+    def _discard(self, index, key):
+        entry = index.pop(key)
+        if not any(other["sha256"] == entry["sha256"] for other in index.values()):
+            shutil.rmtree(self._blobs_dir / entry["sha256"], ignore_errors=True)
+
+    def _prune(self, index, max_bytes, keep=None):
+        sizes = {entry["sha256"]: entry["size"] for entry in index.values()}
+        total = sum(sizes.values())
+        freed = 0
+
+        for key, entry in sorted(index.items(), key=lambda item: item[1]["last_access"]):
+            if total <= max_bytes:
+                break
+            if entry["sha256"] == keep:
+                continue
+            shared = any(
+                other["sha256"] == entry["sha256"]
+                for other_key, other in index.items()
+                if other_key != key
+            )
+            self._discard(index, key)
+            if not shared:
+                total -= entry["size"]
+                freed += entry["size"]
+
+        return freed
+
+    def prune(self, max_bytes=None) -> int:
+        """
+        Evicts the least recently used files until the cache fits in the
+        size budget.
+
+        Args:
+            max_bytes (int, optional): size budget. Defaults to max_bytes.
+
+        Returns:
+            int: number of bytes freed
+        """
+
+        with self._lock:
+            index = self._read_index()
+            freed = self._prune(index, self.max_bytes if max_bytes is None else max_bytes)
+            self._write_index(index)
+        return freed
+
+    def invalidate(self, product_id):
+        """
+        Removes every cached file of a product.
+
+        Args:
+            product_id (int): product id
+        """
+
+        with self._lock:
+            index = self._read_index()
+            for key in [k for k, e in index.items() if e["product_id"] == product_id]:
+                self._discard(index, key)
+            self._write_index(index)
+
+    def clear(self):
+        """
+        Removes every cached file.
+        """
+
+        with self._lock:
+            shutil.rmtree(self._blobs_dir, ignore_errors=True)
+            self._index_path.unlink(missing_ok=True)
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the cache statistics.
+
+        Returns:
+            dict: directory, entries, size in bytes, size budget, hits and
+                misses of this session
+        """
+
+        with self._lock:
+            index = self._read_index()
+
+        return {
+            "directory": str(self.directory),
+            "entries": len(index),
+            "bytes": sum({e["sha256"]: e["size"] for e in index.values()}.values()),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    @staticmethod
+    def export(cached_path, destination) -> pathlib.Path:
+        """
+        Copies a cached file to a destination directory (a copy rather
+        than a link, so editing it does not corrupt the cache).
+
+        Args:
+            cached_path (pathlib.Path): cached file returned by get or put
+            destination (str): destination directory
+
+        Returns:
+            pathlib.Path: path of the file in the destination
+        """
+
+        destination = pathlib.Path(destination)
+        destination.mkdir(parents=True, exist_ok=True)
+        target = destination / pathlib.Path(cached_path).name
+        shutil.copyfile(cached_path, target)
+        return target
@@ -0,0 +1,517 @@
+"""
+Product files on the local side: downloads, the product cache, parsed
+copies of main files, batch reading, spilling and memory checks
+"""
+
+import pathlib
+import tempfile
+import zipfile
+
+import pyarrow as pa
+import requests
+import tables_io
+
+from .memory import (available_memory, column_sizes_from_hdf5,
+                     column_sizes_from_parquet, estimate_memory)
+from .product_cache import ProductCache
+from .readers import (CSV_EXTENSIONS, DEFAULT_BATCH_SIZE, HDF5_EXTENSIONS,
+                      PARQUET_EXTENSIONS, convert_table, filter_batches,
+                      from_astropy, iter_file_batches, parse_filters,
+                      resolve_columns)
+from .spill import mapped_container, read_mapped, spill_batches, write_mapped
+
+FONTCOLORERR = "\033[38;2;255;0;0m"
+FONTCOLOREND = "\033[0m"
+# seconds the size checks wait for the main file archive before giving
+# up on reading the footer of the file
+FOOTER_ARCHIVE_TIMEOUT = 5
+MAX_IN_MEMORY_PRODUCT_SIZE_BYTES = 200 * 1024**2
+
+
+class ProductFilesMixin:
+    """
+    Downloads, caches and reads the files of data products for PzServer.
+    """
+
+    def download_product(self, product_id=None, save_in="."):
+        """
+        Download the data to local.
+
+        Connects to the Photo-z Server's database and
+        download a compressed zip file containing all
+        the data and metadata of a given data product.
+
+        Args:
+            product_id (str or int): data product
+                unique identifier (product id
+                number or internal_name)
+            save_in (str): location where the file will
+                be saved
+
+        """
+        print("Connecting to PZ Server...")
+
+        metadata = self.get_product_metadata(
+            product_id, mainfile_info=self.cache is not None
+        )
+        prodid = metadata["id"]
+
+        results_dict = self._cached_download(
+            metadata,
+            "archive",
+            save_in,
+            lambda destination: self.api.download_product(prodid, destination),
+        )
+        if results_dict.get("success", False):
+            print(f"File saved as: {results_dict['message']}")
+            print("Done!")
+        else:
+            print(f"{FONTCOLORERR}Error: {results_dict['message']}{FONTCOLORERR}")
+
+    def download_products(self, product_ids, save_in=".", *, max_workers=4):
+        """
+        Download many data products to local.
+
+        The compressed zip files of all the products are prepared at
+        once by the Photo-z Server, and each one is downloaded as soon as
+        it is ready.
+
+        Args:
+            product_ids (list): data products unique identifiers
+                (product id numbers or internal_names)
+            save_in (str): location where the files will
+                be saved
+            max_workers (int, optional): maximum number of
+                simultaneous downloads. Defaults to 4.
+
+        Returns:
+            dict: product id -> saved file path (None on errors)
+        """
+        print("Connecting to PZ Server...")
+
+        prodids = [
+            self.get_product_metadata(product_id, mainfile_info=False)["id"]
+            for product_id in product_ids
+        ]
+
+        results = self.api.download_products(
+            prodids, save_in, max_workers=max_workers
+        )
+
+        paths = {}
+        for prodid, results_dict in results.items():
+            if results_dict.get("success", False):
+                print(f"File saved as: {results_dict['message']}")
+                paths[prodid] = results_dict["message"]
+            else:
+                print(
+                    f"{FONTCOLORERR}Error ({prodid}): {results_dict['message']}"
+                    f"{FONTCOLOREND}"
+                )
+                paths[prodid] = None
+
+        print("Done!")
+        return paths
+
+    def iter_product_batches(  # pylint: disable=too-many-arguments
+        self,
+        product_id,
+        batch_size=DEFAULT_BATCH_SIZE,
+        columns=None,
+        as_pandas=False,
+        filters=None,
+    ):
+        """
+        Reads the data product contents in batches.
+
+        The main file is downloaded (or taken from the product cache)
+        and read incrementally, so products larger than the memory can
+        be processed in a streaming pipeline. Supports parquet, CSV,
+        HDF5 and HATS main files.
+
+        Args:
+            product_id (str or int): data product
+                unique identifier (product id
+                number or internal name)
+            batch_size (int, optional): number of rows of each
+                batch. Defaults to 65536.
+            columns (list, optional): columns to read, by name,
+                alias or UCD. Defaults to all columns.
+            as_pandas (bool, optional): yield pandas.DataFrame
+                chunks instead of pyarrow.RecordBatch objects.
+                Defaults to False.
+            filters (str, tuple or list, optional): row filters,
+                as in get_product.
+
+        Yields:
+            pyarrow.RecordBatch or pandas.DataFrame
+        """
+        metadata = self.get_product_metadata(product_id)
+
+        if not metadata["main_file"]:
+            raise FileNotFoundError(f"Product ID ({product_id}): main file not found")
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            batches = self._iter_main_file_batches(
+                metadata, tmpdirname, batch_size, columns, filters
+            )
+            for batch in batches:
+                yield batch.to_pandas() if as_pandas else batch
+
+    def _iter_main_file_batches(  # pylint: disable=too-many-arguments
+        self, metadata, tmpdirname, batch_size, columns, filters
+    ):
+        """Downloads the main file and reads it in record batches."""
+        file_path = self._main_file_path(metadata, tmpdirname)
+        if metadata["main_file"].get("is_directory") or file_path.suffix == ".zip":
+            return self._iter_hats_archive_batches(
+                file_path,
+                metadata["main_file"].get("name"),
+                pathlib.Path(tmpdirname, "extracted"),
+                batch_size,
+                **self._hats_open_options(
+                    resolve_columns(columns, metadata["main_file"]),
+                    parse_filters(filters, metadata["main_file"]),
+                ),
+            )
+
+        return iter_file_batches(
+            file_path, batch_size, columns, metadata["main_file"], filters
+        )
+
+    def _spill_product(self, metadata, columns, filters, return_type):
+        """Reads a product into a memory-mapped table."""
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            table = spill_batches(
+                self._iter_main_file_batches(
+                    metadata, tmpdirname, DEFAULT_BATCH_SIZE, columns, filters
+                ),
+                metadata["main_file"],
+                self.spill_directory,
+            )
+        return mapped_container(table, return_type, self.spill_directory)
+
+    @staticmethod
+    def _read_selection(file_path, main_file, columns, filters):
+        """Reads the selected columns and rows of a main file into an Arrow table."""
+        suffix = pathlib.Path(file_path).suffix.lower()
+
+        if suffix in PARQUET_EXTENSIONS + CSV_EXTENSIONS + HDF5_EXTENSIONS:
+            batches = list(
+                iter_file_batches(
+                    file_path, DEFAULT_BATCH_SIZE, columns, main_file, filters
+                )
+            )
+        else:
+            # formats without a streaming reader are filtered in memory
+            table = tables_io.read(file_path, tables_io.types.AP_TABLE)
+            arrow_table = from_astropy(table)
+            batches = list(filter_batches(arrow_table.to_batches(), filters, columns))
+
+        return ProductFilesMixin._table_from_batches(batches, columns)
+
+    @staticmethod
+    def _table_from_batches(batches, columns):
+        if not batches:
+            return pa.table({column: pa.array([]) for column in columns or []})
+        return pa.Table.from_batches(batches)
+
+    def _parsed_table_version(self, metadata):
+        if self.cache is None:
+            return None
+        return ProductCache.version_marker(metadata, metadata.get("main_file"))
+
+    def _cached_parsed_table(self, metadata):
+        """Path of the parsed main file in the product cache, or None."""
+        version = self._parsed_table_version(metadata)
+        if version is None:
+            return None
+        return self.cache.get(metadata["id"], "parsed", version)
+
+    def _cache_parsed_table(self, metadata, data):
+        """Stores the parsed main file in the product cache as an Arrow
+        IPC file, mapped by later get_product calls instead of parsing
+        the main file again.
+
+        Best effort: contents that cannot be stored are parsed again.
+        """
+        version = self._parsed_table_version(metadata)
+        if version is None:
+            return
+
+        name = pathlib.Path(metadata["main_file"].get("name") or "main").stem
+        try:
+            table = data if isinstance(data, pa.Table) else from_astropy(data)
+            with tempfile.TemporaryDirectory(dir=self._cache_staging_dir()) as tmpdir:
+                path = write_mapped(table, pathlib.Path(tmpdir, f"{name}.arrow"))
+                self.cache.put(metadata["id"], "parsed", version, path)
+        except (OSError, TypeError, ValueError, pa.ArrowException):
+            pass
+
+    def _read_parsed_table(self, path, columns, filters, return_type):
+        """Reads the selected columns and rows of a parsed main file."""
+        if not filters:
+            return read_mapped(path, return_type, columns)
+
+        table = read_mapped(path, "arrow")
+        batches = list(filter_batches(table.to_batches(), filters, columns))
+        return convert_table(self._table_from_batches(batches, columns), return_type)
+
+    def estimate_product_memory(
+        self, product_id, columns=None, return_type="astropy"
+    ):
+        """
+        Estimates the memory get_product needs to load a product.
+
+        The estimate uses the number of rows and the registered columns
+        of the main file or, when the row count is unknown, the footer
+        of parquet and HDF5 main files, read with small byte-range
+        requests (skipped when the main file archive is not ready
+        within a few seconds).
+
+        Args:
+            product_id (str or int): data product
+                unique identifier (product id
+                number or internal name)
+            columns (list, optional): columns to load, by name,
+                alias or UCD. Defaults to all columns.
+            return_type (str, optional): container of the data, as
+                in get_product. Defaults to "astropy".
+
+        Returns:
+            dict: n_rows, bytes (total), columns (name -> bytes),
+                source ("metadata" or "footer"), budget (memory budget
+                in bytes) and suggested_columns (columns that fit in
+                the budget), or None without enough information
+        """
+
+        metadata = self.get_product_metadata(product_id)
+        return self._estimate_product_memory(
+            metadata, columns, return_type, read_footer=True
+        )
+
+    def _memory_budget(self):
+        if self.memory_budget is not None:
+            return self.memory_budget
+        available = available_memory()
+        return None if available is None else available // 2
+
+    def _estimate_product_memory(self, metadata, columns, return_type, read_footer):
+        main_file = metadata.get("main_file") or {}
+        budget = self._memory_budget()
+        estimate = estimate_memory(
+            main_file, columns=columns, return_type=return_type, budget=budget
+        )
+
+        if estimate is None and read_footer:
+            footer = self._footer_column_sizes(metadata)
+            if footer is not None:
+                n_rows, column_sizes = footer
+                estimate = estimate_memory(
+                    main_file,
+                    n_rows,
+                    columns=columns,
+                    return_type=return_type,
+                    column_sizes=column_sizes,
+                    budget=budget,
+                )
+
+        if estimate is not None:
+            estimate["budget"] = budget
+        return estimate
+
+    def _footer_column_sizes(self, metadata):
+        """Column sizes read from the footer of a parquet or HDF5 main file."""
+        main_file = metadata.get("main_file") or {}
+        extension = (main_file.get("extension") or "").lower()
+        if extension in PARQUET_EXTENSIONS:
+            read_sizes = column_sizes_from_parquet
+        elif extension in HDF5_EXTENSIONS:
+            read_sizes = column_sizes_from_hdf5
+        else:
+            return None
+
+        # the footer is only a hint: when the archive is not ready yet (or
+        # the file cannot be read) the stored size is used
+        try:
+            remote = self.api.open_main_file_archive(
+                metadata["id"], timeout=FOOTER_ARCHIVE_TIMEOUT, poll_interval=1
+            )
+            if remote is None:
+                return None
+            if remote.read(4) != b"PK\x03\x04":
+                remote.seek(0)
+                return read_sizes(remote)
+            with zipfile.ZipFile(remote) as archive:
+                members = [
+                    member
+                    for member in archive.infolist()
+                    if member.filename.lower().endswith(extension)
+                    and member.compress_type == zipfile.ZIP_STORED
+                ]
+                if not members:
+                    return None
+                with archive.open(members[0]) as member_file:
+                    return read_sizes(member_file)
+        except (
+            requests.exceptions.RequestException,
+            zipfile.BadZipFile,
+            OSError,
+            ValueError,
+        ):
+            return None
+
+    def _validate_product_size(
+        self,
+        metadata,
+        product_id,
+        get_big_products,
+        *,
+        columns=None,
+        return_type="astropy",
+        spill=False,
+    ):
+        """Prevent large products from being loaded into memory by default.
+
+        Returns:
+            bool: True when the product must be spilled to disk
+        """
+        if get_big_products:
+            return False
+
+        main_file = metadata.get("main_file") or {}
+        size_bytes = main_file.get("size")
+        try:
+            is_too_large = float(size_bytes) > MAX_IN_MEMORY_PRODUCT_SIZE_BYTES
+        except (TypeError, ValueError):
+            is_too_large = False
+
+        product_name = metadata.get("internal_name") or product_id
+        # the footer (which may wait for the main file archive) only
+        # decides between memory and disk when spilling; without it a
+        # large product is refused right away
+        estimate = self._estimate_product_memory(
+            metadata, columns, return_type, read_footer=is_too_large and spill
+        )
+
+        if estimate is not None and estimate["budget"] is not None:
+            if estimate["bytes"] <= estimate["budget"]:
+                return False
+            if spill:
+                return True
+
+            message = (
+                f"Product '{product_name}' is estimated to use "
+                f"{estimate['bytes'] / 1024**2:.0f} MB of memory as {return_type} "
+                f"({estimate['n_rows']} rows), more than the memory budget of "
+                f"{estimate['budget'] / 1024**2:.0f} MB, and cannot be loaded "
+                "into memory by default. "
+            )
+            if estimate["suggested_columns"]:
+                message += (
+                    "These columns fit in the budget:\n\n"
+                    f"pz_server.get_product({product_name!r}, "
+                    f"columns={estimate['suggested_columns']!r})\n\n"
+                    "Alternatively, "
+                )
+            raise ValueError(message + self._big_product_advice(product_name))
+
+        if not is_too_large:
+            return False
+        if spill:
+            return True
+
+        raise ValueError(
+            f"Product '{product_name}' is larger than 200 MB and cannot be loaded "
+            "into memory by default. PZ Server may store products in compressed "
+            "form, so this product can use substantially more RAM when decompressed. "
+            + self._big_product_advice(product_name)
+        )
+
+    @staticmethod
+    def _big_product_advice(product_name):
+        return (
+            "We recommend downloading it and reading it locally with pandas, Dask, "
+            "or LSDB (for HATS catalogs):\n\n"
+            "from pathlib import Path\n\n"
+            f"prod_name = {product_name!r}\n"
+            'caminho = Path("./downloaded_data")\n'
+            "caminho.mkdir(parents=True, exist_ok=True)\n"
+            "pz_server.download_product(product_id=prod_name, save_in=caminho)\n\n"
+            "or process it in batches with bounded memory:\n\n"
+            "for batch in pz_server.iter_product_batches(prod_name, as_pandas=True):\n"
+            "    ...\n\n"
+            "To continue anyway, call "
+            "get_product(product_id=prod_name, get_big_products=True)."
+        )
+
+    def _main_file_path(self, metadata, destination):
+        """Path of the main file, from the product cache or downloaded."""
+        results_dict = self._cached_main_file(metadata, destination)
+
+        if not results_dict.get("success", False):
+            message = results_dict.get("message", "Failed to download main file.")
+            raise requests.exceptions.RequestException(message)
+
+        return pathlib.Path(results_dict["message"])
+
+    def _cached_main_file(self, metadata, destination):
+        """Gets the main file from the product cache or downloads it.
+
+        The returned path points into the cache, which must not be
+        modified; destination is only used when the cache is disabled.
+        """
+        return self._cached_download(
+            metadata,
+            "main_file",
+            None,
+            lambda tmpdir: self.api.download_main_file(metadata["id"], tmpdir),
+            fallback_destination=destination,
+        )
+
+    def _cached_download(  # pylint: disable=too-many-arguments
+        self, metadata, kind, save_in, download, fallback_destination=None
+    ):
+        """Serves a product file from the cache or downloads and caches it.
+
+        Args:
+            metadata (dict): product metadata (with main file info)
+            kind (str): "main_file" or "archive"
+            save_in (str): directory where the file is copied. None returns
+                the path of the cached file.
+            download (callable): downloads the file to a directory and
+                returns the response dict of PzRequests
+            fallback_destination (str, optional): download directory when
+                save_in is None and the product cannot be cached.
+
+        Returns:
+            dict: response dict with the file path as message
+        """
+        version = None
+        if self.cache is not None:
+            version = ProductCache.version_marker(metadata, metadata.get("main_file"))
+
+        if version is None:
+            return download(save_in if save_in is not None else fallback_destination)
+
+        cached_path = self.cache.get(metadata["id"], kind, version)
+
+        if cached_path is None:
+            with tempfile.TemporaryDirectory(dir=self._cache_staging_dir()) as tmpdir:
+                results_dict = download(tmpdir)
+                if not results_dict.get("success", False):
+                    return results_dict
+                cached_path = self.cache.put(
+                    metadata["id"], kind, version, results_dict["message"]
+                )
+
+        if save_in is not None:
+            cached_path = self.cache.export(cached_path, save_in)
+
+        return {"success": True, "message": str(cached_path)}
+
+    def _cache_staging_dir(self):
+        """Directory for partial downloads, on the cache file system."""
+        staging = self.cache.directory / "staging"
+        staging.mkdir(parents=True, exist_ok=True)
+        return staging
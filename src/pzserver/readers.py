@@ -0,0 +1,824 @@
+"""
+Streaming readers of product main files
+"""
+
+import ast
+import importlib
+import operator
+import pathlib
+import re
+from functools import reduce
+
+import h5py
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as pa_ds
+import pyarrow.parquet as pq
+from astropy.table import Column, MaskedColumn, Table
+
+DEFAULT_BATCH_SIZE = 65_536
+
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+CSV_EXTENSIONS = (".csv", ".txt", ".dat")
+HDF5_EXTENSIONS = (".h5", ".hdf5", ".hdf")
+
+RETURN_TYPES = ("astropy", "pandas", "arrow", "polars")
+
+# bytes of CSV parsed by each reader thread; larger blocks amortize the
+# per-block overhead on multi-GB files
+CSV_BLOCK_SIZE = 16 * 1024**2
+
+# type names registered for product columns -> Arrow types
+ARROW_TYPES = {
+    "int": pa.int64(),
+    "integer": pa.int64(),
+    "long": pa.int64(),
+    "float": pa.float64(),
+    "double": pa.float64(),
+    "real": pa.float64(),
+    "str": pa.string(),
+    "string": pa.string(),
+    "text": pa.string(),
+    "char": pa.string(),
+    "bool": pa.bool_(),
+    "boolean": pa.bool_(),
+}
+
+FILTER_PATTERN = re.compile(
+    r"^\s*(?P<column>[^\s<>=!]+)\s*"
+    r"(?P<op>==|!=|<=|>=|<|>|=|not in|in)\s*"
+    r"(?P<value>.+?)\s*$"
+)
+COMPARISONS = {
+    "==": operator.eq,
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def resolve_column(name, main_file=None):
+    """
+    Translates a column given by name, alias or UCD to the name of the
+    column in the main file, using the columns association of the
+    main file info.
+
+    Args:
+        name (str): column name, alias (e.g. "z") or UCD (e.g. "src.redshift")
+        main_file (dict, optional): main file info of the product
+
+    Returns:
+        str: column name
+    """
+
+    if not main_file or name in (main_file.get("columns") or []):
+        return name
+
+    lowered = name.lower()
+    for association in main_file.get("columns_association") or []:
+        alias = (association.get("alias") or "").lower()
+        ucd = (association.get("ucd") or "").lower()
+        if lowered == alias or lowered == ucd or lowered in ucd.split(";"):
+            return association.get("column_name", name)
+
+    return name
+
+
+def resolve_columns(columns, main_file=None):
+    """
+    Translates a list of columns with resolve_column.
+
+    Args:
+        columns (list): column names, aliases or UCDs (None for all)
+        main_file (dict, optional): main file info of the product
+
+    Returns:
+        list: column names or None
+    """
+
+    if columns is None:
+        return None
+    return [resolve_column(column, main_file) for column in columns]
+
+
+def _parse_value(value):
+    if not isinstance(value, str):
+        return value
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+
+def parse_filters(filters, main_file=None):
+    """
+    Normalizes row filters to a list of (column, operator, value) tuples,
+    all of which must hold.
+
+    Args:
+        filters (str, tuple or list): a predicate such as "z < 1.5" or
+            ("z", "<", 1.5), or a list of them. Columns may be given by
+            name, alias or UCD. Supported operators: ==, !=, <, <=, >,
+            >=, in and not in.
+        main_file (dict, optional): main file info of the product
+
+    Returns:
+        list: (column, operator, value) tuples, empty when there are no filters
+    """
+
+    if not filters:
+        return []
+    if isinstance(filters, (str, tuple)):
+        filters = [filters]
+
+    parsed = []
+    for predicate in filters:
+        if isinstance(predicate, str):
+            match = FILTER_PATTERN.match(predicate)
+            if match is None:
+                raise ValueError(f"Invalid filter: {predicate!r}")
+            predicate = (match["column"], match["op"], match["value"])
+
+        column, op, value = predicate
+        op = op.strip().lower()
+        if op not in COMPARISONS and op not in ("in", "not in"):
+            raise ValueError(f"Invalid filter operator: {op!r}")
+
+        parsed.append(
+            (
+                resolve_column(column, main_file),
+                "==" if op == "=" else op,
+                _parse_value(value),
+            )
+        )
+
+    return parsed
+
+
+def filters_expression(filters):
+    """
+    Converts parsed filters to a pyarrow expression.
+
+    Args:
+        filters (list): (column, operator, value) tuples
+
+    Returns:
+        pyarrow.compute.Expression: expression or None without filters
+    """
+
+    expressions = []
+    for column, op, value in filters:
+        field = pc.field(column)
+        if op == "in":
+            expressions.append(field.isin(list(value)))
+        elif op == "not in":
+            expressions.append(~field.isin(list(value)))
+        else:
+            expressions.append(COMPARISONS[op](field, value))
+
+    if not expressions:
+        return None
+    return reduce(operator.and_, expressions)
+
+
+def filter_batches(batches, filters, columns=None):
+    """
+    Applies row filters to record batches, one batch at a time.
+
+    Args:
+        batches (iterable): pyarrow.RecordBatch objects, including the
+            columns used by the filters
+        filters (list): (column, operator, value) tuples
+        columns (list, optional): columns kept after filtering.
+
+    Yields:
+        pyarrow.RecordBatch: filtered record batch
+    """
+
+    expression = filters_expression(filters)
+    for batch in batches:
+        if expression is not None:
+            batch = batch.filter(expression)
+        if columns:
+            batch = batch.select(columns)
+        if batch.num_rows:
+            yield batch
+
+
+def _with_filter_columns(columns, filters):
+    if not columns:
+        return columns
+    return list(dict.fromkeys([*columns, *(column for column, _, _ in filters)]))
+
+
+def rebatch(batches, batch_size):
+    """
+    Regroups record batches into batches of batch_size rows (the last
+    one may be smaller).
+
+    Args:
+        batches (iterable): pyarrow.RecordBatch objects
+        batch_size (int): number of rows of each batch
+
+    Yields:
+        pyarrow.RecordBatch: record batch
+    """
+
+    pending = []
+    pending_rows = 0
+
+    for batch in batches:
+        while batch.num_rows:
+            take = min(batch_size - pending_rows, batch.num_rows)
+            pending.append(batch.slice(0, take))
+            pending_rows += take
+            batch = batch.slice(take)
+
+            if pending_rows == batch_size:
+                yield _concat_batches(pending)
+                pending = []
+                pending_rows = 0
+
+    if pending_rows:
+        yield _concat_batches(pending)
+
+
+def _concat_batches(batches):
+    if len(batches) == 1:
+        return batches[0]
+    return pa.Table.from_batches(batches).combine_chunks().to_batches()[0]
+
+
+def iter_parquet_batches(
+    path, batch_size=DEFAULT_BATCH_SIZE, columns=None, filters=None
+):
+    """
+    Reads a parquet file in record batches.
+
+    Filters are pushed down to the parquet scanner, which skips the row
+    groups whose statistics exclude every row.
+
+    Args:
+        path (str): file path
+        batch_size (int, optional): rows per batch. Defaults to 65536.
+        columns (list, optional): columns to read. Defaults to all.
+        filters (list, optional): (column, operator, value) tuples.
+
+    Yields:
+        pyarrow.RecordBatch: record batch
+    """
+
+    if filters:
+        dataset = pa_ds.dataset(path, format="parquet")
+        for batch in dataset.to_batches(
+            columns=columns,
+            filter=filters_expression(filters),
+            batch_size=batch_size,
+        ):
+            if batch.num_rows:
+                yield batch
+        return
+
+    parquet_file = pq.ParquetFile(path)
+    try:
+        yield from parquet_file.iter_batches(batch_size=batch_size, columns=columns)
+    finally:
+        parquet_file.close()
+
+
+def arrow_type(dtype):
+    """
+    Translates a registered column type (e.g. "float", "int32" or
+    "string") to an Arrow type.
+
+    Args:
+        dtype (str): type name
+
+    Returns:
+        pyarrow.DataType: Arrow type or None when the name is unknown
+    """
+
+    if not isinstance(dtype, str):
+        return None
+    if dtype.lower() in ARROW_TYPES:
+        return ARROW_TYPES[dtype.lower()]
+    try:
+        return pa.from_numpy_dtype(np.dtype(dtype))
+    except (TypeError, pa.ArrowNotImplementedError):
+        return None
+
+
+def column_types(main_file=None):
+    """
+    Builds the Arrow types of the registered columns of a main file, so
+    CSV readers do not need to infer them.
+
+    Args:
+        main_file (dict, optional): main file info of the product
+
+    Returns:
+        dict: column name -> pyarrow.DataType (known types only)
+    """
+
+    types = {}
+    for name, dtype in ((main_file or {}).get("column_types") or {}).items():
+        type_ = arrow_type(dtype)
+        if type_ is not None:
+            types[name] = type_
+    return types
+
+
+def csv_options(main_file=None):
+    """
+    Reads the CSV layout of a main file from its info.
+
+    Args:
+        main_file (dict, optional): main file info of the product
+
+    Returns:
+        dict: delimiter, has_header, column_names and dtypes keyword
+            arguments of the CSV readers
+    """
+
+    if main_file is None:
+        return {}
+    return {
+        "delimiter": main_file.get("delimiter"),
+        "has_header": main_file.get("has_header", False),
+        "column_names": main_file.get("columns"),
+        "dtypes": column_types(main_file),
+    }
+
+
+def _csv_reader_options(
+    columns, *, delimiter, has_header, column_names, dtypes, block_size
+):
+    read_options = pa_csv.ReadOptions(
+        column_names=None if has_header else column_names,
+        autogenerate_column_names=not has_header and not column_names,
+        block_size=block_size,
+        use_threads=True,
+    )
+    parse_options = pa_csv.ParseOptions(delimiter=delimiter or ",")
+    convert_options = pa_csv.ConvertOptions(
+        include_columns=columns or [], column_types=dtypes or {}
+    )
+    return {
+        "read_options": read_options,
+        "parse_options": parse_options,
+        "convert_options": convert_options,
+    }
+
+
+def read_csv_table(  # pylint: disable=too-many-arguments
+    path,
+    columns=None,
+    *,
+    delimiter=None,
+    has_header=True,
+    column_names=None,
+    dtypes=None,
+    block_size=CSV_BLOCK_SIZE,
+):
+    """
+    Reads a whole CSV file with the multithreaded Arrow reader.
+
+    Args:
+        path (str): file path
+        columns (list, optional): columns to read. Defaults to all.
+        delimiter (str, optional): field delimiter. Defaults to ",".
+        has_header (bool, optional): the first line holds the column names.
+            Defaults to True.
+        column_names (list, optional): column names when there is no header.
+        dtypes (dict, optional): column name -> pyarrow.DataType; the
+            other columns are inferred.
+        block_size (int, optional): bytes parsed by each thread.
+            Defaults to 16 MB.
+
+    Returns:
+        pyarrow.Table: file contents
+    """
+
+    return pa_csv.read_csv(
+        path,
+        **_csv_reader_options(
+            columns,
+            delimiter=delimiter,
+            has_header=has_header,
+            column_names=column_names,
+            dtypes=dtypes,
+            block_size=block_size,
+        ),
+    )
+
+
+def iter_csv_batches(  # pylint: disable=too-many-arguments
+    path,
+    batch_size=DEFAULT_BATCH_SIZE,
+    columns=None,
+    *,
+    delimiter=None,
+    has_header=True,
+    column_names=None,
+    dtypes=None,
+):
+    """
+    Reads a CSV file in record batches, parsing it block by block.
+
+    Args:
+        path (str): file path
+        batch_size (int, optional): rows per batch. Defaults to 65536.
+        columns (list, optional): columns to read. Defaults to all.
+        delimiter (str, optional): field delimiter. Defaults to ",".
+        has_header (bool, optional): the first line holds the column names.
+            Defaults to True.
+        column_names (list, optional): column names when there is no header.
+        dtypes (dict, optional): column name -> pyarrow.DataType.
+
+    Yields:
+        pyarrow.RecordBatch: record batch
+    """
+
+    reader = pa_csv.open_csv(
+        path,
+        **_csv_reader_options(
+            columns,
+            delimiter=delimiter,
+            has_header=has_header,
+            column_names=column_names,
+            dtypes=dtypes,
+            block_size=CSV_BLOCK_SIZE,
+        ),
+    )
+    try:
+        yield from rebatch(reader, batch_size)
+    finally:
+        reader.close()
+
+
+def iter_hdf5_batches(path, batch_size=DEFAULT_BATCH_SIZE, columns=None):
+    """
+    Reads an HDF5 file in record batches.
+
+    Supports pandas/PyTables tables (format="table") and the layouts
+    written by tables_io and astropy: a compound dataset or a group of
+    one-dimensional datasets of the same length.
+
+    Args:
+        path (str): file path
+        batch_size (int, optional): rows per batch. Defaults to 65536.
+        columns (list, optional): columns to read. Defaults to all.
+
+    Yields:
+        pyarrow.RecordBatch: record batch
+    """
+
+    with h5py.File(path, "r") as h5file:
+        pandas_key = _find_pandas_table(h5file)
+        if pandas_key is None:
+            length, read_slice = _find_hdf5_columns(h5file, columns)
+            for start in range(0, length, batch_size):
+                yield pa.RecordBatch.from_pydict(read_slice(start, start + batch_size))
+            return
+
+    with pd.HDFStore(path, mode="r") as store:
+        for chunk in store.select(pandas_key, columns=columns, chunksize=batch_size):
+            yield pa.RecordBatch.from_pandas(chunk, preserve_index=False)
+
+
+def _find_pandas_table(h5file):
+    for key, obj in h5file.items():
+        if obj.attrs.get("pandas_type") in (b"frame_table", "frame_table"):
+            return key
+    return None
+
+
+def _find_hdf5_columns(h5file, columns):
+    """Finds the table of an HDF5 file and returns its length and a slice reader."""
+
+    groups = [h5file]
+    while groups:
+        group = groups.pop(0)
+        datasets = {}
+        for name, obj in group.items():
+            if isinstance(obj, h5py.Group):
+                groups.append(obj)
+            elif obj.dtype.names and obj.ndim == 1:
+                names = [n for n in obj.dtype.names if not columns or n in columns]
+                return len(obj), _compound_reader(obj, names)
+            elif obj.ndim == 1:
+                datasets[name] = obj
+
+        lengths = {len(obj) for obj in datasets.values()}
+        if datasets and len(lengths) == 1:
+            selected = {
+                name: obj
+                for name, obj in datasets.items()
+                if not columns or name in columns
+            }
+            return lengths.pop(), _columns_reader(selected)
+
+    raise ValueError(f"No table found in HDF5 file {h5file.filename}")
+
+
+def _compound_reader(dataset, names):
+    def read_slice(start, stop):
+        rows = dataset[start:stop]
+        return {name: rows[name] for name in names}
+
+    return read_slice
+
+
+def _columns_reader(datasets):
+    def read_slice(start, stop):
+        return {name: obj[start:stop] for name, obj in datasets.items()}
+
+    return read_slice
+
+
+def _is_csv(path, main_file=None):
+    """True when a main file is read as CSV: by the extension registered
+    in its info or, without one, by the suffix of its path."""
+    extension = (main_file or {}).get("extension") or pathlib.Path(path).suffix
+    return extension.lower() in CSV_EXTENSIONS
+
+
+def read_main_table(path, main_file=None):
+    """
+    Reads a whole main file into an Arrow table with the Arrow readers,
+    so "arrow" and "polars" results need no further copy.
+
+    Args:
+        path (str): file path
+        main_file (dict, optional): main file info of the product
+
+    Returns:
+        pyarrow.Table: file contents, or None for formats without an
+            Arrow reader (e.g. FITS, or HDF5 layouts not supported by
+            iter_hdf5_batches)
+    """
+
+    if _is_csv(path, main_file):
+        return read_csv_table(path, **csv_options(main_file))
+
+    suffix = pathlib.Path(path).suffix.lower()
+    if suffix in PARQUET_EXTENSIONS:
+        return pq.read_table(path)
+
+    if suffix in HDF5_EXTENSIONS:
+        try:
+            batches = list(iter_hdf5_batches(path))
+        except ValueError:
+            return None
+        return pa.Table.from_batches(batches) if batches else None
+
+    return None
+
+
+def iter_hats_batches(catalog, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Reads an LSDB catalog one partition at a time.
+
+    Args:
+        catalog (lsdb.Catalog): catalog opened with the columns to read
+        batch_size (int, optional): rows per batch. Defaults to 65536.
+
+    Yields:
+        pyarrow.RecordBatch: record batch
+    """
+
+    def partitions():
+        for partition in catalog.to_delayed():
+            dataframe = partition.compute()
+            yield from pa.Table.from_pandas(
+                dataframe, preserve_index=False
+            ).to_batches()
+
+    yield from rebatch(partitions(), batch_size)
+
+
+def iter_file_batches(  # pylint: disable=too-many-arguments
+    path, batch_size=DEFAULT_BATCH_SIZE, columns=None, main_file=None, filters=None
+):
+    """
+    Reads a tabular file in record batches, choosing the reader by the
+    file extension.
+
+    Columns and filters may be given by name, alias or UCD. Filters are
+    pushed down to the parquet reader and applied batch by batch to the
+    other formats.
+
+    Args:
+        path (str): file path
+        batch_size (int, optional): rows per batch. Defaults to 65536.
+        columns (list, optional): columns to read. Defaults to all.
+        main_file (dict, optional): main file info of the product
+            (columns association, and delimiter, has_header and columns
+            of CSV files).
+        filters (str, tuple or list, optional): row filters, see
+            parse_filters.
+
+    Yields:
+        pyarrow.RecordBatch: record batch
+    """
+
+    suffix = pathlib.Path(path).suffix.lower()
+    columns = resolve_columns(columns, main_file)
+    filters = parse_filters(filters, main_file)
+
+    if suffix in PARQUET_EXTENSIONS:
+        return iter_parquet_batches(path, batch_size, columns, filters)
+
+    if _is_csv(path, main_file):
+        batches = iter_csv_batches(
+            path,
+            batch_size,
+            _with_filter_columns(columns, filters),
+            **csv_options(main_file),
+        )
+    elif suffix in HDF5_EXTENSIONS:
+        batches = iter_hdf5_batches(
+            path, batch_size, _with_filter_columns(columns, filters)
+        )
+    else:
+        raise ValueError(f"Streaming is not supported for {suffix or 'this'} files.")
+
+    if not filters:
+        return batches
+    return filter_batches(batches, filters, columns)
+
+
+def to_astropy(table):
+    """
+    Converts an Arrow table to an astropy Table column by column, without
+    an intermediate pandas.DataFrame. Nulls in floating point columns
+    become NaN, as in the pandas conversion; other columns with nulls
+    become masked columns.
+
+    Args:
+        table (pyarrow.Table or pyarrow.RecordBatch): table to convert
+
+    Returns:
+        astropy.table.Table: converted table
+    """
+
+    columns = []
+    for name, column in zip(table.column_names, table.columns):
+        if isinstance(column, pa.ChunkedArray):
+            column = column.combine_chunks()
+        if pa.types.is_dictionary(column.type):
+            column = column.dictionary_decode()
+
+        is_text = pa.types.is_string(column.type) or pa.types.is_large_string(
+            column.type
+        )
+        mask = None
+        if column.null_count and pa.types.is_floating(column.type):
+            column = pc.fill_null(column, pa.scalar(np.nan, column.type))
+        elif column.null_count:
+            mask = column.is_null().to_numpy(zero_copy_only=False)
+            if is_text:
+                column = pc.fill_null(column, "")
+            elif pa.types.is_integer(column.type):
+                column = pc.fill_null(column, 0)
+
+        values = column.to_numpy(zero_copy_only=False)
+        if is_text:
+            values = values.astype(str)
+
+        if mask is None:
+            columns.append(Column(values, name=name))
+        else:
+            columns.append(MaskedColumn(values, name=name, mask=mask))
+
+    return Table(columns, copy=False)
+
+
+def from_astropy(table):
+    """
+    Converts an astropy Table to an Arrow table column by column.
+
+    Args:
+        table (astropy.table.Table): table to convert
+
+    Returns:
+        pyarrow.Table: converted table
+    """
+
+    arrays = []
+    for name in table.colnames:
+        column = table[name]
+        values = np.asarray(column)
+        mask = getattr(column, "mask", None)
+        if values.ndim > 1:
+            arrays.append(pa.array(list(values)))
+        elif mask is not None and np.any(mask):
+            arrays.append(pa.array(values, mask=np.asarray(mask)))
+        else:
+            arrays.append(pa.array(values))
+    return pa.Table.from_arrays(arrays, names=list(table.colnames))
+
+
+def _import_polars():
+    try:
+        return importlib.import_module("polars")
+    except ImportError as exc:
+        raise ImportError(
+            "return_type='polars' requires the optional dependency 'polars'. "
+            "Install it and try again."
+        ) from exc
+
+
+def _as_astropy(data):
+    if isinstance(data, Table):
+        return data
+    if isinstance(data, pd.DataFrame):
+        return Table.from_pandas(data)
+    return to_astropy(data)
+
+
+def _as_pandas(data):
+    if isinstance(data, pd.DataFrame):
+        return data
+    if isinstance(data, Table):
+        return data.to_pandas()
+    return data.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def _as_arrow(data):
+    if isinstance(data, pd.DataFrame):
+        return pa.Table.from_pandas(data, preserve_index=False)
+    if isinstance(data, Table):
+        return from_astropy(data)
+    return data
+
+
+def _as_polars(data):
+    if isinstance(data, pd.DataFrame):
+        return _import_polars().from_pandas(data)
+    return _import_polars().from_arrow(_as_arrow(data))
+
+
+_CONVERTERS = {
+    "astropy": _as_astropy,
+    "pandas": _as_pandas,
+    "arrow": _as_arrow,
+    "polars": _as_polars,
+}
+
+
+def check_return_type(return_type):
+    """
+    Checks that a return type is one of RETURN_TYPES.
+
+    Args:
+        return_type (str): container of the returned data
+    """
+
+    if return_type not in RETURN_TYPES:
+        raise ValueError(
+            f"Invalid return_type {return_type!r}. "
+            f"Expected one of: {', '.join(RETURN_TYPES)}."
+        )
+
+
+def convert_table(data, return_type="astropy"):
+    """
+    Converts the contents read from a main file to the requested
+    container, copying the data at most once.
+
+    Memory cost of each conversion (from Arrow, the native format of
+    the parquet, CSV and HDF5 readers):
+        arrow    no copy
+        polars   no copy (buffers shared with Arrow)
+        pandas   one copy; the Arrow buffers are released column by
+                 column, so the peak stays close to one copy
+        astropy  one copy (numeric columns without nulls may be shared)
+    Converting from a pandas.DataFrame or an astropy Table (HATS
+    catalogs and formats read by tables_io) also costs one copy,
+    except when the data already is in the requested container.
+
+    Args:
+        data (pyarrow.Table, pandas.DataFrame or astropy.table.Table):
+            contents read from the file. An Arrow table must not be used
+            after the conversion.
+        return_type (str, optional): "astropy", "pandas", "arrow" or
+            "polars". Defaults to "astropy".
+
+    Returns:
+        astropy.table.Table, pandas.DataFrame, pyarrow.Table or
+            polars.DataFrame: converted contents
+    """
+
+    check_return_type(return_type)
+
+    if isinstance(data, pa.RecordBatch):
+        data = pa.Table.from_batches([data])
+
+    return _CONVERTERS[return_type](data)
@@ -0,0 +1,115 @@
+"""
+Random access to remote files through HTTP byte-range requests
+"""
+
+import io
+import os
+from collections import OrderedDict
+
+
+class RemoteFile(io.RawIOBase):
+    """
+    Read-only, seekable view of a remote file.
+
+    Small reads are served from blocks of block_size bytes kept in a
+    small LRU cache (zip headers, footers and metadata are read in many
+    small pieces); larger reads are fetched with a single range request.
+    Used with zipfile.ZipFile to read single members of a remote archive
+    without downloading it.
+    """
+
+    def __init__(self, fetch, size, block_size=16 * 1024, max_blocks=256):
+        """
+        RemoteFile class constructor
+
+        Args:
+            fetch (callable): fetch(start, end) returns the bytes from
+                start to end (inclusive)
+            size (int): file size in bytes
+            block_size (int, optional): size of the cached blocks.
+                Defaults to 16 kB.
+            max_blocks (int, optional): number of cached blocks.
+                Defaults to 256.
+        """
+
+        super().__init__()
+        self._fetch = fetch
+        self.size = size
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.bytes_fetched = 0
+        self._position = 0
+        self._blocks = OrderedDict()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self._position = min(max(offset, 0), self.size)
+        return self._position
+
+    def _get(self, start, end):
+        data = self._fetch(start, end)
+        self.bytes_fetched += len(data)
+        return data
+
+    def _block(self, index):
+        if index in self._blocks:
+            self._blocks.move_to_end(index)
+            return self._blocks[index]
+
+        start = index * self.block_size
+        data = self._get(start, min(start + self.block_size, self.size) - 1)
+        self._blocks[index] = data
+        if len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+        return data
+
+    def read(self, size=-1):
+        """
+        Reads up to size bytes from the current position.
+
+        Args:
+            size (int, optional): number of bytes (-1 reads to the end).
+
+        Returns:
+            bytes: data read
+        """
+
+        end = self.size if size is None or size < 0 else self._position + size
+        end = min(end, self.size)
+        if end <= self._position:
+            return b""
+
+        if end - self._position >= self.block_size:
+            data = self._get(self._position, end - 1)
+        else:
+            chunks = []
+            position = self._position
+            while position < end:
+                index, offset = divmod(position, self.block_size)
+                block = self._block(index)
+                chunk = block[offset : offset + end - position]
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                position += len(chunk)
+            data = b"".join(chunks)
+
+        self._position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
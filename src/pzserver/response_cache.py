@@ -0,0 +1,181 @@
+"""
+Cache of API responses used by PzRequests
+"""
+
+import hashlib
+import json
+import pathlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    LRU cache of JSON responses with expiration time.
+
+    Entries keep the response validators (ETag and Last-Modified), so an
+    expired entry can be revalidated with a conditional request and
+    served again when the server answers 304 Not Modified. Optionally,
+    entries are also stored on disk and survive between sessions.
+    """
+
+    def __init__(self, ttl=300, max_entries=256, directory=None):
+        """
+        ResponseCache class constructor
+
+        Args:
+            ttl (float, optional): seconds an entry is served without
+                revalidation. Defaults to 300.
+            max_entries (int, optional): maximum number of entries kept
+                (in memory and on disk). Defaults to 256.
+            directory (str, optional): directory for the on-disk backend.
+                Defaults to None (memory only).
+        """
+
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.directory = pathlib.Path(directory).expanduser() if directory else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """
+        Builds a cache key from request attributes (method, url, params...).
+
+        Returns:
+            str: cache key
+        """
+
+        raw = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key):
+        return self.directory / f"{key}.json"
+
+    def get(self, key):
+        """
+        Gets an entry, fresh or expired.
+
+        Args:
+            key (str): cache key
+
+        Returns:
+            dict: entry (data, etag, last_modified, stored_at) or None
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        if self.directory is None:
+            return None
+
+        try:
+            entry = json.loads(self._entry_path(key).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+        self._remember(key, entry)
+        return entry
+
+    def is_fresh(self, entry, ttl=None) -> bool:
+        """
+        Checks if an entry can be served without revalidation.
+
+        Args:
+            entry (dict): cache entry
+            ttl (float, optional): overrides the cache ttl.
+
+        Returns:
+            bool: True if the entry has not expired
+        """
+
+        ttl = self.ttl if ttl is None else ttl
+        return time.time() - entry["stored_at"] < ttl
+
+    def set(self, key, data, etag=None, last_modified=None):
+        """
+        Stores a response.
+
+        Args:
+            key (str): cache key
+            data: response content (JSON serializable)
+            etag (str, optional): ETag header of the response.
+            last_modified (str, optional): Last-Modified header of the response.
+        """
+
+        entry = {
+            "data": data,
+            "etag": etag,
+            "last_modified": last_modified,
+            "stored_at": time.time(),
+        }
+        self._remember(key, entry)
+
+        if self.directory is not None:
+            self._write(key, entry)
+            self._prune_directory()
+
+    def touch(self, key):
+        """
+        Marks an entry as revalidated, restarting its expiration time.
+
+        Args:
+            key (str): cache key
+        """
+
+        entry = self.get(key)
+        if entry is None:
+            return
+
+        entry["stored_at"] = time.time()
+        if self.directory is not None:
+            self._write(key, entry)
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _write(self, key, entry):
+        path = self._entry_path(key)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        try:
+            tmp_path.write_text(json.dumps(entry), encoding="utf-8")
+            tmp_path.replace(path)
+        except (OSError, TypeError, ValueError):
+            tmp_path.unlink(missing_ok=True)
+
+    def _prune_directory(self):
+        try:
+            files = sorted(
+                self.directory.glob("*.json"), key=lambda path: path.stat().st_mtime
+            )
+            for path in files[: max(0, len(files) - self.max_entries)]:
+                path.unlink(missing_ok=True)
+        except OSError:
+            pass
+
+    def clear(self):
+        """
+        Removes every entry (in memory and on disk).
+        """
+
+        with self._lock:
+            self._entries.clear()
+
+        if self.directory is not None:
+            for path in self.directory.glob("*.json"):
+                path.unlink(missing_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,159 @@
+"""
+Retry policy for transient failures of the Pz Server API
+"""
+
+import email.utils
+import random
+import time
+
+import requests
+
+
+class RetryPolicy:
+    """
+    Decides when a failed request is sent again and how long to wait.
+
+    Idempotent methods are retried on transient HTTP statuses (429, 502,
+    503 and 504 by default) and on connection errors or timeouts.
+    Non-idempotent methods (POST, PATCH) are only retried when the server
+    certainly did not process them: a 429 answer or a failure to connect.
+    """
+
+    idempotent_methods = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        *,
+        max_attempts=4,
+        backoff_factor=0.5,
+        max_backoff=60,
+        jitter=0.5,
+        retry_statuses=(429, 502, 503, 504),
+        respect_retry_after=True,
+    ):
+        """
+        RetryPolicy class constructor
+
+        Args:
+            max_attempts (int, optional): total number of attempts, including
+                the first one (1 disables retries). Defaults to 4.
+            backoff_factor (float, optional): delay in seconds before the
+                first retry; it doubles on each new retry. Defaults to 0.5.
+            max_backoff (float, optional): maximum delay in seconds, also
+                applied to Retry-After. Defaults to 60.
+            jitter (float, optional): fraction of the delay that is
+                randomized, between 0 and 1. Defaults to 0.5.
+            retry_statuses (tuple, optional): HTTP statuses considered
+                transient. Defaults to (429, 502, 503, 504).
+            respect_retry_after (bool, optional): wait the time requested
+                by the server in the Retry-After header. Defaults to True.
+        """
+
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = min(max(jitter, 0.0), 1.0)
+        self.retry_statuses = frozenset(retry_statuses)
+        self.respect_retry_after = respect_retry_after
+
+    def is_idempotent(self, method) -> bool:
+        """
+        Checks if a request method can be safely repeated.
+
+        Args:
+            method (str): HTTP method
+
+        Returns:
+            bool: True for idempotent methods
+        """
+        return (method or "GET").upper() in self.idempotent_methods
+
+    def should_retry_status(self, method, status_code, attempt) -> bool:
+        """
+        Checks if a response status should be retried.
+
+        Args:
+            method (str): HTTP method
+            status_code (int): response status
+            attempt (int): number of attempts already made
+
+        Returns:
+            bool: True to send the request again
+        """
+
+        if attempt >= self.max_attempts or status_code not in self.retry_statuses:
+            return False
+        return self.is_idempotent(method) or status_code == 429
+
+    def should_retry_error(self, method, error, attempt) -> bool:
+        """
+        Checks if a connection error should be retried.
+
+        Args:
+            method (str): HTTP method
+            error (requests.exceptions.RequestException): raised error
+            attempt (int): number of attempts already made
+
+        Returns:
+            bool: True to send the request again
+        """
+
+        if attempt >= self.max_attempts:
+            return False
+
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+
+        if self.is_idempotent(method):
+            return isinstance(
+                error,
+                (requests.exceptions.ConnectionError, requests.exceptions.Timeout),
+            )
+
+        return False
+
+    def delay(self, attempt, retry_after=None) -> float:
+        """
+        Seconds to wait before the next attempt.
+
+        Args:
+            attempt (int): number of attempts already made
+            retry_after (str, optional): Retry-After header value
+
+        Returns:
+            float: delay in seconds
+        """
+
+        if self.respect_retry_after and retry_after:
+            seconds = self.parse_retry_after(retry_after)
+            if seconds is not None:
+                return min(seconds, self.max_backoff)
+
+        backoff = min(self.backoff_factor * 2 ** (attempt - 1), self.max_backoff)
+        return backoff * (1 - self.jitter * random.random())
+
+    @staticmethod
+    def parse_retry_after(value):
+        """
+        Converts a Retry-After header (seconds or HTTP date) to seconds.
+
+        Args:
+            value (str): header value
+
+        Returns:
+            float: seconds to wait or None when the value is invalid
+        """
+
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            pass
+
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+
+        if when is None:
+            return None
+        return max(0.0, when.timestamp() - time.time())
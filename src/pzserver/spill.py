@@ -0,0 +1,327 @@
+"""
+Memory-mapped on-disk storage of product contents too large for the
+memory budget
+"""
+
+import os
+import pathlib
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from astropy.table import Column, Table
+
+from .readers import column_types, convert_table, to_astropy
+
+
+def cheapest_schema(schema, main_file=None):
+    """
+    Narrows the types of a schema to the registered column types that
+    use fewer bytes (e.g. float64 read from a CSV file registered as
+    float32).
+
+    Args:
+        schema (pyarrow.Schema): schema read from the file
+        main_file (dict, optional): main file info of the product
+
+    Returns:
+        pyarrow.Schema: schema of the spilled data
+    """
+
+    registered = column_types(main_file)
+    fields = []
+    for field in schema:
+        target = registered.get(field.name)
+        if (
+            target is not None
+            and pa.types.is_primitive(field.type)
+            and pa.types.is_primitive(target)
+            and 1 < target.bit_width < field.type.bit_width
+        ):
+            field = field.with_type(target)
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def _spill_path(directory, suffix):
+    directory = pathlib.Path(directory or tempfile.gettempdir()).expanduser()
+    directory.mkdir(parents=True, exist_ok=True)
+    handle, path = tempfile.mkstemp(
+        prefix="pzserver-spill-", suffix=suffix, dir=directory
+    )
+    os.close(handle)
+    return pathlib.Path(path)
+
+
+def _unlink(path):
+    # the mapping keeps the data alive; the disk space is released when
+    # the returned table is garbage collected (not possible on Windows)
+    try:
+        path.unlink()
+    except OSError:
+        pass
+
+
+def _narrowed(column, target):
+    """Column cast to target, or None when some value does not fit it."""
+    if column.type == target:
+        return column
+    try:
+        narrowed = column.cast(target)
+    except pa.ArrowInvalid:
+        # integer overflow or truncated fractions
+        return None
+    # floats too large for the target become infinite instead of failing
+    if pa.types.is_floating(target) and _infinities(narrowed) != _infinities(column):
+        return None
+    return narrowed
+
+
+def _infinities(column):
+    return np.count_nonzero(np.isinf(column.to_numpy(zero_copy_only=False)))
+
+
+def _widened(path, schema):
+    """
+    Copies a spill file to a new one with a schema of wider types.
+
+    Returns:
+        tuple: path of the new file and its writer, left open
+    """
+
+    wide_path = _spill_path(path.parent, ".arrow")
+    writer = pa.ipc.new_file(str(wide_path), schema)
+    try:
+        with pa.memory_map(str(path), "r") as source:
+            reader = pa.ipc.open_file(source)
+            for index in range(reader.num_record_batches):
+                writer.write_batch(reader.get_batch(index).cast(schema))
+    except BaseException:
+        writer.close()
+        _unlink(wide_path)
+        raise
+    _unlink(path)
+    return wide_path, writer
+
+
+def _write_batches(batches, path, main_file):
+    """
+    Writes the batches to path, narrowed to the cheapest schema while
+    their values fit it. Nothing is left on disk when it fails.
+
+    Returns:
+        pathlib.Path: written file (None when there were no batches)
+    """
+
+    writer = None
+    try:
+        try:
+            for batch in batches:
+                if writer is None:
+                    schema = cheapest_schema(batch.schema, main_file)
+                    writer = pa.ipc.new_file(str(path), schema)
+
+                columns = [
+                    _narrowed(column, field.type)
+                    for column, field in zip(batch.columns, schema)
+                ]
+                if any(column is None for column in columns):
+                    # the columns with values out of the registered type
+                    # keep the type read from the file
+                    schema = pa.schema(
+                        field if column is not None else batch.schema.field(index)
+                        for index, (column, field) in enumerate(zip(columns, schema))
+                    )
+                    # not closed again when the copy fails
+                    writer.close()
+                    writer = None
+                    path, writer = _widened(path, schema)
+                    columns = batch.cast(schema).columns
+
+                writer.write_batch(pa.record_batch(columns, schema=schema))
+        finally:
+            if writer is not None:
+                writer.close()
+    except BaseException:
+        _unlink(path)
+        raise
+
+    if writer is None:
+        _unlink(path)
+        return None
+    return path
+
+
+def spill_batches(batches, main_file=None, directory=None):
+    """
+    Writes record batches to an uncompressed Arrow IPC file and maps it
+    back, so the returned table is backed by the page cache instead of
+    heap memory.
+
+    Columns are narrowed to the cheapest registered types only while
+    their values fit them: a column with a value out of range (or with
+    fractions, for integer types) keeps the type read from the file.
+
+    Args:
+        batches (iterable): pyarrow.RecordBatch objects
+        main_file (dict, optional): main file info, used to cast columns
+            to the cheapest registered types.
+        directory (str, optional): directory of the spill file. Defaults
+            to the system temporary directory.
+
+    Returns:
+        pyarrow.Table: memory-mapped table
+    """
+
+    path = _write_batches(batches, _spill_path(directory, ".arrow"), main_file)
+    if path is None:
+        return pa.table({})
+
+    source = pa.memory_map(str(path), "r")
+    table = pa.ipc.open_file(source).read_all()
+    _unlink(path)
+    return table
+
+
+def _mapped_array(column, directory):
+    """Copies a numeric column chunk by chunk to a memory-mapped .npy file."""
+    dtype = column.type.to_pandas_dtype()
+    path = _spill_path(directory, ".npy")
+    array = np.lib.format.open_memmap(
+        path, mode="w+", dtype=dtype, shape=(len(column),)
+    )
+
+    position = 0
+    for chunk in column.chunks:
+        array[position : position + len(chunk)] = chunk.to_numpy(zero_copy_only=True)
+        position += len(chunk)
+    array.flush()
+
+    _unlink(path)
+    return array
+
+
+def _is_mappable(column):
+    return (
+        (pa.types.is_integer(column.type) or pa.types.is_floating(column.type))
+        and column.null_count == 0
+    )
+
+
+def _container(table, return_type, map_column):
+    """Builds a pandas or astropy container, mapping numeric columns."""
+    columns = {}
+    for name, column in zip(table.column_names, table.columns):
+        values = map_column(column) if _is_mappable(column) else None
+        if values is not None:
+            columns[name] = values
+        elif return_type == "pandas":
+            columns[name] = column.to_pandas()
+        else:
+            columns[name] = to_astropy(pa.table({name: column}))[name]
+
+    if return_type == "pandas":
+        return pd.DataFrame(columns, copy=False)
+
+    return Table(
+        [
+            Column(values, name=name, copy=False)
+            if isinstance(values, np.memmap)
+            else values
+            for name, values in columns.items()
+        ],
+        copy=False,
+    )
+
+
+def mapped_container(table, return_type="arrow", directory=None):
+    """
+    Converts a memory-mapped Arrow table to a container without copying
+    its numeric columns to the heap.
+
+    Arrow and polars share the mapped buffers. For pandas and astropy,
+    numeric columns without nulls are copied chunk by chunk to
+    memory-mapped numpy arrays; the other columns (strings, nulls) are
+    converted in memory.
+
+    Args:
+        table (pyarrow.Table): table returned by spill_batches
+        return_type (str, optional): "arrow", "polars", "pandas" or
+            "astropy". Defaults to "arrow".
+        directory (str, optional): directory of the spill files.
+
+    Returns:
+        pyarrow.Table, polars.DataFrame, pandas.DataFrame or
+            astropy.table.Table: container backed by mapped buffers
+    """
+
+    if return_type in ("arrow", "polars"):
+        return convert_table(table, return_type)
+    return _container(
+        table, return_type, lambda column: _mapped_array(column, directory)
+    )
+
+
+def write_mapped(table, path):
+    """
+    Writes a table to an uncompressed Arrow IPC file as a single record
+    batch, so read_mapped can map each numeric column as one array.
+
+    Args:
+        table (pyarrow.Table): table to write
+        path (str): path of the IPC file
+
+    Returns:
+        pathlib.Path: path of the IPC file
+    """
+
+    table = table.combine_chunks()
+    with pa.ipc.new_file(str(path), table.schema) as writer:
+        writer.write_table(table)
+    return pathlib.Path(path)
+
+
+def read_mapped(path, return_type="arrow", columns=None):
+    """
+    Maps an Arrow IPC file written by write_mapped without copying it.
+
+    Arrow and polars share the mapped buffers. For pandas and astropy,
+    numeric columns without nulls are copy-on-write numpy memory maps
+    of the file, so the pages are shared by every process reading the
+    same file until they are modified; the other columns are converted
+    in memory.
+
+    Args:
+        path (str): path of the IPC file
+        return_type (str, optional): "arrow", "polars", "pandas" or
+            "astropy". Defaults to "arrow".
+        columns (list, optional): columns to read. Defaults to all
+            columns.
+
+    Returns:
+        pyarrow.Table, polars.DataFrame, pandas.DataFrame or
+            astropy.table.Table: container backed by the mapped file
+    """
+
+    source = pa.memory_map(str(path), "r")
+    start = source.read_buffer(1).address
+    source.seek(0)
+    table = pa.ipc.open_file(source).read_all()
+    if columns:
+        table = table.select(columns)
+
+    if return_type in ("arrow", "polars"):
+        return convert_table(table, return_type)
+
+    def file_view(column):
+        if column.num_chunks != 1:
+            return None
+        chunk = column.chunk(0)
+        dtype = np.dtype(column.type.to_pandas_dtype())
+        offset = chunk.buffers()[1].address - start + chunk.offset * dtype.itemsize
+        if len(chunk) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="c", offset=offset, shape=(len(chunk),))
+
+    return _container(table, return_type, file_view)
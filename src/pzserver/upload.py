@@ -4,6 +4,7 @@ Classes responsible for managing user interaction
 
 import mimetypes
 import pathlib
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 from pydantic import BaseModel, validator
@@ -15,6 +16,69 @@ class RequiredColumnsException(Exception):
     pass
 
 
+class UploadError(Exception):
+    """Some files could not be uploaded.
+
+    Attributes:
+        files_id (list): ids of the files uploaded successfully, in order
+        errors (dict): file path -> exception of each failed upload
+        upload (PzUpload): upload object, when the product was created
+    """
+
+    def __init__(self, files_id, errors, upload=None):
+        self.files_id = files_id
+        self.errors = errors
+        self.upload = upload
+        failed = ", ".join(str(filepath) for filepath in errors)
+        super().__init__(f"{len(errors)} file(s) could not be uploaded: {failed}")
+
+
+class ColumnsAssociationError(Exception):
+    """Some column associations could not be updated.
+
+    Attributes:
+        errors (dict): column name -> exception of each failed update
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        failed = ", ".join(str(column) for column in errors)
+        super().__init__(f"{len(errors)} column(s) could not be updated: {failed}")
+
+
+def run_concurrently(func, items, max_workers=4):
+    """Calls a function for each item in parallel
+
+    Args:
+        func (callable): function receiving one item (e.g. a file path)
+        items (list): items
+        max_workers (int, optional): maximum number of simultaneous
+            calls. Defaults to 4.
+
+    Returns:
+        tuple: results in the order of items (None for failed calls)
+            and dict with the exception of each failed item
+    """
+
+    items = list(items)
+    results = [None] * len(items)
+    errors = {}
+
+    if not items:
+        return results, errors
+
+    workers = max(1, min(max_workers or 1, len(items)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(func, item) for item in items]
+        for index, future in enumerate(futures):
+            try:
+                results[index] = future.result()
+            except Exception as excp:  # pylint: disable=broad-except
+                errors[items[index]] = excp
+
+    return results, errors
+
+
 class UploadData(BaseModel):
     """Upload data"""
 
@@ -64,23 +128,34 @@ class UploadData(BaseModel):
 class PzUpload:
     """Responsible for managing user interactions with upload."""
 
-    def __init__(self, upload: UploadData, api):
+    def __init__(self, upload: UploadData, api, max_workers=4):
         """
         PzUpload class constructor
 
         Args:
             upload (Upload)
             api (PzRequests)
+            max_workers (int, optional): maximum number of auxiliary files
+                uploaded simultaneously. Defaults to 4.
+
+        Raises:
+            UploadError: if some auxiliary files could not be uploaded. The
+                upload is registered anyway and available in error.upload;
+                the failed files can be sent again with add_auxiliary_files.
         """
 
         self.api = api
         self.upload = upload
+        self.max_workers = max_workers
         self.product_id = self.__save_basic_info()
         self.files_id = []
-        self.__save_upload_files()
+        errors = self.__save_upload_files()
         self.api.registry_upload(self.product_id)
         self.__columns = self.get_product_columns()
-        self.__columns_association = []
+        self.__columns_association = {}
+
+        if errors:
+            raise UploadError(list(self.files_id), errors, upload=self)
 
     @property
     def columns(self):
@@ -94,27 +169,81 @@ class PzUpload:
         """Get system columns"""
         return self.upload.system_columns
 
-    def make_columns_association(self, data: dict):
+    def make_columns_association(self, data: dict, max_workers=8):
         """Associates upload columns
 
+        Only the columns whose association changed are sent to the
+        server, simultaneously.
+
         Args:
             data (dict): dictionary with associations
+            max_workers (int, optional): maximum number of simultaneous
+                updates. Defaults to 8.
+
+        Raises:
+            ColumnsAssociationError: if some columns could not be updated;
+                the other associations are kept.
         """
 
+        updates = {}
+
         for key, value in data.items():
             id_attr = self.__columns.get(key)
             col = self.upload.system_columns.get(value.lower(), (value, None))
             data_up = {"ucd": col[1], "alias": col[0]}
-            _data = self.api.update_upload_column(id_attr, data_up)
-            self.__columns_association.append(_data)
+            current = self.__columns_association.get(id_attr)
+
+            if current is not None and self.__same_association(current, data_up):
+                continue
+
+            updates[id_attr] = data_up
+
+        self.__update_columns(updates, max_workers)
+
+    def reset_columns_association(self, max_workers=8):
+        """Reset upload columns association
+
+        Args:
+            max_workers (int, optional): maximum number of simultaneous
+                updates. Defaults to 8.
+        """
+
+        empty = {"ucd": "", "alias": ""}
+        updates = {id_attr: empty for id_attr in self.__columns_association}
+        self.__update_columns(updates, max_workers)
+
+    @staticmethod
+    def __same_association(column, data):
+        """Checks if a column already has the given ucd and alias"""
+        return all((column.get(key) or "") == (value or "") for key, value in data.items())
+
+    def __update_columns(self, updates, max_workers):
+        """Sends the column association updates simultaneously
+
+        Args:
+            updates (dict): column id -> attributes that will be updated
+            max_workers (int): maximum number of simultaneous updates
+        """
 
-    def reset_columns_association(self):
-        """Reset upload columns association"""
+        results, errors = run_concurrently(
+            lambda id_attr: self.api.update_upload_column(id_attr, updates[id_attr]),
+            updates,
+            max_workers,
+        )
 
-        for column in self.__columns_association.copy():
-            id_attr = column.get("id")
-            self.api.update_upload_column(id_attr, {"ucd": "", "alias": ""})
-            self.__columns_association.remove(column)
+        for id_attr, column in zip(updates, results):
+            if id_attr in errors:
+                continue
+            if column and (column.get("alias") or column.get("ucd")):
+                self.__columns_association[id_attr] = column
+            else:
+                self.__columns_association.pop(id_attr, None)
+
+        if errors:
+            names = {id_attr: name for name, id_attr in self.__columns.items()}
+            raise ColumnsAssociationError(
+                {names.get(id_attr, id_attr): excp for id_attr, excp in errors.items()}
+            )
 
     def check_required_columns(self):
         """Checks required columns
@@ -130,7 +259,7 @@ class PzUpload:
         else:
             required_columns = []
 
-        for column in self.__columns_association:
+        for column in self.__columns_association.values():
             attr = column.get("alias")
             if attr in required_columns:
                 required_columns.remove(attr)
@@ -149,14 +278,56 @@ class PzUpload:
             filepath (str): file path
         """
 
-        fid = self.__upload_file(filepath, "auxiliary")
-        self.files_id.append(fid)
+        self.add_auxiliary_files([filepath], update=update)
+
+    def add_auxiliary_files(self, filepaths, update=True, max_workers=None):
+        """Add auxiliary files to upload, uploading them simultaneously
+
+        Args:
+            filepaths (list): file paths
+            update (bool, optional): add the files to the upload data.
+                Defaults to True.
+            max_workers (int, optional): maximum number of simultaneous
+                uploads. Defaults to the value given to the constructor.
+
+        Raises:
+            UploadError: if some files could not be uploaded; the files
+                uploaded successfully are kept.
+        """
+
+        errors = self.__upload_files(filepaths, "auxiliary", max_workers)
 
         if update:
             if not self.upload.auxiliary_files:
                 self.upload.auxiliary_files = []
 
-            self.upload.auxiliary_files.append(filepath)
+            self.upload.auxiliary_files.extend(
+                filepath for filepath in filepaths if filepath not in errors
+            )
+
+        if errors:
+            raise UploadError(list(self.files_id), errors)
+
+    def __upload_files(self, filepaths, role, max_workers=None):
+        """Uploads files simultaneously, keeping the ids in order
+
+        Args:
+            filepaths (list): file paths
+            role (str): file role
+            max_workers (int, optional): maximum number of simultaneous
+                uploads. Defaults to the value given to the constructor.
+
+        Returns:
+            dict: file path -> exception of each failed upload
+        """
+
+        results, errors = run_concurrently(
+            lambda filepath: self.__upload_file(filepath, role),
+            filepaths,
+            max_workers or self.max_workers,
+        )
+        self.files_id.extend(fid for fid in results if fid is not None)
+        return errors
 
     def __save_basic_info(self):
         """Saves the basic upload information in the database.
@@ -178,16 +349,20 @@ class PzUpload:
     def __save_upload_files(self):
         """Saves the upload files in the database.
 
+        The main file is uploaded first, then the auxiliary files
+        simultaneously.
+
         Returns:
-            file_ids (list): file ids list
+            dict: file path -> exception of each failed auxiliary file
         """
 
         main_id = self.__upload_file(self.upload.main_file, "main")
         self.files_id.append(main_id)
 
-        if self.upload.auxiliary_files:
-            for auxfile in self.upload.auxiliary_files:
-                self.add_auxiliary_file(auxfile, update=False)
+        if not self.upload.auxiliary_files:
+            return {}
+
+        return self.__upload_files(self.upload.auxiliary_files, "auxiliary")
 
     def get_product_columns(self):
         """Gets product columns in database
@@ -0,0 +1,99 @@
+"""
+Shared fixtures for the pzserver tests.
+"""
+
+import importlib
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import ModuleType
+
+import pytest
+
+
+def load_module(name):
+    """Imports a pzserver module from src without importing the package
+    __init__ (and the optional dependencies it pulls in)."""
+    root = Path(__file__).parents[2] / "src" / "pzserver"
+    package = ModuleType("pzserver")
+    package.__path__ = [str(root)]
+    sys.modules.setdefault("pzserver", package)
+    return importlib.import_module(f"pzserver.{name}")
+
+
+class LocalServer:
+    """Local stand-in for the Pz Server API used by network-level tests.
+
+    Routes map ``(method, path)`` to a callable receiving the request
+    handler and returning ``(status, headers, body)``. Every request is
+    recorded in ``requests`` as ``(method, path_with_query, headers, body)``.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Dispatches requests to the registered routes."""
+
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+            def _dispatch(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                path = self.path.split("?", 1)[0]
+                with server._lock:  # pylint: disable=protected-access
+                    server.requests.append(
+                        (self.command, self.path, dict(self.headers), body)
+                    )
+                route = server.routes.get((self.command, path))
+                if route is None:
+                    status, headers, payload = 404, {}, b"not found"
+                else:
+                    status, headers, payload = route(self, body)
+
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = do_PATCH = _dispatch
+            do_DELETE = do_OPTIONS = do_HEAD = _dispatch
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        )
+
+    def route(self, method, path, handler):
+        """Registers a handler for a method and path."""
+        self.routes[(method, path)] = handler
+
+    def start(self):
+        """Starts serving in a background thread."""
+        self._thread.start()
+
+    def stop(self):
+        """Stops the server."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def local_server():
+    """Runs a LocalServer for the duration of a test."""
+    server = LocalServer()
+    server.start()
+    yield server
+    server.stop()
@@ -0,0 +1,221 @@
+"""
+Tests for the asyncio client.
+"""
+
+import asyncio
+import importlib
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+import requests
+from conftest import load_module
+
+
+def json_route(payload, status=200):
+    def handler(_request, _body):
+        return status, {"Content-Type": "application/json"}, json.dumps(payload).encode()
+
+    return handler
+
+
+def make_server(local_server, **options):
+    async_core = load_module("async_core")
+    local_server.route("GET", "/api/", json_route({"products": "..."}))
+    return async_core.AsyncPzServer("token", f"{local_server.url}/api/", **options)
+
+
+def test_async_metadata_requests_run_concurrently(local_server):
+    active = {"now": 0, "max": 0}
+    lock = threading.Lock()
+
+    def slow_product(request, _body):
+        with lock:
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+        time.sleep(0.05)
+        with lock:
+            active["now"] -= 1
+        product_id = int(request.path.rstrip("/").rsplit("/", 1)[-1])
+        payload = json.dumps({"id": product_id}).encode()
+        return 200, {"Content-Type": "application/json"}, payload
+
+    for product_id in range(12):
+        local_server.route("GET", f"/api/products/{product_id}/", slow_product)
+
+    async def run():
+        async with make_server(local_server, max_concurrency=4) as pz_server:
+            return await asyncio.gather(
+                *(pz_server.api.get("products", pid) for pid in range(12))
+            )
+
+    results = asyncio.run(run())
+
+    assert [result["id"] for result in results] == list(range(12))
+    assert 1 < active["max"] <= 4
+    for _method, _path, headers, _body in local_server.requests:
+        assert headers["Authorization"] == "Token token"
+
+
+def test_async_get_products_follows_pagination(local_server):
+    base = f"{local_server.url}/api/products/"
+
+    def products(request, _body):
+        if "page=2" in request.path:
+            payload = {"next": None, "results": [{"id": 2}]}
+        else:
+            payload = {"next": f"{base}?page=2", "results": [{"id": 1}]}
+        return 200, {"Content-Type": "application/json"}, json.dumps(payload).encode()
+
+    local_server.route("GET", "/api/products/", products)
+
+    async def run():
+        async with make_server(local_server) as pz_server:
+            return await pz_server.get_products_list()
+
+    assert asyncio.run(run()) == [{"id": 1}, {"id": 2}]
+    assert local_server.requests[1][1] == "/api/products/?status=1"
+
+
+def test_async_download_product(local_server, tmp_path):
+    local_server.route("GET", "/api/products/7/", json_route({"id": 7}))
+    local_server.route(
+        "POST", "/api/products/7/download/prepare/", json_route({"status": "running"})
+    )
+    local_server.route(
+        "GET",
+        "/api/products/7/download/status/",
+        json_route({"status": "ready", "download_url": "/api/files/7/"}),
+    )
+    local_server.route(
+        "GET",
+        "/api/files/7/",
+        lambda request, body: (
+            200,
+            {"Content-Disposition": "attachment; filename=product_7.zip"},
+            b"zip-bytes",
+        ),
+    )
+
+    async def run():
+        async with make_server(local_server) as pz_server:
+            result = await pz_server.api.download_product(7, tmp_path, poll_interval=0)
+            return result["message"]
+
+    path = asyncio.run(run())
+
+    assert Path(path) == tmp_path / "product_7.zip"
+    assert Path(path).read_bytes() == b"zip-bytes"
+
+
+def test_async_start_process_and_check_status(local_server):
+    local_server.route("POST", "/api/processes/", json_route({"id": 5}, status=201))
+    local_server.route("GET", "/api/processes/5/", json_route({"status": "Running"}))
+
+    async def run():
+        async with make_server(local_server) as pz_server:
+            process = await pz_server.start_process(
+                {"display_name": "tsm", "used_config": {"param": {}}}
+            )
+            return process, await pz_server.check_status(process["id"])
+
+    process, status = asyncio.run(run())
+
+    assert process == {"id": 5}
+    assert status == "Running"
+    posted = [body for method, _, _, body in local_server.requests if method == "POST"]
+    assert json.loads(posted[0]) == {
+        "display_name": "tsm",
+        "used_config": json.dumps({"param": {}}),
+    }
+
+
+def test_async_open_rejects_invalid_token(local_server):
+    async_core = load_module("async_core")
+    local_server.route("GET", "/api/", json_route({"detail": "Invalid token"}, 401))
+
+    async def run():
+        async with async_core.AsyncPzServer("bad", f"{local_server.url}/api/"):
+            pass
+
+    with pytest.raises(requests.exceptions.RequestException, match="401"):
+        asyncio.run(run())
+
+
+def test_async_client_is_reused_across_event_loops(local_server):
+    local_server.route("GET", "/api/products/3/", json_route({"id": 3}))
+    pz_server = make_server(local_server)
+
+    async def run(close=False):
+        record = await pz_server.api.get("products", 3)
+        if close:
+            await pz_server.api.close()
+        return record
+
+    assert asyncio.run(run()) == {"id": 3}
+    assert asyncio.run(run(close=True)) == {"id": 3}
+
+
+def test_async_body_reads_time_out(local_server):
+    retry = importlib.import_module("pzserver.retry")
+
+    def stalled_body(request, _body):
+        request.wfile.write(b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nabc")
+        request.wfile.flush()
+        time.sleep(2)
+        request.close_connection = True
+        return 200, {}, b""
+
+    local_server.route("GET", "/api/products/3/", stalled_body)
+    pz_server = make_server(
+        local_server, timeout=0.2, retry_policy=retry.RetryPolicy(max_attempts=1)
+    )
+
+    async def run():
+        return await pz_server.api.get("products", 3)
+
+    started = time.perf_counter()
+    with pytest.raises(requests.exceptions.RequestException, match="Timeout"):
+        asyncio.run(run())
+    assert time.perf_counter() - started < 1.5
+
+
+def test_async_download_resumes_partial_file_on_first_get(local_server, tmp_path):
+    (tmp_path / "product_7.zip.part").write_bytes(b"zip-")
+
+    def download(request, _body):
+        headers = {"Content-Disposition": "attachment; filename=product_7.zip"}
+        if request.command == "HEAD":
+            return 200, headers, b"zip-bytes"
+        assert request.headers["Range"] == "bytes=4-"
+        headers["Content-Range"] = "bytes 4-8/9"
+        return 206, headers, b"bytes"
+
+    local_server.route("HEAD", "/api/files/7/", download)
+    local_server.route("GET", "/api/files/7/", download)
+
+    async def run():
+        async with make_server(local_server) as pz_server:
+            result = await pz_server.api._download_request(
+                f"{local_server.url}/api/files/7/", tmp_path
+            )
+            return result["message"]
+
+    path = asyncio.run(run())
+
+    assert Path(path).read_bytes() == b"zip-bytes"
+    gets = [path for method, path, _, _ in local_server.requests if method == "GET"]
+    assert gets == ["/api/", "/api/files/7/"]
+
+
+def test_async_client_imports_aiohttp_only_when_created(monkeypatch):
+    load_module("async_core")
+    async_communicate = sys.modules["pzserver.async_communicate"]
+    monkeypatch.setitem(sys.modules, "aiohttp", None)
+
+    importlib.reload(async_communicate)
+    with pytest.raises(ImportError, match=r"pzserver\[async\]"):
+        async_communicate.AsyncHTTPClient()
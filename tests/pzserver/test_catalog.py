@@ -2,6 +2,16 @@
 Tests for pzserver/catalog.py
 """
 
+from unittest import mock
+
+import matplotlib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from conftest import load_module
+
+matplotlib.use("Agg")
+
 # from pzserver.catalog import Catalog
 
 
@@ -11,3 +21,85 @@ def test_init():
     """
     value = 42
     assert value == 42
+
+
+def test_binned_densities_accumulate_streamed_chunks():
+    density = load_module("density")
+    table = pa.table(
+        {"ra": [10.0, 370.0, 200.0, None], "dec": [0.0, 0.0, -89.0, 5.0]}
+    )
+
+    sky = density.SkyHistogram(bins=(36, 18))
+    for chunk in density.iter_chunks(table.to_batches(max_chunksize=1), ["ra", "dec"]):
+        sky.update(chunk["ra"], chunk["dec"])
+
+    assert sky.counts.sum() == 3
+    assert sky.counts[1].sum() == 2
+
+    histogram = density.Histogram((0, 10), 1000)
+    histogram.update(np.array([1.0, 1.05, 2.5, np.nan, 20.0]))
+    merged = histogram.coarsened(3)
+    assert merged.counts.sum() == 3
+    assert len(merged.counts) <= 3
+    assert merged.edges[0] == 1.0
+
+
+def test_only_streamed_catalogs_are_plotted_binned_by_default(monkeypatch, capsys):
+    catalog = load_module("catalog")
+    monkeypatch.setattr(catalog, "BINNED_PLOT_MIN_ROWS", 100)
+    rows = 1000
+    data = pd.DataFrame(
+        {
+            "ra": np.linspace(0, 359, rows),
+            "dec": np.linspace(-60, 30, rows),
+            "z": np.linspace(0, 2, rows),
+        }
+    )
+    metadata = {
+        "main_file": {
+            "columns_association": [
+                {"ucd": "pos.eq.ra;meta.main", "column_name": "ra"},
+                {"ucd": "pos.eq.dec;meta.main", "column_name": "dec"},
+                {"ucd": "src.redshift", "column_name": "z"},
+            ]
+        }
+    }
+
+    catalog.SpeczCatalog(data, metadata).plot()
+
+    assert catalog.plt.gcf().axes[0].name == "rectilinear"
+    assert "binned=True" in capsys.readouterr().out
+    catalog.plt.close("all")
+
+    catalog.SpeczCatalog(data, metadata).plot(binned=True)
+    assert catalog.plt.gcf().axes[0].name == "mollweide"
+    catalog.plt.close("all")
+
+    batches = iter(pa.Table.from_pandas(data).to_batches(max_chunksize=300))
+    catalog.TrainingSet(batches, metadata).plot(mag_name="dec")
+    assert len(catalog.plt.gcf().axes) == 4
+    catalog.plt.close("all")
+
+
+def test_binned_plots_keep_values_out_of_the_default_ranges(capsys):
+    catalog = load_module("catalog")
+    data = pd.DataFrame({"z": [0.1, 0.5, 12.0], "mag": [20.0, 22.0, 99.0]})
+    metadata = {
+        "main_file": {
+            "columns_association": [{"ucd": "src.redshift", "column_name": "z"}]
+        }
+    }
+
+    catalog.TrainingSet(data, metadata).plot(mag_name="mag", binned=True)
+
+    magnitude, redshift = catalog.plt.gcf().axes[:2]
+    assert magnitude.patches[0].get_path().vertices[:, 0].max() >= 99.0
+    assert redshift.patches[0].get_path().vertices[:, 0].max() >= 12.0
+    catalog.plt.close("all")
+
+    batches = iter(pa.Table.from_pandas(data).to_batches())
+    catalog.TrainingSet(batches, metadata).plot(mag_name="mag")
+    output = capsys.readouterr().out
+    assert "1 values of mag outside the plotted range" in output
+    assert "1 values of z outside the plotted range" in output
+    catalog.plt.close("all")
@@ -0,0 +1,481 @@
+"""
+Tests for the PzRequests HTTP layer.
+"""
+
+import importlib
+from unittest import mock
+
+import pytest
+import requests
+from conftest import load_module
+
+
+def make_api():
+    communicate = load_module("communicate")
+    api = object.__new__(communicate.PzRequests)
+    api._base_api_url = "https://pz.example.org/api/"
+    api._token = "token"
+    return api, communicate
+
+
+def make_response(status_code=200, json_data=None, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {"content-type": "application/json"})
+    response._content = (
+        b"" if json_data is None else requests.compat.json.dumps(json_data).encode()
+    )
+    return response
+
+
+def test_requests_share_one_pooled_session(monkeypatch):
+    api, communicate = make_api()
+    session = mock.Mock()
+    session.send.return_value = make_response(json_data={"id": 1})
+    create_session = mock.Mock(return_value=session)
+    monkeypatch.setattr(communicate.PzRequests, "_create_session", create_session)
+
+    api.get("products", 1)
+    api.get("product-types", 2)
+    api.options("products")
+
+    create_session.assert_called_once()
+    assert session.send.call_count == 3
+
+
+def test_session_mounts_pooled_adapter_with_limits():
+    _, communicate = make_api()
+
+    session = communicate.PzRequests._create_session(
+        pool_connections=4, pool_maxsize=16, pool_block=True
+    )
+    adapter = session.get_adapter("https://pz.example.org/api/")
+
+    assert adapter._pool_connections == 4
+    assert adapter._pool_maxsize == 16
+    assert adapter._pool_block is True
+    session.close()
+
+
+def test_close_releases_session_and_context_manager_closes(monkeypatch):
+    api, communicate = make_api()
+    session = mock.Mock()
+    session.send.return_value = make_response(json_data={})
+    monkeypatch.setattr(
+        communicate.PzRequests, "_create_session", mock.Mock(return_value=session)
+    )
+
+    with api:
+        api.get("products", 1)
+
+    session.close.assert_called_once()
+    assert api._session is None
+
+
+def test_keep_alive_disabled_sends_connection_close(monkeypatch):
+    api, communicate = make_api()
+    api._keep_alive = False
+    session = mock.Mock()
+    session.send.return_value = make_response(json_data={})
+    monkeypatch.setattr(
+        communicate.PzRequests, "_create_session", mock.Mock(return_value=session)
+    )
+
+    api.get("products", 1)
+
+    prepared = session.send.call_args.args[0]
+    assert prepared.headers["Connection"] == "close"
+
+
+def paged_get_request(pages, calls):
+    def get_request(url, params=None):
+        calls.append((url, params))
+        return {"success": True, "data": pages[url]}
+
+    return get_request
+
+
+def test_get_all_follows_pagination_links():
+    api, _ = make_api()
+    calls = []
+    base = "https://pz.example.org/api/releases/"
+    pages = {
+        base: {"next": f"{base}?page=2", "results": [{"id": 1}, {"id": 2}]},
+        f"{base}?page=2": {"next": f"{base}?page=3", "results": [{"id": 3}]},
+        f"{base}?page=3": {"next": None, "results": [{"id": 4}]},
+    }
+    api._get_request = paged_get_request(pages, calls)
+
+    records = api.get_all("releases", ordering="order")
+
+    assert [record["id"] for record in records] == [1, 2, 3, 4]
+    assert calls[0] == (base, {"ordering": "order"})
+    assert [url for url, _ in calls[1:]] == [f"{base}?page=2", f"{base}?page=3"]
+
+
+def test_iter_products_is_lazy_and_prefetches_next_page():
+    api, _ = make_api()
+    calls = []
+    base = "https://pz.example.org/api/products/"
+    pages = {
+        base: {"next": f"{base}?page=2", "results": [{"id": 1}]},
+        f"{base}?page=2": {"next": f"{base}?page=3", "results": [{"id": 2}]},
+        f"{base}?page=3": {"next": None, "results": [{"id": 3}]},
+    }
+    api._get_request = paged_get_request(pages, calls)
+
+    products = api.iter_products(page_size=1)
+    assert not calls
+
+    assert next(products) == {"id": 1}
+    assert calls[0] == (base, {"status": "1", "page_size": 1})
+
+    products.close()
+    assert f"{base}?page=3" not in [url for url, _ in calls]
+
+
+def test_iter_all_accepts_unpaginated_responses():
+    api, _ = make_api()
+    api._get_request = lambda url, params=None: {
+        "success": True,
+        "data": [{"id": 1}, {"id": 2}],
+    }
+
+    assert list(api.iter_all("pipelines")) == [{"id": 1}, {"id": 2}]
+
+
+def test_iter_pages_raises_on_failed_page():
+    api, _ = make_api()
+    api._get_request = lambda url, params=None: {
+        "success": False,
+        "message": "server error",
+    }
+
+    with pytest.raises(requests.exceptions.RequestException, match="server error"):
+        api.get_all("releases")
+
+
+def etag_route(payload, etag='"v1"'):
+    def handler(request, _body):
+        if request.headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+        body = requests.compat.json.dumps(payload).encode()
+        return 200, {"Content-Type": "application/json", "ETag": etag}, body
+
+    return handler
+
+
+def make_cached_api(communicate, local_server, cache):
+    api = object.__new__(communicate.PzRequests)
+    api._base_api_url = f"{local_server.url}/api/"
+    api._token = "token"
+    api._metadata_cache = cache
+    return api
+
+
+def test_static_entities_are_served_from_cache_until_expired(local_server):
+    _, communicate = make_api()
+    response_cache = importlib.import_module("pzserver.response_cache")
+    local_server.route("GET", "/api/releases/3/", etag_route({"id": 3}))
+    cache = response_cache.ResponseCache(ttl=60)
+    api = make_cached_api(communicate, local_server, cache)
+
+    first = api.get("releases", 3)
+    first["name"] = "changed by the caller"
+    second = api.get("releases", 3)
+
+    assert second == {"id": 3}
+    assert len(local_server.requests) == 1
+
+
+def test_expired_entries_are_revalidated_with_etag(local_server):
+    _, communicate = make_api()
+    response_cache = importlib.import_module("pzserver.response_cache")
+    local_server.route("GET", "/api/products/9/", etag_route({"id": 9}))
+    api = make_cached_api(communicate, local_server, response_cache.ResponseCache())
+
+    assert api.get("products", 9) == {"id": 9}
+    assert api.get("products", 9) == {"id": 9}
+
+    assert len(local_server.requests) == 2
+    assert "If-None-Match" not in local_server.requests[0][2]
+    assert local_server.requests[1][2]["If-None-Match"] == '"v1"'
+
+
+def test_disk_backend_is_shared_between_instances(local_server, tmp_path):
+    _, communicate = make_api()
+    response_cache = importlib.import_module("pzserver.response_cache")
+    local_server.route("OPTIONS", "/api/products/", etag_route({"search": []}))
+
+    for _ in range(2):
+        cache = response_cache.ResponseCache(ttl=60, directory=tmp_path)
+        api = make_cached_api(communicate, local_server, cache)
+        assert api.options("products") == {"search": []}
+
+    assert len(local_server.requests) == 1
+
+
+def test_response_cache_evicts_least_recently_used():
+    make_api()
+    response_cache = importlib.import_module("pzserver.response_cache")
+    cache = response_cache.ResponseCache(max_entries=2)
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a")["data"] == 1
+    assert cache.get("c")["data"] == 3
+
+
+def flaky_route(statuses, headers=None):
+    """Answers with the given statuses in order, then 200."""
+
+    def handler(_request, _body):
+        status = statuses.pop(0) if statuses else 200
+        if status == 200:
+            return 200, {"Content-Type": "application/json"}, b'{"id": 1}'
+        return status, dict(headers or {}), b"busy"
+
+    return handler
+
+
+def make_retry_api(communicate, local_server, **policy_options):
+    retry = importlib.import_module("pzserver.retry")
+    api = make_cached_api(communicate, local_server, None)
+    api._retry_policy = retry.RetryPolicy(**policy_options)
+    return api
+
+
+def test_transient_statuses_are_retried_with_backoff(local_server, monkeypatch):
+    _, communicate = make_api()
+    delays = []
+    monkeypatch.setattr(communicate.time, "sleep", delays.append)
+    local_server.route("GET", "/api/products/1/", flaky_route([503, 502]))
+    api = make_retry_api(communicate, local_server, backoff_factor=1, jitter=0)
+
+    resp = api._get_request(f"{local_server.url}/api/products/1/")
+
+    assert resp["success"] is True
+    assert resp["retries"] == 2
+    assert delays == [1, 2]
+
+
+def test_retry_after_header_is_honored(local_server, monkeypatch):
+    _, communicate = make_api()
+    delays = []
+    monkeypatch.setattr(communicate.time, "sleep", delays.append)
+    local_server.route(
+        "GET", "/api/products/1/", flaky_route([429], headers={"Retry-After": "7"})
+    )
+    api = make_retry_api(communicate, local_server)
+
+    assert api.get("products", 1) == {"id": 1}
+    assert delays == [7.0]
+
+
+def test_post_is_not_replayed_on_server_errors(local_server, monkeypatch):
+    _, communicate = make_api()
+    monkeypatch.setattr(communicate.time, "sleep", lambda seconds: None)
+    local_server.route("POST", "/api/processes/", flaky_route([503]))
+    api = make_retry_api(communicate, local_server)
+
+    with pytest.raises(requests.exceptions.RequestException, match="busy"):
+        api.start_process({"display_name": "test"})
+
+    assert len(local_server.requests) == 1
+
+
+def test_post_is_retried_when_rate_limited(local_server, monkeypatch):
+    _, communicate = make_api()
+    monkeypatch.setattr(communicate.time, "sleep", lambda seconds: None)
+    local_server.route("POST", "/api/processes/", flaky_route([429]))
+    api = make_retry_api(communicate, local_server)
+
+    assert api.start_process({"display_name": "test"}) == {"id": 1}
+    assert len(local_server.requests) == 2
+
+
+def test_retries_stop_after_max_attempts(local_server, monkeypatch):
+    _, communicate = make_api()
+    monkeypatch.setattr(communicate.time, "sleep", lambda seconds: None)
+    local_server.route("GET", "/api/products/1/", flaky_route([503] * 5))
+    api = make_retry_api(communicate, local_server, max_attempts=3)
+
+    resp = api._get_request(f"{local_server.url}/api/products/1/")
+
+    assert resp["success"] is False
+    assert resp["status_code"] == 503
+    assert resp["retries"] == 2
+
+
+def test_request_events_report_endpoint_status_and_sizes(local_server):
+    _, communicate = make_api()
+    local_server.route("GET", "/api/products/12/main_file_info/", flaky_route([]))
+    api = make_cached_api(communicate, local_server, None)
+    events = []
+    api.events.subscribe(events.append)
+
+    api._get_request(f"{local_server.url}/api/products/12/main_file_info/?x=1")
+
+    assert len(events) == 1
+    event = events[0]
+    assert event["kind"] == "request"
+    assert event["method"] == "GET"
+    assert event["endpoint"] == "products/{id}/main_file_info/"
+    assert event["status_code"] == 200
+    assert event["response_bytes"] == len(b'{"id": 1}')
+    assert event["request_bytes"] == 0
+    assert event["retries"] == 0
+    assert event["duration"] >= 0
+
+
+def test_request_stats_aggregates_percentiles(capsys):
+    make_api()
+    instrumentation = importlib.import_module("pzserver.instrumentation")
+    stats = instrumentation.RequestStats()
+
+    for duration in range(1, 101):
+        stats(
+            {
+                "kind": "request",
+                "method": "GET",
+                "endpoint": "products/{id}/",
+                "duration": duration / 100,
+                "success": duration != 100,
+                "response_bytes": 10,
+            }
+        )
+
+    (row,) = stats.summary()
+    assert row["count"] == 100
+    assert row["errors"] == 1
+    assert row["response_bytes"] == 1000
+    assert row["p50_s"] == 0.50
+    assert row["p95_s"] == 0.95
+    assert row["p99_s"] == 0.99
+
+    stats.print_summary()
+    assert "products/{id}/" in capsys.readouterr().out
+
+
+def test_download_emits_transfer_event(local_server, tmp_path):
+    _, communicate = make_api()
+    local_server.route(
+        "GET",
+        "/file",
+        lambda request, body: (200, {"Content-Disposition": "filename=a.csv"}, b"abc"),
+    )
+    api = make_cached_api(communicate, local_server, None)
+    events = []
+    api.events.subscribe(events.append)
+
+    api._download_request(f"{local_server.url}/file", tmp_path)
+
+    assert [event["kind"] for event in events] == ["request", "transfer"]
+    assert events[1]["response_bytes"] == 3
+    assert events[1]["success"] is True
+
+
+def json_reply(status, payload):
+    return status, {"Content-Type": "application/json"}, requests.compat.json.dumps(
+        payload
+    ).encode()
+
+
+def chunked_upload_routes(local_server, received, fail_part=None):
+    def create(_request, _body):
+        return json_reply(201, {"id": "u1", "chunk_size": 4})
+
+    def put_part(request, body):
+        start = int(request.headers["Content-Range"].split()[1].split("-")[0])
+        if start // 4 == fail_part:
+            return json_reply(400, {"detail": "bad part"})
+        received[start // 4] = body
+        return json_reply(200, {"parts": sorted(received)})
+
+    def status(_request, _body):
+        return json_reply(200, {"parts": sorted(received)})
+
+    def complete(_request, _body):
+        content = b"".join(received[index] for index in sorted(received))
+        return json_reply(201, {"id": 7, "content": content.decode()})
+
+    local_server.route("POST", "/api/product-files/uploads/", create)
+    local_server.route("PUT", "/api/product-files/uploads/u1/", put_part)
+    local_server.route("GET", "/api/product-files/uploads/u1/", status)
+    local_server.route("POST", "/api/product-files/uploads/u1/complete/", complete)
+
+
+def make_upload_api(communicate, local_server, tmp_path):
+    api = make_cached_api(communicate, local_server, None)
+    api._upload_journal_dir = str(tmp_path / "journal")
+    return api
+
+
+def test_large_files_are_uploaded_in_parts(local_server, tmp_path):
+    _, communicate = make_api()
+    received = {}
+    chunked_upload_routes(local_server, received)
+    api = make_upload_api(communicate, local_server, tmp_path)
+    filepath = tmp_path / "data.csv"
+    filepath.write_bytes(b"0123456789")
+
+    upload = api.upload_file(1, filepath, "main", chunk_size=4)
+
+    assert upload == {"id": 7, "content": "0123456789"}
+    ranges = [
+        headers["Content-Range"]
+        for method, _, headers, _ in local_server.requests
+        if method == "PUT"
+    ]
+    assert ranges == ["bytes 0-3/10", "bytes 4-7/10", "bytes 8-9/10"]
+    assert not list((tmp_path / "journal").glob("*.json"))
+
+
+def test_interrupted_chunked_upload_resumes_missing_parts(local_server, tmp_path):
+    _, communicate = make_api()
+    received = {}
+    chunked_upload_routes(local_server, received, fail_part=2)
+    api = make_upload_api(communicate, local_server, tmp_path)
+    filepath = tmp_path / "data.csv"
+    filepath.write_bytes(b"0123456789")
+
+    with pytest.raises(requests.exceptions.RequestException, match="resume"):
+        api.upload_file(1, filepath, "main", chunk_size=4)
+
+    chunked_upload_routes(local_server, received)
+    local_server.requests.clear()
+    upload = api.upload_file(1, filepath, "main", chunk_size=4)
+
+    assert upload["content"] == "0123456789"
+    assert [(method, path) for method, path, _, _ in local_server.requests] == [
+        ("GET", "/api/product-files/uploads/u1/"),
+        ("PUT", "/api/product-files/uploads/u1/"),
+        ("POST", "/api/product-files/uploads/u1/complete/"),
+    ]
+
+
+def test_multipart_upload_is_streamed_from_disk(local_server, tmp_path):
+    _, communicate = make_api()
+    local_server.route(
+        "POST", "/api/product-files/", lambda request, body: json_reply(201, {"id": 3})
+    )
+    api = make_upload_api(communicate, local_server, tmp_path)
+    filepath = tmp_path / "data.csv"
+    filepath.write_bytes(b"a,b\n1,2\n")
+
+    with mock.patch.object(
+        communicate.MultipartStream, "close", autospec=True
+    ) as close:
+        upload = api.upload_file(1, filepath, "main", mimetype="text/csv")
+
+    _, _, headers, body = local_server.requests[0]
+    assert upload == {"id": 3}
+    assert headers["Content-Type"].startswith("multipart/form-data; boundary=")
+    assert int(headers["Content-Length"]) == len(body)
+    assert b'filename="data.csv"' in body and b"a,b\n1,2\n" in body
+    assert b'name="role"\r\n\r\n0\r\n' in body
+    close.assert_called_once()
@@ -2,19 +2,24 @@
 Tests for product download orchestration.
 """
 
-import importlib.util
+import base64
+import hashlib
+import importlib
+import json
+import sys
 from pathlib import Path
+from types import ModuleType
 
 import pytest
 import requests
 
 
 def load_communicate_module():
-    module_path = Path(__file__).parents[2] / "src" / "pzserver" / "communicate.py"
-    spec = importlib.util.spec_from_file_location("pzserver_communicate", module_path)
-    module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(module)
-    return module
+    root = Path(__file__).parents[2] / "src" / "pzserver"
+    package = ModuleType("pzserver")
+    package.__path__ = [str(root)]
+    sys.modules.setdefault("pzserver", package)
+    return importlib.import_module("pzserver.communicate")
 
 
 def make_api():
@@ -237,3 +242,296 @@ def test_download_request_resumes_interrupted_stream(tmp_path):
     assert first_response.closed is True
     assert second_response.closed is True
     assert not responses
+
+
+def ranged_file_route(content, calls, fail_once_at=None):
+    """Serves content honoring single byte-range requests."""
+
+    def handler(request, _body):
+        headers = {"Content-Disposition": "attachment; filename=product.zip"}
+        range_header = request.headers.get("Range")
+        calls.append(range_header)
+        if not range_header:
+            return 200, headers, content
+
+        start, end = range_header.removeprefix("bytes=").split("-")
+        start = int(start)
+        end = int(end) if end else len(content) - 1
+        payload = content[start : end + 1]
+        if fail_once_at is not None and start == fail_once_at and calls.count(
+            range_header
+        ) == 1:
+            return 500, {}, b"boom"
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+        return 206, headers, payload
+
+    return handler
+
+
+def make_pooled_api(communicate):
+    api = object.__new__(communicate.PzRequests)
+    api._token = "token"
+    api._min_range_size = 4
+    return api
+
+
+def test_parallel_download_fetches_ranges_concurrently(local_server, tmp_path):
+    _, communicate = make_api()
+    api = make_pooled_api(communicate)
+    content = bytes(range(256)) * 4
+    calls = []
+    local_server.route("GET", "/file", ranged_file_route(content, calls))
+
+    result = api._download_request(f"{local_server.url}/file", tmp_path, connections=4)
+
+    destination = Path(result["message"])
+    assert destination.read_bytes() == content
+    assert calls[0] == "bytes=0-0"
+    assert sorted(calls[1:]) == sorted(
+        ["bytes=0-255", "bytes=256-511", "bytes=512-767", "bytes=768-1023"]
+    )
+    assert not destination.with_name("product.zip.part").exists()
+    assert not destination.with_name("product.zip.part.ranges").exists()
+
+
+def test_parallel_download_retries_failed_range(local_server, tmp_path):
+    _, communicate = make_api()
+    api = make_pooled_api(communicate)
+    content = b"0123456789abcdef"
+    calls = []
+    local_server.route("GET", "/file", ranged_file_route(content, calls, fail_once_at=8))
+
+    result = api._download_request(f"{local_server.url}/file", tmp_path, connections=2)
+
+    assert Path(result["message"]).read_bytes() == content
+    assert calls.count("bytes=8-15") == 2
+
+
+def test_parallel_download_resumes_from_journal(local_server, tmp_path):
+    _, communicate = make_api()
+    api = make_pooled_api(communicate)
+    content = b"0123456789abcdef"
+    partial = tmp_path / "product.zip.part"
+    partial.write_bytes(b"0123" + b"\0" * 4 + b"89ab" + b"\0" * 4)
+    (tmp_path / "product.zip.part.ranges").write_text(
+        '{"size": 16, "segments": [[0, 7, 4], [8, 15, 4]]}'
+    )
+    calls = []
+    local_server.route("GET", "/file", ranged_file_route(content, calls))
+
+    result = api._download_request(f"{local_server.url}/file", tmp_path, connections=2)
+
+    assert Path(result["message"]).read_bytes() == content
+    assert sorted(calls[1:]) == ["bytes=12-15", "bytes=4-7"]
+
+
+def test_parallel_download_falls_back_without_range_support(local_server, tmp_path):
+    _, communicate = make_api()
+    api = make_pooled_api(communicate)
+    content = b"0123456789abcdef"
+
+    def no_ranges(_request, _body):
+        return 200, {"Content-Disposition": "attachment; filename=plain.csv"}, content
+
+    local_server.route("GET", "/file", no_ranges)
+
+    result = api._download_request(f"{local_server.url}/file", tmp_path, connections=4)
+
+    assert Path(result["message"]).read_bytes() == content
+    assert len(local_server.requests) == 2
+
+
+class FakeClock:
+    """Monotonic clock advanced by the patched time.sleep."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def status_sequences(sequences):
+    polls = []
+
+    def status(product_id):
+        polls.append(product_id)
+        return sequences[product_id].pop(0)
+
+    return status, polls
+
+
+def ready(product_id):
+    return {"status": "ready", "download_url": f"/api/products/{product_id}/file/"}
+
+
+def test_archives_are_polled_from_one_loop_with_backoff(monkeypatch):
+    api, communicate = make_api()
+    clock = FakeClock()
+    monkeypatch.setattr(communicate.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(communicate.time, "sleep", clock.sleep)
+    running = {"status": "running"}
+    status, polls = status_sequences(
+        {
+            1: [running, running, running, ready(1)],
+            2: [ready(2)],
+            3: [{"status": "running", "retry_after": "10"}, ready(3)],
+        }
+    )
+
+    results = list(
+        api._iter_ready_archives(
+            {1: running, 2: running, 3: running, 4: ready(4)},
+            poll_interval=1,
+            max_poll_interval=20,
+            status_getter=status,
+        )
+    )
+
+    assert [(product_id, error) for product_id, _, error in results] == [
+        (4, None),
+        (2, None),
+        (1, None),
+        (3, None),
+    ]
+    # product 1 is checked at t=1, 2.5, 4.75 and 8.125 (backoff of 1.5x);
+    # product 3 waits the 10 s requested by the server after its first check.
+    assert polls == [1, 2, 3, 1, 1, 1, 3]
+    assert clock.now == 11
+
+
+def test_archive_polling_reports_timeouts_and_failures(monkeypatch):
+    api, communicate = make_api()
+    clock = FakeClock()
+    monkeypatch.setattr(communicate.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(communicate.time, "sleep", clock.sleep)
+    status, _ = status_sequences(
+        {
+            1: [{"status": "running"}] * 10,
+            2: [{"status": "failed", "error_message": "zip failed"}],
+        }
+    )
+
+    results = {
+        product_id: error
+        for product_id, _, error in api._iter_ready_archives(
+            {1: {"status": "pending"}, 2: {"status": "pending"}},
+            timeout=5,
+            poll_interval=1,
+            status_getter=status,
+        )
+    }
+
+    assert str(results[2]) == "zip failed"
+    assert "still being prepared" in str(results[1])
+
+
+def test_download_products_downloads_each_archive_when_ready(monkeypatch):
+    api, communicate = make_api()
+    monkeypatch.setattr(communicate.time, "sleep", lambda seconds: None)
+    status, _ = status_sequences({1: [{"status": "running"}, ready(1)], 2: [ready(2)]})
+    downloads = []
+
+    def prepare(product_id):
+        if product_id == 3:
+            raise requests.exceptions.RequestException("not found")
+        return {"status": "pending"}
+
+    monkeypatch.setattr(api, "_prepare_product_download", prepare)
+    monkeypatch.setattr(api, "_get_product_download_status", status)
+    monkeypatch.setattr(
+        api,
+        "_download_request",
+        lambda url, save_in: downloads.append(url)
+        or {"success": True, "message": url.rsplit("/", 3)[-3]},
+    )
+
+    results = api.download_products([1, 2, 3], "/tmp", poll_interval=0)
+
+    assert list(results) == [1, 2, 3]
+    assert results[1] == {"success": True, "message": "1"}
+    assert results[3] == {"success": False, "message": "not found"}
+    assert downloads == [
+        "https://pz.example.org/api/products/2/file/",
+        "https://pz.example.org/api/products/1/file/",
+    ]
+
+
+def digest_route(content, calls, digest=None):
+    """Ranged route that also sends the sha256 of the file."""
+    serve = ranged_file_route(content, calls)
+    digest = digest or hashlib.sha256(content).digest()
+
+    def handler(request, body):
+        status, headers, payload = serve(request, body)
+        headers["Repr-Digest"] = f"sha-256=:{base64.b64encode(digest).decode()}:"
+        return status, headers, payload
+
+    return handler
+
+
+def test_download_records_block_digests_while_writing(local_server, tmp_path):
+    _, communicate = make_api()
+    api = make_pooled_api(communicate)
+    api._digest_block_size = 4
+    content = b"0123456789"
+    local_server.route("GET", "/file", digest_route(content, []))
+
+    result = api._download_request(f"{local_server.url}/file", tmp_path)
+
+    manifest = json.loads((tmp_path / "product.zip.digests").read_text())
+    assert Path(result["message"]).read_bytes() == content
+    assert manifest["digest"] == hashlib.sha256(content).hexdigest()
+    assert manifest["blocks"] == [
+        hashlib.sha256(content[start : start + 4]).hexdigest() for start in (0, 4, 8)
+    ]
+
+
+def test_resumed_download_refetches_only_corrupted_blocks(local_server, tmp_path):
+    _, communicate = make_api()
+    api = make_pooled_api(communicate)
+    api._digest_block_size = 4
+    content = b"0123456789abcdef"
+    (tmp_path / "product.zip.part").write_bytes(b"0123XXXX89")
+    (tmp_path / "product.zip.part.digests").write_text(
+        json.dumps(
+            {
+                "block_size": 4,
+                "blocks": [
+                    hashlib.sha256(content[start : start + 4]).hexdigest()
+                    for start in (0, 4)
+                ],
+            }
+        )
+    )
+    calls = []
+    local_server.route("HEAD", "/file", digest_route(content, []))
+    local_server.route("GET", "/file", digest_route(content, calls))
+
+    result = api._download_request(f"{local_server.url}/file", tmp_path)
+
+    assert Path(result["message"]).read_bytes() == content
+    assert calls == ["bytes=4-7", "bytes=10-"]
+
+
+def test_download_with_wrong_digest_is_fetched_again_then_rejected(
+    local_server, tmp_path
+):
+    _, communicate = make_api()
+    api = make_pooled_api(communicate)
+    calls = []
+    local_server.route(
+        "GET", "/file", digest_route(b"0123456789", calls, digest=b"\0" * 32)
+    )
+
+    with pytest.raises(requests.exceptions.RequestException) as excinfo:
+        api._download_request(f"{local_server.url}/file", tmp_path, max_attempts=2)
+
+    assert "Checksum mismatch" in str(excinfo.value.__cause__)
+    assert calls == [None, None]
+    assert not (tmp_path / "product.zip").exists()
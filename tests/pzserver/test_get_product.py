@@ -9,9 +9,11 @@ from pathlib import Path
 from types import ModuleType
 from unittest import mock
 
+import numpy as np
 import pandas as pd
 import pytest
 import requests
+from astropy.coordinates import SkyCoord
 from astropy.table import Table
 
 
@@ -92,7 +94,7 @@ def test_get_product_allows_large_products_when_explicitly_requested(tmp_path):
     )
 
     expected = Table({"id": [1]})
-    with mock.patch.object(core.tables_io, "read", return_value=expected):
+    with mock.patch.object(core, "read_main_table", return_value=expected):
         result = server.get_product("large", get_big_products=True)
 
     assert result is expected
@@ -120,7 +122,7 @@ def test_get_product_allows_product_at_exactly_200_mb(tmp_path):
     )
 
     expected = Table({"id": [1]})
-    with mock.patch.object(core.tables_io, "read", return_value=expected):
+    with mock.patch.object(core, "read_main_table", return_value=expected):
         result = server.get_product("limit")
 
     assert result is expected
@@ -148,7 +150,7 @@ def test_get_product_allows_small_product_when_size_is_in_bytes(tmp_path):
     )
 
     expected = Table({"id": [1]})
-    with mock.patch.object(core.tables_io, "read", return_value=expected):
+    with mock.patch.object(core, "read_main_table", return_value=expected):
         result = server.get_product("small")
 
     assert result is expected
@@ -208,7 +210,9 @@ def test_get_product_downloads_hats_main_file_and_reads_with_lsdb(tmp_path, monk
     assert len(table) == 2
     api.download_main_file.assert_called_once()
     api.download_product.assert_not_called()
-    assert open_catalog.call_args.kwargs["path"].endswith("/extracted")
+    assert open_catalog.call_args.kwargs["path"] == (
+        f"zip://::file://{archive_path.resolve()}"
+    )
 
 
 def test_get_product_reads_zip_download_even_when_metadata_is_not_directory(
@@ -245,7 +249,9 @@ def test_get_product_reads_zip_download_even_when_metadata_is_not_directory(
     assert table.colnames == ["object_id", "ra", "dec"]
     api.download_main_file.assert_called_once()
     api.download_product.assert_not_called()
-    assert open_catalog.call_args.kwargs["path"].endswith("/extracted")
+    assert open_catalog.call_args.kwargs["path"] == (
+        f"zip://::file://{archive_path.resolve()}"
+    )
 
 
 def test_get_product_raises_when_hats_main_file_download_fails(monkeypatch):
@@ -294,3 +300,501 @@ def test_get_product_requires_lsdb_for_hats(monkeypatch):
 
     with pytest.raises(ImportError, match="lsdb"):
         server.get_product("hats_product")
+
+
+def csv_download(calls, content="id,z\n1,0.5\n"):
+    def download(product_id, destination):
+        calls.append(destination)
+        path = Path(destination) / "main.csv"
+        path.write_text(content)
+        return {"success": True, "message": str(path)}
+
+    return download
+
+
+def make_cached_server(core, api, tmp_path, metadata):
+    server = make_server_with_api(core, api)
+    server.cache = core.ProductCache(tmp_path / "cache")
+    server.get_product_metadata = mock.Mock(return_value=metadata)
+    return server
+
+
+def test_get_product_reuses_cached_main_file(tmp_path):
+    core = load_core_module()
+    calls = []
+    api = mock.Mock()
+    api.download_main_file.side_effect = csv_download(calls)
+    metadata = base_metadata(
+        {"extension": ".csv", "is_directory": False, "has_header": True, "size": 12}
+    )
+    server = make_cached_server(core, api, tmp_path, metadata)
+
+    first = server.get_product("crc")
+    second = server.get_product("crc")
+
+    assert list(first["z"]) == list(second["z"]) == [0.5]
+    assert len(calls) == 1
+    assert server.cache.stats()["hits"] == 1
+
+    metadata["main_file"]["size"] = 13
+    server.get_product("crc")
+    assert len(calls) == 2
+
+
+def test_download_product_copies_cached_archive(tmp_path):
+    core = load_core_module()
+    calls = []
+    api = mock.Mock()
+    api.download_product.side_effect = csv_download(calls)
+    metadata = base_metadata({"size": 12})
+    metadata["updated_at"] = "2024-01-01T00:00:00Z"
+    server = make_cached_server(core, api, tmp_path, metadata)
+
+    server.download_product("crc", tmp_path / "first")
+    server.download_product("crc", tmp_path / "second")
+
+    assert len(calls) == 1
+    assert (tmp_path / "second" / "main.csv").read_text() == "id,z\n1,0.5\n"
+
+
+def test_product_cache_evicts_least_recently_used_and_drops_corrupted(tmp_path):
+    core = load_core_module()
+    cache = core.ProductCache(tmp_path / "cache", max_bytes=10)
+    paths = []
+    for name in ("a", "b"):
+        path = tmp_path / f"{name}.bin"
+        path.write_bytes(name.encode() * 6)
+        paths.append(path)
+
+    cached_a = cache.put(1, "main_file", "v1", paths[0])
+    cache.put(2, "main_file", "v1", paths[1])
+
+    assert cache.get(1, "main_file", "v1") is None
+    assert not cached_a.exists()
+    assert cache.stats()["bytes"] == 6
+
+    cached_b = cache.get(2, "main_file", "v1")
+    cached_b.write_bytes(b"x" * 6)
+    assert cache.get(2, "main_file", "v1", verify=True) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_open_hats_product_reuses_persistent_local_copy(tmp_path, monkeypatch):
+    core = load_core_module()
+    fake_lsdb = ModuleType("lsdb")
+    catalog = FakeLsdbCatalog()
+    fake_lsdb.open_catalog = mock.Mock(return_value=catalog)
+    monkeypatch.setitem(sys.modules, "lsdb", fake_lsdb)
+
+    def download(product_id, destination):
+        path = Path(destination) / "hats.zip"
+        create_hats_archive(path, root="main")
+        return {"success": True, "message": str(path)}
+
+    api = mock.Mock()
+    api.download_main_file.side_effect = download
+    metadata = base_metadata({"is_directory": True, "name": "main", "size": 99})
+    server = make_cached_server(core, api, tmp_path, metadata)
+
+    first = server.get_product("hats_product", lazy=True, columns=["ra"])
+    second = server.open_hats_product("hats_product")
+
+    assert first is second is catalog
+    assert api.download_main_file.call_count == 1
+    calls = fake_lsdb.open_catalog.call_args_list
+    assert calls[0].kwargs["columns"] == ["ra"]
+    member, archive = calls[1].kwargs["path"].split("::file://")
+    assert member == "zip://main"
+    assert Path(archive).is_relative_to((tmp_path / "cache" / "hats").resolve())
+    assert not list((tmp_path / "cache" / "hats").rglob("collection.properties"))
+
+
+def test_hats_archive_is_extracted_only_when_zip_reading_fails(tmp_path, monkeypatch):
+    core = load_core_module()
+    fake_lsdb = ModuleType("lsdb")
+    catalog = FakeLsdbCatalog()
+
+    def open_catalog(path, **kwargs):
+        if path.startswith("zip://"):
+            raise FileNotFoundError(path)
+        return catalog
+
+    fake_lsdb.open_catalog = mock.Mock(side_effect=open_catalog)
+    monkeypatch.setitem(sys.modules, "lsdb", fake_lsdb)
+    archive_path = tmp_path / "hats.zip"
+    create_hats_archive(archive_path, root="main")
+    server = make_server_with_api(core, mock.Mock())
+
+    opened = server._open_hats_catalog_from_archive(  # pylint: disable=protected-access
+        fake_lsdb, archive_path, "main", tmp_path / "extracted"
+    )
+
+    assert opened is catalog
+    paths = [call.kwargs["path"] for call in fake_lsdb.open_catalog.call_args_list]
+    assert paths[:2] == [
+        f"zip://main::file://{archive_path.resolve()}",
+        f"zip://::file://{archive_path.resolve()}",
+    ]
+    assert paths[2] == str((tmp_path / "extracted" / "main").resolve())
+
+
+def test_hats_open_option_errors_do_not_extract_the_archive(tmp_path, monkeypatch):
+    core = load_core_module()
+    fake_lsdb = ModuleType("lsdb")
+    fake_lsdb.open_catalog = mock.Mock(side_effect=ValueError("unknown column"))
+    monkeypatch.setitem(sys.modules, "lsdb", fake_lsdb)
+    archive_path = tmp_path / "hats.zip"
+    create_hats_archive(archive_path, root="main")
+    server = make_server_with_api(core, mock.Mock())
+
+    with pytest.raises(ValueError, match="unknown column"):
+        server._open_hats_catalog_from_archive(  # pylint: disable=protected-access
+            fake_lsdb, archive_path, "main", tmp_path / "extracted", columns=["bad"]
+        )
+
+    assert fake_lsdb.open_catalog.call_count == 1
+    assert not (tmp_path / "extracted").exists()
+
+
+def ranged_route(content, served):
+    def handler(request, _body):
+        start, end = request.headers["Range"].removeprefix("bytes=").split("-")
+        payload = content[int(start) : int(end) + 1]
+        served.append(len(payload))
+        headers = {"Content-Range": f"bytes {start}-{end}/{len(content)}"}
+        return 206, headers, payload
+
+    return handler
+
+
+def write_hats_zip(tmp_path, frame):
+    lsdb = pytest.importorskip("lsdb")
+    catalog = lsdb.from_dataframe(
+        frame,
+        ra_column="ra",
+        dec_column="dec",
+        catalog_name="main",
+        lowest_order=1,
+        highest_order=1,
+        partition_rows=10_000,
+        margin_threshold=None,
+    )
+    catalog.write_catalog(tmp_path / "main")
+    archive_path = tmp_path / "hats.zip"
+    with zipfile.ZipFile(archive_path, "w") as archive:
+        for path in sorted((tmp_path / "main").rglob("*")):
+            if path.is_file():
+                archive.write(path, path.relative_to(tmp_path).as_posix())
+    return archive_path
+
+
+def test_get_product_fetches_only_partitions_in_region(tmp_path, local_server):
+    lsdb = pytest.importorskip("lsdb")
+    core = load_core_module()
+    communicate = importlib.import_module("pzserver.communicate")
+    rng = np.random.default_rng(1)
+    frame = pd.DataFrame(
+        {
+            "id": range(3000),
+            "ra": rng.uniform(0, 360, 3000),
+            "dec": rng.uniform(-60, 60, 3000),
+        }
+    )
+    archive_path = write_hats_zip(tmp_path, frame)
+    content = archive_path.read_bytes()
+    served = []
+    local_server.route("GET", "/hats.zip", ranged_route(content, served))
+
+    requests_api = object.__new__(communicate.PzRequests)
+    requests_api._token = "token"
+    api = mock.Mock()
+    api.open_main_file_archive.side_effect = lambda _id: (
+        requests_api._open_remote_file(f"{local_server.url}/hats.zip")
+    )
+    server = make_server_with_api(core, api)
+    server.get_product_metadata = mock.Mock(
+        return_value=base_metadata({"is_directory": True, "name": "main"})
+    )
+    region = lsdb.ConeSearch(ra=100, dec=10, radius_arcsec=5 * 3600)
+
+    table = server.get_product("hats_product", region=region, return_type="pandas")
+
+    center = SkyCoord(100, 10, unit="deg")
+    separation = SkyCoord(frame["ra"], frame["dec"], unit="deg").separation(center)
+    assert sorted(table["id"]) == sorted(frame["id"][separation.deg <= 5])
+    assert len(table) > 0
+    assert sum(served) < len(content) / 2
+    api.download_main_file.assert_not_called()
+
+
+def estimated_metadata(n_rows):
+    metadata = base_metadata(
+        {
+            "extension": ".parquet",
+            "is_directory": False,
+            "name": "main.parquet",
+            "size": 10 * 1024**2,
+            "n_rows": n_rows,
+            "columns": ["id", "ra", "dec", "z", "name"],
+            "column_types": {"id": "int64", "z": "float32", "name": "string"},
+            "columns_association": [{"column_name": "z", "ucd": "src.redshift"}],
+        }
+    )
+    metadata["internal_name"] = "big_crc"
+    return metadata
+
+
+def test_get_product_rejects_products_estimated_over_memory_budget():
+    core = load_core_module()
+    api = mock.Mock()
+    server = make_server_with_api(core, api)
+    server.memory_budget = 100 * 1024**2
+    server.get_product_metadata = mock.Mock(return_value=estimated_metadata(3 * 10**6))
+
+    with pytest.raises(ValueError, match="estimated to use") as exc_info:
+        server.get_product("big_crc")
+
+    message = str(exc_info.value)
+    assert "more than the memory budget of 100 MB" in message
+    assert "columns=['id', 'z']" in message
+    api.download_main_file.assert_not_called()
+    api.open_main_file_archive.assert_not_called()
+
+
+def test_get_product_allows_compressed_product_that_fits_in_memory(tmp_path):
+    core = load_core_module()
+    api = mock.Mock()
+    api.download_main_file.return_value = {
+        "success": True,
+        "message": str(tmp_path / "main.parquet"),
+    }
+    server = make_server_with_api(core, api)
+    server.memory_budget = 100 * 1024**2
+    metadata = estimated_metadata(10**5)
+    metadata["main_file"]["size"] = 300 * 1024**2
+    server.get_product_metadata = mock.Mock(return_value=metadata)
+
+    expected = Table({"id": [1]})
+    with mock.patch.object(core, "read_main_table", return_value=expected):
+        assert server.get_product("big_crc") is expected
+
+    estimate = server.estimate_product_memory("big_crc", columns=["src.redshift"])
+    assert estimate["columns"] == {"z": 2 * 4 * 10**5}
+    assert estimate["source"] == "metadata"
+
+
+def test_get_product_refuses_large_product_without_reading_footer():
+    core = load_core_module()
+    api = mock.Mock()
+    server = make_server_with_api(core, api)
+    server.memory_budget = 100 * 1024**2
+    metadata = base_metadata({"extension": ".parquet", "size": 300 * 1024**2})
+    server.get_product_metadata = mock.Mock(return_value=metadata)
+
+    with pytest.raises(ValueError, match="larger than 200 MB"):
+        server.get_product("crc")
+
+    api.open_main_file_archive.assert_not_called()
+    api.download_main_file.assert_not_called()
+
+
+def test_estimate_product_memory_reads_parquet_footer_by_ranges(tmp_path):
+    core = load_core_module()
+    remote_file = importlib.import_module("pzserver.remote_file")
+    path = tmp_path / "main.parquet"
+    frame = pd.DataFrame({"id": np.arange(50_000), "z": np.linspace(0, 1, 50_000)})
+    frame.to_parquet(path, compression="zstd")
+    content = path.read_bytes()
+    remote = remote_file.RemoteFile(
+        lambda start, end: content[start : end + 1], len(content)
+    )
+    api = mock.Mock()
+    api.open_main_file_archive.return_value = remote
+    server = make_server_with_api(core, api)
+    metadata = base_metadata({"extension": ".parquet", "size": len(content)})
+    server.get_product_metadata = mock.Mock(return_value=metadata)
+
+    estimate = server.estimate_product_memory("crc", return_type="arrow")
+
+    assert estimate["source"] == "footer"
+    assert estimate["n_rows"] == 50_000
+    assert estimate["columns"]["z"] >= 8 * 50_000
+    assert remote.bytes_fetched < len(content) / 2
+
+
+def test_estimate_product_memory_skips_footer_of_archive_not_ready():
+    core = load_core_module()
+    api = mock.Mock()
+    api.open_main_file_archive.side_effect = requests.exceptions.RequestException(
+        "Product main file is still being prepared. Please try again later."
+    )
+    server = make_server_with_api(core, api)
+    metadata = base_metadata({"extension": ".parquet", "size": 10**9})
+    server.get_product_metadata = mock.Mock(return_value=metadata)
+
+    assert server.estimate_product_memory("crc") is None
+    _args, kwargs = api.open_main_file_archive.call_args
+    product_files = sys.modules["pzserver.product_files"]
+    assert kwargs["timeout"] == product_files.FOOTER_ARCHIVE_TIMEOUT
+
+
+def test_get_product_spills_products_over_memory_budget(tmp_path):
+    core = load_core_module()
+    path = tmp_path / "main.csv"
+    frame = pd.DataFrame(
+        {
+            "id": np.arange(1000),
+            "ra": np.linspace(0, 10, 1000),
+            "dec": np.linspace(-5, 5, 1000),
+            "z": np.linspace(0, 1, 1000),
+            "name": [f"obj{i}" for i in range(1000)],
+        }
+    )
+    frame.to_csv(path, index=False)
+    api = mock.Mock()
+    api.download_main_file.return_value = {"success": True, "message": str(path)}
+    server = make_server_with_api(core, api)
+    server.memory_budget = 1024
+    server.spill_directory = str(tmp_path / "spill")
+    metadata = estimated_metadata(1000)
+    metadata["main_file"].update(
+        {"extension": ".csv", "name": "main.csv", "has_header": True}
+    )
+    server.get_product_metadata = mock.Mock(return_value=metadata)
+
+    with pytest.raises(ValueError, match="estimated to use"):
+        server.get_product("big_crc", return_type="pandas")
+
+    result = server.get_product("big_crc", return_type="pandas", spill=True)
+
+    assert isinstance(result["z"].to_numpy().base, np.memmap)
+    assert result["z"].dtype == np.float32
+    np.testing.assert_allclose(result["z"], frame["z"], rtol=1e-6)
+    assert list(result["name"]) == list(frame["name"])
+    assert not list((tmp_path / "spill").iterdir())
+
+
+def test_get_product_maps_parsed_table_from_product_cache(tmp_path):
+    core = load_core_module()
+    frame = pd.DataFrame(
+        {"id": np.arange(100), "z": np.linspace(0, 1, 100), "name": ["a"] * 100}
+    )
+
+    def download_main_file(_id, destination):
+        path = Path(destination) / "main.csv"
+        frame.to_csv(path, index=False)
+        return {"success": True, "message": str(path)}
+
+    api = mock.Mock()
+    api.download_main_file.side_effect = download_main_file
+    server = make_server_with_api(core, api)
+    server.cache = core.ProductCache(tmp_path / "cache")
+    metadata = base_metadata(
+        {"extension": ".csv", "name": "main.csv", "has_header": True, "size": 1}
+    )
+    server.get_product_metadata = mock.Mock(return_value=metadata)
+
+    first = server.get_product(42)
+
+    with mock.patch.object(core, "read_main_table", side_effect=AssertionError):
+        second = server.get_product(42, return_type="pandas")
+        selected = server.get_product(42, columns=["z"], filters="id >= 90")
+
+    assert list(first["z"]) == list(second["z"])
+    assert isinstance(second["z"].to_numpy().base, np.memmap)
+    assert list(second["name"]) == ["a"] * 100
+    assert selected.colnames == ["z"]
+    assert list(selected["z"]) == list(frame["z"][90:])
+    api.download_main_file.assert_called_once()
+
+
+def make_many_products_server(core, tmp_path):
+    frames = {
+        1: pd.DataFrame({"id": np.arange(10), "z": np.linspace(0, 1, 10)}),
+        2: pd.DataFrame({"id": np.arange(5), "z": np.linspace(1, 2, 5)}),
+    }
+
+    def download_main_file(_id, destination):
+        path = Path(destination) / f"main{_id}.parquet"
+        frames[_id].to_parquet(path)
+        return {"success": True, "message": str(path)}
+
+    def get_product_metadata(product_id):
+        if product_id == "missing":
+            raise ValueError("product not found.")
+        metadata = base_metadata(
+            {"extension": ".parquet", "name": "main.parquet", "size": 1}
+        )
+        metadata["id"] = product_id
+        return metadata
+
+    api = mock.Mock()
+    api.download_main_file.side_effect = download_main_file
+    server = make_server_with_api(core, api)
+    server.cache = core.ProductCache(tmp_path / "cache")
+    server.get_product_metadata = get_product_metadata
+    return server, frames
+
+
+def test_get_products_many_reports_failures_without_aborting(tmp_path):
+    core = load_core_module()
+    server, frames = make_many_products_server(core, tmp_path)
+
+    results = {
+        product_id: (data, error)
+        for product_id, data, error in server.get_products_many(
+            [1, "missing", 2], memory_budget=1, return_type="pandas", parse_processes=0
+        )
+    }
+
+    assert isinstance(results["missing"][1], ValueError)
+    assert results["missing"][0] is None
+    for product_id, frame in frames.items():
+        data, error = results[product_id]
+        assert error is None
+        assert list(data["z"]) == list(frame["z"])
+    # main files and parsed tables
+    assert server.cache.stats()["entries"] == 4
+
+
+def test_get_products_many_parses_in_worker_processes(tmp_path, monkeypatch):
+    core = load_core_module()
+    monkeypatch.syspath_prepend(str(Path(__file__).parents[2] / "src"))
+    server, frames = make_many_products_server(core, tmp_path)
+
+    results = list(
+        server.get_products_many([1, 2], columns=["z"], filters="z > 0.5")
+    )
+
+    assert {product_id for product_id, _, _ in results} == {1, 2}
+    for product_id, data, error in results:
+        assert error is None
+        expected = frames[product_id]["z"]
+        assert list(data["z"]) == list(expected[expected > 0.5])
+        assert data.colnames == ["z"]
+
+
+def test_get_products_many_stops_queued_downloads_when_closed(tmp_path):
+    core = load_core_module()
+    server, _frames = make_many_products_server(core, tmp_path)
+
+    results = server.get_products_many(
+        ["missing", 1, 2, 1, 2], max_workers=1, parse_processes=0
+    )
+    product_id, _data, error = next(results)
+    results.close()
+
+    assert product_id == "missing"
+    assert isinstance(error, ValueError)
+    assert server.api.download_main_file.call_count <= 1
+
+
+def test_product_cache_is_opt_in(local_server):
+    core = load_core_module()
+    local_server.route(
+        "GET", "/api/", lambda _request, _body: (200, {}, b'{"products": "..."}')
+    )
+    url = f"{local_server.url}/api/"
+
+    assert core.PzServer("token", url).cache is None
+    assert isinstance(core.PzServer("token", url, cache=True).cache, core.ProductCache)
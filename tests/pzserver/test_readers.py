@@ -0,0 +1,337 @@
+"""
+Tests for the streaming readers of product main files.
+"""
+
+from unittest import mock
+
+import h5py
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from conftest import load_module
+
+
+def sample_frame(rows=10):
+    return pd.DataFrame(
+        {"id": np.arange(rows), "z": np.linspace(0, 1, rows), "flag": np.ones(rows)}
+    )
+
+
+def test_parquet_batches_have_bounded_size_and_selected_columns(tmp_path):
+    readers = load_module("readers")
+    path = tmp_path / "main.parquet"
+    pq.write_table(pa.Table.from_pandas(sample_frame()), path, row_group_size=3)
+
+    batches = list(readers.iter_file_batches(path, batch_size=4, columns=["id", "z"]))
+
+    assert [batch.num_rows for batch in batches] == [4, 4, 2]
+    assert batches[0].schema.names == ["id", "z"]
+    assert pa.Table.from_batches(batches).column("id").to_pylist() == list(range(10))
+
+
+def test_csv_batches_use_main_file_info(tmp_path):
+    readers = load_module("readers")
+    path = tmp_path / "main.csv"
+    sample_frame().to_csv(path, sep=";", header=False, index=False)
+    main_file = {"delimiter": ";", "has_header": False, "columns": ["id", "z", "flag"]}
+
+    batches = list(
+        readers.iter_file_batches(path, batch_size=3, columns=["z"], main_file=main_file)
+    )
+
+    assert [batch.num_rows for batch in batches] == [3, 3, 3, 1]
+    assert batches[0].schema.names == ["z"]
+
+
+def test_whole_and_batched_readers_agree_on_csv_files(tmp_path):
+    readers = load_module("readers")
+    path = tmp_path / "main.dat"
+    sample_frame().to_csv(path, index=False)
+
+    for main_file in (None, {"extension": ".dat"}):
+        table = readers.read_main_table(path, main_file)
+        batches = list(readers.iter_file_batches(path, main_file=main_file))
+        assert table.equals(pa.Table.from_batches(batches))
+
+
+def test_hdf5_batches_from_column_datasets_and_pandas_tables(tmp_path):
+    readers = load_module("readers")
+    frame = sample_frame()
+    columns_path = tmp_path / "columns.hdf5"
+    with h5py.File(columns_path, "w") as h5file:
+        group = h5file.create_group("photometry")
+        for name in frame.columns:
+            group.create_dataset(name, data=frame[name].to_numpy())
+    table_path = tmp_path / "table.h5"
+    frame.to_hdf(table_path, key="data", format="table")
+
+    for path in (columns_path, table_path):
+        batches = list(readers.iter_file_batches(path, batch_size=4, columns=["z"]))
+        assert [batch.num_rows for batch in batches] == [4, 4, 2]
+        assert pa.Table.from_batches(batches).column("z").to_pylist() == list(frame.z)
+
+
+def test_pz_server_streams_product_batches(tmp_path):
+    core = load_module("core")
+    path = tmp_path / "main.csv"
+    sample_frame().to_csv(path, index=False)
+    api = mock.Mock()
+    api.download_main_file.return_value = {"success": True, "message": str(path)}
+    server = object.__new__(core.PzServer)
+    server.api = api
+    server.get_product_metadata = mock.Mock(
+        return_value={
+            "id": 42,
+            "main_file": {"extension": ".csv", "has_header": True, "size": 10**12},
+        }
+    )
+
+    chunks = list(server.iter_product_batches(42, batch_size=6, as_pandas=True))
+
+    assert [len(chunk) for chunk in chunks] == [6, 4]
+    assert list(chunks[0].columns) == ["id", "z", "flag"]
+
+
+MAIN_FILE = {
+    "columns": ["id", "z", "flag"],
+    "columns_association": [
+        {"column_name": "id", "ucd": "meta.id;meta.main", "alias": "id"},
+        {"column_name": "z", "ucd": "src.redshift", "alias": "z"},
+    ],
+}
+
+
+def test_parse_filters_resolves_ucds_and_literals():
+    readers = load_module("readers")
+
+    filters = readers.parse_filters(
+        ["src.redshift < 0.5", ("meta.id", "in", "[1, 2]"), "flag = 1"], MAIN_FILE
+    )
+
+    assert filters == [("z", "<", 0.5), ("id", "in", [1, 2]), ("flag", "==", 1)]
+
+
+def test_parquet_filters_are_pushed_down_to_row_groups(tmp_path):
+    readers = load_module("readers")
+    path = tmp_path / "main.parquet"
+    pq.write_table(pa.Table.from_pandas(sample_frame()), path, row_group_size=3)
+
+    batches = list(
+        readers.iter_file_batches(
+            path, columns=["meta.id"], main_file=MAIN_FILE, filters="src.redshift > 0.6"
+        )
+    )
+
+    table = pa.Table.from_batches(batches)
+    assert table.schema.names == ["id"]
+    assert table.column("id").to_pylist() == [6, 7, 8, 9]
+
+
+def test_csv_filters_are_applied_per_chunk(tmp_path):
+    readers = load_module("readers")
+    path = tmp_path / "main.csv"
+    sample_frame().to_csv(path, index=False)
+
+    batches = list(
+        readers.iter_file_batches(
+            path, batch_size=3, columns=["id"], filters=[("z", ">=", 0.5)]
+        )
+    )
+
+    assert all(batch.schema.names == ["id"] for batch in batches)
+    assert pa.Table.from_batches(batches).column("id").to_pylist() == [5, 6, 7, 8, 9]
+
+
+def test_get_product_reads_selected_columns_and_rows(tmp_path):
+    core = load_module("core")
+    path = tmp_path / "main.parquet"
+    pq.write_table(pa.Table.from_pandas(sample_frame()), path)
+    api = mock.Mock()
+    api.download_main_file.return_value = {"success": True, "message": str(path)}
+    server = object.__new__(core.PzServer)
+    server.api = api
+    server.get_product_metadata = mock.Mock(
+        return_value={
+            "id": 42,
+            "product_type_internal_name": "redshift_catalog",
+            "main_file": dict(MAIN_FILE, extension=".parquet", size=10),
+        }
+    )
+
+    table = server.get_product(42, columns=["z"], filters="meta.id < 3")
+
+    assert table.colnames == ["z"]
+    assert len(table) == 3
+
+
+def test_hats_open_options_forward_columns_and_filters():
+    core = load_module("core")
+
+    options = core.PzServer._hats_open_options(  # pylint: disable=protected-access
+        ["ra", "z"], [["z", "<", 1]]
+    )
+
+    assert options == {"columns": ["ra", "z"], "filters": [("z", "<", 1)]}
+    assert not core.PzServer._hats_open_options(None, [])  # pylint: disable=protected-access
+
+
+def test_csv_table_uses_registered_types_and_converts_to_astropy(tmp_path):
+    readers = load_module("readers")
+    path = tmp_path / "main.csv"
+    path.write_text("1|0.5|a\n2||b\n")
+    main_file = {
+        "delimiter": "|",
+        "has_header": False,
+        "columns": ["id", "z", "name"],
+        "column_types": {"id": "int32", "z": "float", "name": "unknown"},
+    }
+
+    table = readers.to_astropy(
+        readers.read_csv_table(path, **readers.csv_options(main_file))
+    )
+
+    assert table.colnames == ["id", "z", "name"]
+    assert table["id"].dtype == np.int32
+    assert table["z"][0] == 0.5
+    assert np.isnan(table["z"][1])
+    assert table["name"].tolist() == ["a", "b"]
+
+
+def test_get_product_reads_csv_with_arrow(tmp_path):
+    core = load_module("core")
+    path = tmp_path / "main.csv"
+    sample_frame().to_csv(path, index=False)
+    api = mock.Mock()
+    api.download_main_file.return_value = {"success": True, "message": str(path)}
+    server = object.__new__(core.PzServer)
+    server.api = api
+    server.get_product_metadata = mock.Mock(
+        return_value={
+            "id": 42,
+            "product_type_internal_name": "redshift_catalog",
+            "main_file": {"extension": ".csv", "has_header": True, "size": 10},
+        }
+    )
+
+    table = server.get_product(42)
+
+    assert table.colnames == ["id", "z", "flag"]
+    assert table["id"].tolist() == list(range(10))
+
+
+def test_convert_table_returns_requested_containers():
+    readers = load_module("readers")
+    frame = sample_frame(3)
+
+    arrow = readers.convert_table(frame, "arrow")
+    assert isinstance(arrow, pa.Table)
+    assert arrow.column_names == ["id", "z", "flag"]
+
+    table = readers.convert_table(arrow, "astropy")
+    assert table.colnames == ["id", "z", "flag"]
+    assert isinstance(readers.convert_table(table, "arrow"), pa.Table)
+
+    pandas_frame = readers.convert_table(pa.Table.from_pandas(frame), "pandas")
+    pd.testing.assert_frame_equal(pandas_frame, frame)
+
+    with pytest.raises(ValueError, match="return_type"):
+        readers.convert_table(frame, "numpy")
+
+
+def test_get_product_returns_arrow_without_conversion(tmp_path):
+    core = load_module("core")
+    path = tmp_path / "main.csv"
+    sample_frame().to_csv(path, index=False)
+    api = mock.Mock()
+    api.download_main_file.return_value = {"success": True, "message": str(path)}
+    server = object.__new__(core.PzServer)
+    server.api = api
+    server.get_product_metadata = mock.Mock(
+        return_value={
+            "id": 42,
+            "product_type_internal_name": "redshift_catalog",
+            "main_file": {"extension": ".csv", "has_header": True, "size": 10},
+        }
+    )
+
+    table = server.get_product(42, return_type="arrow")
+
+    assert isinstance(table, pa.Table)
+    assert table.num_rows == 10
+
+
+def test_main_tables_are_read_with_arrow_readers(tmp_path):
+    readers = load_module("readers")
+    frame = sample_frame()
+    parquet_path = tmp_path / "main.parquet"
+    frame.to_parquet(parquet_path)
+    hdf5_path = tmp_path / "main.hdf5"
+    with h5py.File(hdf5_path, "w") as h5file:
+        for name in frame.columns:
+            h5file[name] = frame[name].to_numpy()
+
+    for path in (parquet_path, hdf5_path):
+        table = readers.read_main_table(path)
+        assert isinstance(table, pa.Table)
+        assert table.column("z").to_pylist() == frame["z"].tolist()
+
+    assert readers.read_main_table(tmp_path / "main.fits") is None
+
+
+def is_memory_mapped(array):
+    while isinstance(array, np.ndarray):
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+def test_spilled_batches_use_registered_types_and_mapped_arrays(tmp_path):
+    spill = load_module("spill")
+    table = pa.Table.from_pandas(sample_frame(), preserve_index=False)
+    main_file = {"column_types": {"z": "float32", "id": "int64"}}
+
+    spilled = spill.spill_batches(
+        table.to_batches(max_chunksize=4), main_file, tmp_path
+    )
+
+    assert spilled.schema.field("z").type == pa.float32()
+    assert spilled.schema.field("flag").type == pa.float64()
+    assert spilled.num_rows == 10
+    assert not list(tmp_path.iterdir())
+
+    result = spill.mapped_container(spilled, "astropy", tmp_path)
+    assert is_memory_mapped(result["id"].data)
+    assert list(result["id"]) == list(range(10))
+
+
+def test_spilled_batches_keep_types_of_values_out_of_range(tmp_path):
+    spill = load_module("spill")
+    batches = [
+        pa.record_batch({"z": [0.5, 1.5], "id": [1, 2]}),
+        pa.record_batch({"z": [1e300, 2.5], "id": [3, 2**40]}),
+    ]
+    main_file = {"column_types": {"z": "float32", "id": "int32"}}
+
+    spilled = spill.spill_batches(iter(batches), main_file, tmp_path)
+
+    assert spilled.schema.field("z").type == pa.float64()
+    assert spilled.schema.field("id").type == pa.int64()
+    assert spilled.column("z").to_pylist() == [0.5, 1.5, 1e300, 2.5]
+    assert spilled.column("id").to_pylist() == [1, 2, 3, 2**40]
+    assert not list(tmp_path.iterdir())
+
+
+def test_failed_spill_leaves_no_partial_file(tmp_path):
+    spill = load_module("spill")
+
+    def batches():
+        yield pa.record_batch({"z": [0.5, 1.5]})
+        raise ValueError("broken file")
+
+    with pytest.raises(ValueError, match="broken file"):
+        spill.spill_batches(batches(), None, tmp_path)
+
+    assert not list(tmp_path.iterdir())
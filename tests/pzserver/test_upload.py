@@ -0,0 +1,192 @@
+"""
+Tests for the upload of product files.
+"""
+
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from conftest import load_module
+
+
+class FakeUploadApi:
+    """Records uploads; files named in `failing` raise an error."""
+
+    def __init__(self, failing=(), delay=0.05):
+        self.failing = set(failing)
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.uploaded = []
+        self.files = []
+        self._lock = threading.Lock()
+
+    def upload_basic_info(self, *args):
+        return {"id": 1}
+
+    def upload_file(self, product_id, filepath, role, mimetype=None):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if Path(filepath).name in self.failing:
+                raise OSError("connection reset")
+            data = {"id": Path(filepath).stem, "role_name": role.capitalize()}
+            with self._lock:
+                self.uploaded.append((Path(filepath).name, role))
+                self.files.append({**data, "name": Path(filepath).name})
+            return data
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def registry_upload(self, product_id):
+        pass
+
+    def get_by_attribute(self, *args):
+        return {
+            "results": [
+                {"id": index, "column_name": name}
+                for index, name in enumerate(["ra", "dec", "z", "mag_g"], start=10)
+            ]
+        }
+
+    def update_upload_column(self, id_attr, data):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if id_attr in self.failing:
+                raise OSError("connection reset")
+            with self._lock:
+                self.uploaded.append((id_attr, data["alias"]))
+            return {"id": id_attr, **data}
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def get(self, entity, product_id):
+        return {"id": product_id, "is_owner": True}
+
+    def get_product_files(self, product_id):
+        with self._lock:
+            return list(self.files)
+
+
+def make_files(tmp_path, names):
+    paths = []
+    for name in names:
+        path = tmp_path / name
+        path.write_text(name)
+        paths.append(str(path))
+    return paths
+
+
+def test_auxiliary_files_are_uploaded_concurrently_in_order(tmp_path):
+    upload = load_module("upload")
+    main, *aux = make_files(tmp_path, ["main.csv", "a1.txt", "a2.txt", "a3.txt"])
+    api = FakeUploadApi()
+    data = upload.UploadData(
+        name="p", product_type="x", main_file=main, auxiliary_files=aux
+    )
+
+    pz_upload = upload.PzUpload(data, api, max_workers=3)
+
+    assert api.uploaded[0] == ("main.csv", "main")
+    assert api.max_active == 3
+    assert pz_upload.files_id == ["main", "a1", "a2", "a3"]
+
+
+def test_failed_auxiliary_files_keep_successful_uploads(tmp_path):
+    upload = load_module("upload")
+    main, *aux = make_files(tmp_path, ["main.csv", "a1.txt", "a2.txt", "a3.txt"])
+    api = FakeUploadApi(failing={"a2.txt"})
+    data = upload.UploadData(
+        name="p", product_type="x", main_file=main, auxiliary_files=aux
+    )
+
+    with pytest.raises(upload.UploadError) as excinfo:
+        upload.PzUpload(data, api)
+
+    error = excinfo.value
+    assert error.files_id == ["main", "a1", "a3"]
+    assert list(error.errors) == [aux[1]]
+    assert isinstance(error.errors[aux[1]], OSError)
+
+    api.failing.clear()
+    error.upload.add_auxiliary_files(list(error.errors), update=False)
+    assert error.upload.files_id == ["main", "a1", "a3", "a2"]
+
+
+def test_product_attaches_files_concurrently(tmp_path):
+    product = load_module("product")
+    upload = load_module("upload")
+    aux = make_files(tmp_path, ["a1.txt", "a2.txt", "a3.txt"])
+    api = FakeUploadApi(failing={"a3.txt"})
+    pz_product = product.PzProduct(1, api)
+
+    with pytest.raises(upload.UploadError) as excinfo:
+        pz_product.attach_auxiliary_files(aux, max_workers=2)
+
+    assert excinfo.value.files_id == ["a1", "a2"]
+    assert api.max_active == 2
+    # the files are listed again from the server after the uploads
+    names = sorted(f["name"] for f in pz_product.get_auxiliary_files())
+    assert names == ["a1.txt", "a2.txt"]
+
+
+def make_upload(tmp_path, api):
+    upload = load_module("upload")
+    (main,) = make_files(tmp_path, ["main.csv"])
+    data = upload.UploadData(name="p", product_type="redshift_catalog", main_file=main)
+    pz_upload = upload.PzUpload(data, api)
+    api.uploaded.clear()
+    api.max_active = 0
+    return pz_upload, upload
+
+
+def test_columns_association_is_sent_concurrently_and_only_the_delta(tmp_path):
+    api = FakeUploadApi()
+    pz_upload, _ = make_upload(tmp_path, api)
+
+    pz_upload.make_columns_association({"ra": "RA", "dec": "Dec", "z": "z"})
+
+    assert sorted(api.uploaded) == [(10, "RA"), (11, "Dec"), (12, "z")]
+    assert api.max_active == 3
+    assert pz_upload.check_required_columns()["success"] is True
+
+    api.uploaded.clear()
+    pz_upload.make_columns_association({"ra": "RA", "dec": "Dec", "z": "z_err"})
+
+    assert api.uploaded == [(12, "z_err")]
+    assert pz_upload.check_required_columns()["success"] is False
+
+
+def test_reset_only_touches_associated_columns(tmp_path):
+    api = FakeUploadApi()
+    pz_upload, _ = make_upload(tmp_path, api)
+    pz_upload.make_columns_association({"ra": "RA", "mag_g": "mag_g"})
+    api.uploaded.clear()
+
+    pz_upload.reset_columns_association()
+    pz_upload.reset_columns_association()
+
+    assert sorted(api.uploaded) == [(10, ""), (13, "")]
+
+
+def test_failed_column_updates_keep_the_others(tmp_path):
+    api = FakeUploadApi()
+    pz_upload, upload = make_upload(tmp_path, api)
+    api.failing = {11}
+
+    with pytest.raises(upload.ColumnsAssociationError) as excinfo:
+        pz_upload.make_columns_association({"ra": "RA", "dec": "Dec"})
+
+    assert list(excinfo.value.errors) == ["dec"]
+    api.failing.clear()
+    api.uploaded.clear()
+    pz_upload.make_columns_association({"ra": "RA", "dec": "Dec"})
+    assert api.uploaded == [(11, "Dec")]